@@ -76,6 +76,13 @@ enum ConvertedType {
    * 2 digits over).
    */
   DECIMAL = 5;
+
+  /**
+   * Signed integers of 8 and 16 bits, stored as INT32. The numbering matches the
+   * ConvertedType values of the Parquet format.
+   */
+  INT_8 = 15;
+  INT_16 = 16;
 }
 
 /**
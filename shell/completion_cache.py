@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# A local cache of database, table and column names for TAB completion.
+#
+# Completion never waits for the impalad. It is answered from the names in the cache,
+# which are kept sorted so that the names with a given prefix are found by binary
+# search, however many tables there are. Names that are missing or older than the TTL
+# are fetched by a background thread over a session of its own, with SHOW DATABASES,
+# SHOW TABLES and DESCRIBE, and are available for the next completion. Expired names
+# are still used until they are replaced. Columns are only fetched for the tables that
+# a statement being completed refers to.
+#
+# DDL statements executed in the shell update the cached names directly, e.g. CREATE
+# TABLE adds the table and ALTER TABLE forgets the columns of the table, instead of
+# fetching the whole list of tables again.
+
+import re
+import threading
+import time
+
+from bisect import bisect_left, insort
+from Queue import Queue
+
+# Matches DDL statements that create, drop or alter a table, view or database.
+DDL_PATTERN = re.compile(
+    r'^\s*(?P<verb>create|drop|alter)\s+(?:external\s+)?'
+    r'(?P<kind>table|view|database|schema)\s+(?:if\s+(?:not\s+)?exists\s+)?'
+    r'(?P<name>[\w`.]+)(?:.*?\brename\s+to\s+(?P<new_name>[\w`.]+))?', re.I | re.S)
+# Matches INVALIDATE METADATA and REFRESH statements.
+INVALIDATE_PATTERN = re.compile(
+    r'^\s*(?:invalidate\s+metadata|refresh)(?:\s+(?P<name>[\w`.]+))?', re.I)
+# Matches the tables that a statement refers to.
+TABLE_REFERENCE_PATTERN = re.compile(
+    r'\b(?:from|join|into|table|update|describe|desc)\s+([\w`.]+)', re.I)
+
+
+class CachedNames(object):
+  """A sorted list of lower case names, and when it was fetched."""
+
+  def __init__(self, names):
+    self.names = sorted(set([name.lower() for name in names]))
+    self.fetch_time = time.time()
+
+  def get_with_prefix(self, prefix):
+    prefix = prefix.lower()
+    names = []
+    for i in xrange(bisect_left(self.names, prefix), len(self.names)):
+      if not self.names[i].startswith(prefix):
+        break
+      names.append(self.names[i])
+    return names
+
+  def __contains__(self, name):
+    name = name.lower()
+    i = bisect_left(self.names, name)
+    return i < len(self.names) and self.names[i] == name
+
+  def add(self, name):
+    if name not in self:
+      insort(self.names, name.lower())
+
+  def remove(self, name):
+    name = name.lower()
+    i = bisect_left(self.names, name)
+    if i < len(self.names) and self.names[i] == name:
+      del self.names[i]
+
+
+def split_table_name(name, current_db):
+  """Returns the database and table of the table 'name', which may be qualified."""
+  parts = name.replace('`', '').lower().split('.')
+  if len(parts) == 1:
+    return current_db.lower(), parts[0]
+  return parts[0], parts[1]
+
+
+class CompletionCache(object):
+  """Caches the names used for completion. 'client_factory' must return a new
+  ImpalaClient that is already connected. Cached names expire after 'ttl_s' seconds."""
+
+  # Maximum number of tables whose columns are cached.
+  MAX_COLUMN_TABLES = 10000
+
+  def __init__(self, client_factory, ttl_s):
+    self.client_factory = client_factory
+    self.ttl_s = ttl_s
+    # Protects the cached names, which are read by the shell and written by the worker.
+    self.lock = threading.Lock()
+    self.databases = None
+    # The tables by database, and the columns by (database, table).
+    self.tables = {}
+    self.columns = {}
+    # The keys of the names that are fetched, see _request().
+    self.requests = Queue()
+    self.pending = set()
+    self.worker = None
+    self.client = None
+
+  def prefetch(self, db):
+    """Fetches the databases and the tables of 'db' in the background, if they are not
+    cached yet or expired."""
+    self._get_names(('databases',))
+    self._get_names(('tables', db.lower()))
+
+  def complete(self, text, line, current_db):
+    """Returns the names that complete 'text' in the statement 'line', in database
+    'current_db'. Never blocks."""
+    text = text.replace('`', '')
+    if '.' in text:
+      qualifier, prefix = text.rsplit('.', 1)
+      parts = qualifier.lower().split('.')
+      if len(parts) == 1:
+        # The qualifier is a database, or a table of the current database.
+        names = self._get_columns(current_db.lower(), parts[0]).get_with_prefix(prefix)
+        if parts[0] in self._get_names(('databases',)):
+          names += self._get_names(('tables', parts[0])).get_with_prefix(prefix)
+      else:
+        names = self._get_columns(parts[0], parts[1]).get_with_prefix(prefix)
+      return ['%s.%s' % (qualifier, name) for name in names]
+    names = self._get_names(('databases',)).get_with_prefix(text)
+    names += self._get_names(('tables', current_db.lower())).get_with_prefix(text)
+    for table_name in TABLE_REFERENCE_PATTERN.findall(line):
+      names += self._get_columns(*split_table_name(table_name, current_db)
+                                 ).get_with_prefix(text)
+    return sorted(set(names))
+
+  def invalidate(self, statement, current_db):
+    """Updates the cache after 'statement' was executed in database 'current_db'."""
+    match = DDL_PATTERN.match(statement)
+    if match is not None:
+      verb, kind = match.group('verb').lower(), match.group('kind').lower()
+      if kind in ('database', 'schema'):
+        self._invalidate_database(verb, match.group('name').replace('`', '').lower())
+      else:
+        if match.group('new_name'):
+          # The table was renamed.
+          verb = 'drop'
+          self._invalidate_table('create',
+                                 *split_table_name(match.group('new_name'), current_db))
+        self._invalidate_table(verb, *split_table_name(match.group('name'), current_db))
+      return
+    match = INVALIDATE_PATTERN.match(statement)
+    if match is None:
+      return
+    if match.group('name'):
+      self._invalidate_table('alter', *split_table_name(match.group('name'), current_db))
+    elif statement.strip().lower().startswith('invalidate'):
+      # All metadata may have changed.
+      self.lock.acquire()
+      try:
+        self.databases = None
+        self.tables = {}
+        self.columns = {}
+      finally:
+        self.lock.release()
+      self.prefetch(current_db)
+
+  def reset(self):
+    """Forgets all names and closes the session, e.g. after connecting to another
+    impalad. Fetches that are in progress complete normally."""
+    self.lock.acquire()
+    try:
+      self.databases = None
+      self.tables = {}
+      self.columns = {}
+    finally:
+      self.lock.release()
+    self.requests.put('reconnect')
+
+  def close(self):
+    if self.worker is not None:
+      self.requests.put(None)
+      self.worker.join()
+      self.worker = None
+
+  def _invalidate_database(self, verb, db):
+    self.lock.acquire()
+    try:
+      if verb == 'create' and self.databases is not None:
+        self.databases.add(db)
+      elif verb == 'drop':
+        if self.databases is not None:
+          self.databases.remove(db)
+        self.tables.pop(db, None)
+        for key in [key for key in self.columns if key[0] == db]:
+          del self.columns[key]
+    finally:
+      self.lock.release()
+
+  def _invalidate_table(self, verb, db, table):
+    self.lock.acquire()
+    try:
+      tables = self.tables.get(db)
+      if verb == 'create' and tables is not None:
+        tables.add(table)
+      elif verb == 'drop' and tables is not None:
+        tables.remove(table)
+      self.columns.pop((db, table), None)
+    finally:
+      self.lock.release()
+
+  def _get_columns(self, db, table):
+    """Like _get_names() for the columns of a table, which are only requested if the
+    table is known, so that e.g. table aliases are not looked up."""
+    if table and table in self._get_names(('tables', db)):
+      return self._get_names(('columns', db, table))
+    return CachedNames([])
+
+  def _get_names(self, key):
+    """Returns the cached names for 'key', and requests them if they are missing or
+    expired."""
+    self.lock.acquire()
+    try:
+      if key[0] == 'databases':
+        names = self.databases
+      elif key[0] == 'tables':
+        names = self.tables.get(key[1])
+      else:
+        names = self.columns.get(key[1:])
+    finally:
+      self.lock.release()
+    if names is None or time.time() - names.fetch_time > self.ttl_s:
+      self._request(key)
+    return names or CachedNames([])
+
+  def _request(self, key):
+    if key in self.pending:
+      return
+    self.pending.add(key)
+    self.requests.put(key)
+    if self.worker is None:
+      self.worker = threading.Thread(target=self._run_worker, name="Completion cache")
+      self.worker.daemon = True
+      self.worker.start()
+
+  def _run_worker(self):
+    try:
+      while True:
+        key = self.requests.get()
+        if key is None:
+          return
+        if key == 'reconnect':
+          self._close_client()
+          continue
+        try:
+          names = self._fetch(key)
+        except Exception:
+          # E.g. the table does not exist. It is not looked up again before the names
+          # expire. The session is reopened in case it was lost.
+          names = []
+          self._close_client()
+        self.lock.acquire()
+        try:
+          self._store(key, CachedNames(names))
+        finally:
+          self.lock.release()
+        self.pending.discard(key)
+    finally:
+      self._close_client()
+
+  def _fetch(self, key):
+    if key[0] == 'databases':
+      sql = 'show databases'
+    elif key[0] == 'tables':
+      sql = 'show tables in `%s`' % key[1]
+    else:
+      sql = 'describe `%s`.`%s`' % key[1:]
+    if self.client is None:
+      self.client = self.client_factory()
+    query_handle = self.client.execute_query(self.client.create_beeswax_query(sql, {}))
+    try:
+      # The name is the first column of the result of each of the statements.
+      return [row[0] for rows in self.client.fetch(query_handle) for row in rows]
+    finally:
+      self.client.close_query(query_handle)
+
+  def _store(self, key, names):
+    if key[0] == 'databases':
+      self.databases = names
+    elif key[0] == 'tables':
+      self.tables[key[1]] = names
+    else:
+      if len(self.columns) >= self.MAX_COLUMN_TABLES:
+        # Forget the columns that were fetched first.
+        oldest = sorted(self.columns, key=lambda key: self.columns[key].fetch_time)
+        for old_key in oldest[:len(oldest) / 2]:
+          del self.columns[old_key]
+      self.columns[key[1:]] = names
+
+  def _close_client(self):
+    if self.client is not None:
+      try:
+        self.client.close_connection()
+      except Exception:
+        pass
+      self.client = None
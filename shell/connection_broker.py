@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# A connection broker keeps connections to impalads open, including their transport
+# setup and SASL negotiation, and lends them to short-lived shells.
+#
+# A shell connects to the broker's unix socket and sends a handshake line with the
+# impalad it wants to talk to. The broker replies with a line that is either 'OK' or
+# 'ERROR <message>'. After 'OK', the shell speaks the Thrift binary protocol over the
+# unix socket as if it was connected to the impalad, and the broker relays every message
+# to an idle connection to that impalad, and every reply back. The relay is aware of
+# message boundaries, so a connection is only reused if the shell disconnected between
+# two RPCs. Since every connection has its own session, the current database is reset
+# before a connection is lent to the next shell. Query options are not part of the
+# session, the shell sends them with every query. A shell that disconnects while one of
+# its queries is still open, e.g. because it was killed, does not return the connection:
+# it is closed, which closes the queries of its session on the impalad.
+#
+# The unix socket is only accessible by the user that runs the broker, and every shell
+# that can connect to it uses the broker's credentials.
+
+import os
+import socket
+import threading
+import time
+
+from thrift.Thrift import TMessageType, TType
+from thrift.protocol import TBinaryProtocol
+from thrift.transport.TSocket import TServerSocket, TSocket
+from thrift.transport.TTransport import (TBufferedTransport, TTransportBase,
+    TTransportException)
+
+HANDSHAKE_OK = 'OK'
+HANDSHAKE_ERROR = 'ERROR'
+# Maximum length of a handshake line.
+MAX_LINE_LENGTH = 1024
+
+# RPCs that execute statements, which may change the database of the session.
+SESSION_CHANGING_RPCS = frozenset(['query', 'executeAndWait'])
+# RPCs that open a query, and that close one, in both Beeswax and HiveServer2.
+QUERY_OPENING_RPCS = frozenset(['query', 'executeAndWait', 'ExecuteStatement'])
+QUERY_CLOSING_RPCS = frozenset(['close', 'CloseInsert', 'CloseOperation'])
+
+
+def read_line(sock):
+  """Reads a line from the socket 'sock', one byte at a time so that nothing after the
+  line is consumed. Returns the line without its newline."""
+  chars = []
+  while len(chars) < MAX_LINE_LENGTH:
+    char = sock.recv(1)
+    if not char:
+      raise TTransportException(TTransportException.END_OF_FILE,
+                                "Connection closed during handshake")
+    if char == '\n':
+      return ''.join(chars)
+    chars.append(char)
+  raise TTransportException(message="Handshake line too long")
+
+
+class BrokerSocket(TSocket):
+  """A TSocket that is connected to a connection broker. Opening it borrows a connection
+  to 'impalad', a (host, port) tuple, from the broker listening on 'socket_path'."""
+
+  def __init__(self, socket_path, impalad):
+    TSocket.__init__(self, unix_socket=socket_path)
+    self.impalad = impalad
+
+  def open(self):
+    TSocket.open(self)
+    try:
+      self.handle.sendall('%s:%s\n' % self.impalad)
+      reply = read_line(self.handle)
+    except socket.error, e:
+      self.close()
+      raise TTransportException(TTransportException.NOT_OPEN, str(e))
+    if reply != HANDSHAKE_OK:
+      self.close()
+      raise TTransportException(TTransportException.NOT_OPEN,
+                                reply[len(HANDSHAKE_ERROR):].strip())
+
+
+class RecordingTransport(TTransportBase):
+  """Wraps a transport and records the bytes read from it, so that a message can be
+  parsed and then relayed unchanged."""
+
+  def __init__(self, transport):
+    self.transport = transport
+    self.recorded = []
+
+  def read(self, sz):
+    data = self.transport.read(sz)
+    self.recorded.append(data)
+    return data
+
+  def has_recorded(self):
+    return len(self.recorded) > 0
+
+  def take_recorded(self):
+    """Returns the bytes read since the last call and stops recording them."""
+    data = ''.join(self.recorded)
+    self.recorded = []
+    return data
+
+
+def relay_message(protocol, transport, destination):
+  """Reads a message with 'protocol' from the RecordingTransport 'transport' and writes
+  it to the transport 'destination'. Returns the name and type of the message, and the
+  id of the first field of its body, or None if it has no fields. The result of a
+  successful call is field 0 of a reply, or no field if the call returns nothing."""
+  name, message_type, _ = protocol.readMessageBegin()
+  first_field_id = None
+  protocol.readStructBegin()
+  while True:
+    _, field_type, field_id = protocol.readFieldBegin()
+    if field_type == TType.STOP:
+      break
+    if first_field_id is None:
+      first_field_id = field_id
+    protocol.skip(field_type)
+    protocol.readFieldEnd()
+  protocol.readStructEnd()
+  protocol.readMessageEnd()
+  destination.write(transport.take_recorded())
+  destination.flush()
+  return name, message_type, first_field_id
+
+
+class ConnectionBroker(object):
+  """Lends connections to impalads to shells that connect to the unix socket
+  'socket_path'.
+
+  'client_factory' is called with a (host, port) tuple and returns a connected
+  ImpalaClient. Up to 'max_idle_connections' idle connections are kept for every impalad,
+  and closed once they were idle for 'idle_timeout_s' seconds.
+  """
+
+  # Idle connections older than this many seconds are pinged before they are lent.
+  VALIDATE_AFTER_S = 10
+
+  def __init__(self, socket_path, client_factory, max_idle_connections=8,
+               idle_timeout_s=600):
+    self.socket_path = socket_path
+    self.client_factory = client_factory
+    self.max_idle_connections = max_idle_connections
+    self.idle_timeout_s = idle_timeout_s
+    # Maps (host, port) to a list of (time it became idle, ImpalaClient) tuples, the most
+    # recently used last.
+    self.idle_connections = {}
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+    self.server_socket = None
+
+  def serve_forever(self):
+    """Accepts shells until close() is called."""
+    self.server_socket = TServerSocket(unix_socket=self.socket_path)
+    # Only the user running the broker may use its connections.
+    old_umask = os.umask(0077)
+    try:
+      self.server_socket.listen()
+    finally:
+      os.umask(old_umask)
+    reaper = threading.Thread(target=self._close_expired_connections,
+                              name="Idle connection reaper")
+    reaper.daemon = True
+    reaper.start()
+    while not self.stopped.is_set():
+      try:
+        client_socket = self.server_socket.accept()
+      except (socket.error, TTransportException):
+        if self.stopped.is_set():
+          break
+        raise
+      handler = threading.Thread(target=self._serve_shell, args=(client_socket,),
+                                 name="Connection broker handler")
+      handler.daemon = True
+      handler.start()
+
+  def close(self):
+    """Stops accepting shells and closes all idle connections."""
+    self.stopped.set()
+    if self.server_socket is not None:
+      self.server_socket.close()
+      try:
+        os.remove(self.socket_path)
+      except OSError:
+        pass
+    self.lock.acquire()
+    try:
+      idle_connections, self.idle_connections = self.idle_connections, {}
+    finally:
+      self.lock.release()
+    for connections in idle_connections.values():
+      for _, client in connections:
+        client.close_connection()
+
+  def _serve_shell(self, client_socket):
+    """Lends a connection to the shell connected to 'client_socket' until it
+    disconnects."""
+    upstream = None
+    try:
+      try:
+        host, port = read_line(client_socket.handle).rsplit(':', 1)
+        impalad = (host, port)
+        upstream = self._borrow(impalad)
+      except Exception, e:
+        try:
+          client_socket.handle.sendall('%s %s\n' % (HANDSHAKE_ERROR, e))
+        except socket.error:
+          pass
+        return
+      try:
+        client_socket.handle.sendall(HANDSHAKE_OK + '\n')
+      except socket.error:
+        return
+      reusable, session_changed = self._relay(TBufferedTransport(client_socket), upstream)
+      if reusable and session_changed:
+        reusable = self._reset_session(upstream)
+      if reusable:
+        self._give_back(impalad, upstream)
+        upstream = None
+    finally:
+      client_socket.close()
+      if upstream is not None:
+        upstream.close_connection()
+
+  def _relay(self, downstream, upstream):
+    """Relays RPCs from the shell's transport 'downstream' to the ImpalaClient 'upstream'
+    until the shell disconnects. Returns a tuple of whether the connection may be reused,
+    and whether the shell executed statements in its session. The connection may not be
+    reused if the shell left queries open."""
+    requests = RecordingTransport(downstream)
+    request_protocol = TBinaryProtocol.TBinaryProtocol(requests)
+    responses = RecordingTransport(upstream.transport)
+    response_protocol = TBinaryProtocol.TBinaryProtocol(responses)
+    session_changed = False
+    # The number of queries opened by the shell that it did not close. A HiveServer2
+    # statement that failed counts as open, unless the shell closes it.
+    num_open_queries = 0
+    while True:
+      try:
+        name, message_type, _ = relay_message(request_protocol, requests,
+                                              upstream.transport)
+      except (TTransportException, socket.error, EOFError):
+        # The shell disconnected. Unless it was in the middle of sending a request or
+        # left a query open, the connection is idle.
+        return not requests.has_recorded() and num_open_queries == 0, session_changed
+      except Exception:
+        return False, session_changed
+      if name in SESSION_CHANGING_RPCS:
+        session_changed = True
+      if message_type == TMessageType.ONEWAY:
+        continue
+      try:
+        _, reply_type, field_id = relay_message(response_protocol, responses, downstream)
+      except Exception:
+        return False, session_changed
+      if reply_type != TMessageType.REPLY:
+        continue
+      if name in QUERY_OPENING_RPCS and field_id == 0:
+        num_open_queries += 1
+      elif name in QUERY_CLOSING_RPCS and field_id in (None, 0):
+        num_open_queries = max(num_open_queries - 1, 0)
+
+  def _reset_session(self, client):
+    """Makes 'default' the current database of the session of 'client' again. Returns
+    False if that failed."""
+    try:
+      query = client.create_beeswax_query("use default", {})
+      handle = client.execute_query(query)
+      client.wait_to_finish(handle)
+      client.close_query(handle)
+      return True
+    except Exception:
+      return False
+
+  def _borrow(self, impalad):
+    """Returns an idle connection to 'impalad', or a new one if there is none."""
+    while True:
+      self.lock.acquire()
+      try:
+        connections = self.idle_connections.get(impalad)
+        if not connections:
+          break
+        idle_since, client = connections.pop()
+      finally:
+        self.lock.release()
+      if time.time() - idle_since < self.VALIDATE_AFTER_S:
+        return client
+      try:
+        client.test_connection()
+        return client
+      except Exception:
+        # The impalad may have been restarted.
+        client.close_connection()
+    return self.client_factory(impalad)
+
+  def _give_back(self, impalad, client):
+    self.lock.acquire()
+    try:
+      connections = self.idle_connections.setdefault(impalad, [])
+      if len(connections) < self.max_idle_connections:
+        connections.append((time.time(), client))
+        return
+    finally:
+      self.lock.release()
+    client.close_connection()
+
+  def _close_expired_connections(self):
+    while True:
+      self.stopped.wait(min(self.idle_timeout_s, 60))
+      if self.stopped.is_set():
+        return
+      expired = []
+      deadline = time.time() - self.idle_timeout_s
+      self.lock.acquire()
+      try:
+        for impalad, connections in self.idle_connections.items():
+          expired.extend([client for idle_since, client in connections
+                          if idle_since < deadline])
+          self.idle_connections[impalad] = [(idle_since, client)
+              for idle_since, client in connections if idle_since >= deadline]
+      finally:
+        self.lock.release()
+      for client in expired:
+        client.close_connection()
@@ -338,13 +338,115 @@ class Lexer(object):
                     break
 
 
+class FastLexer(Lexer):
+    """
+    Lexer that produces the same tokens as :class:`Lexer`. Instead of trying
+    the rules of the current state one after another at every position, it
+    combines them into a single precompiled regular expression per state and
+    tokenizes the input in one pass.
+    """
+
+    def _get_state_matchers(self):
+        """
+        Returns a dict mapping each state to the match function of its
+        combined expression and a dict mapping the group of each rule in that
+        expression to the rule's action and new state.
+        """
+        cls = type(self)
+        if '_state_matchers' not in cls.__dict__:
+            matchers = {}
+            for state, tokenlist in self._tokens.items():
+                alternatives = []
+                rules = {}
+                group = 1
+                for rexmatch, action, new_state in tokenlist:
+                    rex = rexmatch.__self__
+                    # Alternatives are tried in order, so the first rule that
+                    # matches wins, like in Lexer.
+                    alternatives.append('(%s)' % rex.pattern)
+                    rules[group] = (action, new_state)
+                    group += 1 + rex.groups
+                matchers[state] = (re.compile('|'.join(alternatives),
+                                              self.flags).match, rules)
+            cls._state_matchers = matchers
+        return cls._state_matchers
+
+    def get_tokens_unprocessed(self, stream, stack=('root',)):
+        """
+        Split ``text`` into (tokentype, text) pairs.
+
+        ``stack`` is the inital stack (default: ``['root']``)
+        """
+        pos = 0
+        matchers = self._get_state_matchers()
+        statestack = list(stack)
+        statematch, staterules = matchers[statestack[-1]]
+        known_names = {}
+
+        text = stream.read()
+        text = self._decode(text)
+
+        while 1:
+            m = statematch(text, pos)
+            if m:
+                # The group of the matching rule is the outermost, and
+                # therefore the last, group that matched.
+                action, new_state = staterules[m.lastindex]
+                value = m.group()
+                if value in known_names:
+                    yield pos, known_names[value], value
+                elif type(action) is tokens._TokenType:
+                    yield pos, action, value
+                else:
+                    ttype, value = action(value)
+                    known_names[value] = ttype
+                    yield pos, ttype, value
+                pos = m.end()
+                if new_state is not None:
+                    # state transition
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == '#pop':
+                                statestack.pop()
+                            elif state == '#push':
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        # pop
+                        del statestack[new_state:]
+                    elif new_state == '#push':
+                        statestack.append(statestack[-1])
+                    else:
+                        assert False, "wrong state def: %r" % new_state
+                    statematch, staterules = matchers[statestack[-1]]
+            else:
+                try:
+                    if text[pos] == '\n':
+                        # at EOL, reset state to "root"
+                        pos += 1
+                        statestack = ['root']
+                        statematch, staterules = matchers['root']
+                        yield pos, tokens.Text, u'\n'
+                        continue
+                    yield pos, tokens.Error, text[pos]
+                    pos += 1
+                except IndexError:
+                    break
+
+
+# The lexer used by tokenize(), and therefore by parse(), split() and
+# format(). Set it to Lexer to use the original rule by rule lexer.
+DEFAULT_LEXER = FastLexer
+
+
 def tokenize(sql, encoding=None):
     """Tokenize sql.
 
-    Tokenize *sql* using the :class:`Lexer` and return a 2-tuple stream
-    of ``(token type, value)`` items.
+    Tokenize *sql* using the :data:`DEFAULT_LEXER` and return a 2-tuple
+    stream of ``(token type, value)`` items.
     """
-    lexer = Lexer()
+    lexer = DEFAULT_LEXER()
     if encoding is not None:
         lexer.encoding = encoding
     return lexer.get_tokens(sql)
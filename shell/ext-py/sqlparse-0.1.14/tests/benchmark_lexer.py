@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares the speed of Lexer and FastLexer on large statements.
+
+Usage: python tests/benchmark_lexer.py [-n ITERATIONS] [FILE ...]
+
+Without FILE arguments, the statements in tests/files and a generated
+multi-row INSERT ... VALUES statement are used.
+"""
+
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlparse.lexer import Lexer, FastLexer
+from tests.utils import FILES_DIR
+
+
+def generated_insert(num_rows):
+    rows = ["(%d, 'name %d', %d.5, NULL, -- row %d\n now())" % (i, i, i, i)
+            for i in range(num_rows)]
+    return 'INSERT INTO t /* generated */ VALUES %s;' % ',\n'.join(rows)
+
+
+def time_lexer(lexer_class, sql, iterations):
+    best = None
+    for _ in range(iterations):
+        start = time.time()
+        for _ in lexer_class().get_tokens(sql):
+            pass
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [OPTIONS] [FILE, ...]')
+    parser.add_option('-n', '--iterations', dest='iterations', type='int',
+                      default=5, help='runs per input, the fastest counts')
+    options, args = parser.parse_args()
+    if args:
+        inputs = [(path, open(path).read()) for path in args]
+    else:
+        inputs = [(name, open(os.path.join(FILES_DIR, name)).read())
+                  for name in sorted(os.listdir(FILES_DIR))]
+        inputs.append(('<INSERT with 10000 rows>', generated_insert(10000)))
+    print '%-30s %10s %10s %10s %8s' % ('input', 'bytes', 'Lexer', 'FastLexer',
+                                        'speedup')
+    for name, sql in inputs:
+        assert (list(Lexer().get_tokens(sql)) ==
+                list(FastLexer().get_tokens(sql))), name
+        slow = time_lexer(Lexer, sql, options.iterations)
+        fast = time_lexer(FastLexer, sql, options.iterations)
+        print '%-30s %10d %9.4fs %9.4fs %7.1fx' % (
+            name[:30], len(sql), slow, fast, slow / max(fast, 1e-9))
+
+
+if __name__ == '__main__':
+    main()
@@ -188,3 +188,22 @@ def test_parse_endifloop():
     p = sqlparse.parse('END  LOOP')[0]
     assert len(p.tokens) == 1
     assert p.tokens[0].ttype is Keyword
+
+
+@pytest.mark.parametrize('filename', ['begintag.sql', 'dashcomment.sql',
+                                      'function_psql.sql', 'huge_select.sql',
+                                      'test_cp1251.sql'])
+def test_fast_lexer_same_tokens_as_lexer(filename):
+    from tests.utils import load_file
+    sql = load_file(filename, 'cp1251' if 'cp1251' in filename else 'utf-8')
+    assert (list(lexer.FastLexer().get_tokens(sql)) ==
+            list(lexer.Lexer().get_tokens(sql)))
+
+
+@pytest.mark.parametrize('sql', ["select 'a''b', \"c\\\"d\", `e``f` from x",
+                                 'select /* a /* b */ c */ 1 -- d',
+                                 'select 1.5e3, -0x1F, $1, :x from [y]\n',
+                                 "a\n'unterminated\nb"])
+def test_fast_lexer_same_tokens_as_lexer_on_edge_cases(sql):
+    assert (list(lexer.FastLexer().get_tokens(sql)) ==
+            list(lexer.Lexer().get_tokens(sql)))
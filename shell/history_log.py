@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# The on-disk log of the statements executed in interactive shells.
+#
+# The log consists of two append-only files: the data file holds the text of the
+# statements, one after the other, and the index file holds a fixed size record per
+# statement with its id, its offset and length in the data file, when it was executed,
+# how long it took and whether it failed. Statements are appended as they complete, so
+# no history is lost if a shell dies, and the shell never reads or rewrites the whole
+# history: the last statements and ranges of ids are located through the index.
+#
+# Once the data file grows beyond its maximum size, the oldest statements are dropped
+# by rewriting the newest half of the log into new files, which replace the old ones.
+# Statement ids keep increasing, so they remain valid. Several shells may share the
+# log, appends and compactions are serialized with a lock on the index file.
+
+import os
+import re
+import struct
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+# id, offset, length, start time, elapsed seconds (negative if unknown), flags.
+INDEX_RECORD = struct.Struct('<QQIdfB')
+# Flags of an entry.
+FLAG_FAILED = 1
+FLAG_TRUNCATED = 2
+
+
+class HistoryEntry(object):
+  """A statement in the history log."""
+
+  def __init__(self, entry_id, start_time, elapsed_secs, flags, statement):
+    self.id = entry_id
+    self.start_time = start_time
+    # None if not known, e.g. for statements imported from the old history file.
+    self.elapsed_secs = elapsed_secs
+    self.failed = bool(flags & FLAG_FAILED)
+    # Statements longer than the maximum entry size are only partially stored.
+    self.truncated = bool(flags & FLAG_TRUNCATED)
+    self.statement = statement
+
+
+class HistoryLog(object):
+  """The history log with data file 'path' and index file 'path'.idx. The oldest
+  statements are dropped once the data file is larger than 'max_bytes'."""
+
+  # Statements longer than this are truncated.
+  MAX_ENTRY_BYTES = 1024 * 1024
+
+  def __init__(self, path, max_bytes):
+    self.path = path
+    self.index_path = path + '.idx'
+    self.max_bytes = max_bytes
+
+  def exists(self):
+    return os.path.exists(self.index_path)
+
+  def append(self, statement, start_time, elapsed_secs=None, failed=False):
+    """Appends the utf-8 encoded 'statement'. Returns the id of the new entry."""
+    flags = failed and FLAG_FAILED or 0
+    if len(statement) > self.MAX_ENTRY_BYTES:
+      statement = statement[:self.MAX_ENTRY_BYTES]
+      flags |= FLAG_TRUNCATED
+    if elapsed_secs is None:
+      elapsed_secs = -1.0
+    index = self._open_index(True)
+    try:
+      index.seek(0, os.SEEK_END)
+      num_records = index.tell() / INDEX_RECORD.size
+      entry_id = 1
+      if num_records:
+        entry_id = self._read_records(index, num_records - 1, 1)[0][0] + 1
+      data = open(self.path, 'ab')
+      try:
+        data.seek(0, os.SEEK_END)
+        offset = data.tell()
+        # Statements are separated by newlines, which keeps the data file readable.
+        data.write(statement + '\n')
+      finally:
+        data.close()
+      # A partial record, left by a shell that died while appending, is overwritten.
+      index.truncate(num_records * INDEX_RECORD.size)
+      index.seek(num_records * INDEX_RECORD.size)
+      index.write(INDEX_RECORD.pack(entry_id, offset, len(statement), start_time,
+                                    elapsed_secs, flags))
+      index.flush()
+      if offset + len(statement) > self.max_bytes:
+        self._compact(index)
+      return entry_id
+    finally:
+      index.close()
+
+  def get_last(self, num_entries):
+    """Returns the last 'num_entries' entries, oldest first."""
+    index = self._open_index(False)
+    if index is None:
+      return []
+    try:
+      num_records = self._get_num_records(index)
+      first = max(0, num_records - num_entries)
+      return self._read_entries(self._read_records(index, first, num_records - first))
+    finally:
+      index.close()
+
+  def get_range(self, first_id, last_id):
+    """Returns the entries with ids from 'first_id' to 'last_id', both included. Entries
+    that were dropped from the log are missing."""
+    index = self._open_index(False)
+    if index is None:
+      return []
+    try:
+      num_records = self._get_num_records(index)
+      first = self._find_record(index, num_records, first_id)
+      last = self._find_record(index, num_records, last_id + 1)
+      return self._read_entries(self._read_records(index, first, last - first))
+    finally:
+      index.close()
+
+  def search(self, pattern):
+    """Returns the entries whose statement matches the regular expression 'pattern',
+    ignoring case."""
+    regex = re.compile(pattern, re.I)
+    index = self._open_index(False)
+    if index is None:
+      return []
+    try:
+      records = self._read_records(index, 0, self._get_num_records(index))
+    finally:
+      index.close()
+    return [entry for entry in self._read_entries(records)
+            if regex.search(entry.statement)]
+
+  def _open_index(self, for_write):
+    """Opens the index file and locks it, exclusively if 'for_write'. Returns None if
+    there is no log to read."""
+    while True:
+      if for_write:
+        index = open(self.index_path, 'a+b')
+      elif not os.path.exists(self.index_path):
+        return None
+      else:
+        index = open(self.index_path, 'rb')
+      if fcntl is None:
+        return index
+      fcntl.flock(index.fileno(), for_write and fcntl.LOCK_EX or fcntl.LOCK_SH)
+      # The log may have been compacted while waiting for the lock, in which case the
+      # file that was opened is not the index anymore.
+      try:
+        if os.fstat(index.fileno()).st_ino == os.stat(self.index_path).st_ino:
+          return index
+      except OSError:
+        pass
+      index.close()
+
+  def _get_num_records(self, index):
+    index.seek(0, os.SEEK_END)
+    return index.tell() / INDEX_RECORD.size
+
+  def _read_records(self, index, first, num_records):
+    index.seek(first * INDEX_RECORD.size)
+    data = index.read(num_records * INDEX_RECORD.size)
+    return [INDEX_RECORD.unpack_from(data, i * INDEX_RECORD.size)
+            for i in xrange(len(data) / INDEX_RECORD.size)]
+
+  def _find_record(self, index, num_records, entry_id):
+    """Returns the position of the first record with an id of at least 'entry_id'."""
+    low, high = 0, num_records
+    while low < high:
+      middle = (low + high) / 2
+      if self._read_records(index, middle, 1)[0][0] < entry_id:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def _read_entries(self, records):
+    if not records:
+      return []
+    entries = []
+    data = open(self.path, 'rb')
+    try:
+      for entry_id, offset, length, start_time, elapsed_secs, flags in records:
+        data.seek(offset)
+        if elapsed_secs < 0:
+          elapsed_secs = None
+        entries.append(HistoryEntry(entry_id, start_time, elapsed_secs, flags,
+                                    data.read(length)))
+    finally:
+      data.close()
+    return entries
+
+  def _compact(self, index):
+    """Rewrites the newest entries that take up to half of the maximum size into new
+    files, which replace the log. Called with 'index' locked exclusively."""
+    num_records = self._get_num_records(index)
+    records = self._read_records(index, 0, num_records)
+    kept_bytes = 0
+    first = num_records
+    # The last entry is always kept, so that ids keep increasing.
+    while first > 0 and (first == num_records or
+                         kept_bytes + records[first - 1][2] <= self.max_bytes / 2):
+      first -= 1
+      kept_bytes += records[first][2] + 1
+    entries = self._read_entries(records[first:])
+    suffix = '.%d.tmp' % os.getpid()
+    new_data = open(self.path + suffix, 'wb')
+    new_index = open(self.index_path + suffix, 'wb')
+    try:
+      for entry, record in zip(entries, records[first:]):
+        new_index.write(INDEX_RECORD.pack(entry.id, new_data.tell(), len(entry.statement),
+                                          entry.start_time, record[4], record[5]))
+        new_data.write(entry.statement + '\n')
+    finally:
+      new_data.close()
+      new_index.close()
+    # The data file is replaced first. Readers hold the lock on the old index, and
+    # check that they locked the current index before they read the data file.
+    os.rename(self.path + suffix, self.path)
+    os.rename(self.index_path + suffix, self.index_path)
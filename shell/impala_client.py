@@ -17,19 +17,21 @@
 # specific language governing permissions and limitations
 # under the License.
 
-import sasl
+import threading
 import time
 
+from Queue import Empty, Full, Queue
 from beeswaxd import BeeswaxService
 from beeswaxd.BeeswaxService import QueryState
 from ExecStats.ttypes import TExecStats
 from ImpalaService import ImpalaService
 from ErrorCodes.ttypes import TErrorCode
+from shell_output import ColumnarBatch
 from Status.ttypes import TStatus
 from thrift.protocol import TBinaryProtocol
-from thrift_sasl import TSaslClientTransport
 from thrift.transport.TSocket import TSocket
-from thrift.transport.TTransport import TBufferedTransport, TTransportException
+from thrift.transport.TTransport import (TBufferedTransport, TTransportBase,
+    TTransportException)
 from thrift.Thrift import TApplicationException
 
 class RpcStatus:
@@ -55,11 +57,56 @@ class DisconnectedException(Exception):
   def __str__(self):
       return self.value
 
+class CountingTransport(TTransportBase):
+  """Wraps a transport and counts the bytes sent and received through it."""
+
+  def __init__(self, transport):
+    self.transport = transport
+    self.bytes_sent = 0
+    self.bytes_received = 0
+
+  def isOpen(self):
+    return self.transport.isOpen()
+
+  def open(self):
+    self.transport.open()
+
+  def close(self):
+    self.transport.close()
+
+  def read(self, sz):
+    data = self.transport.read(sz)
+    self.bytes_received += len(data)
+    return data
+
+  def write(self, buf):
+    self.bytes_sent += len(buf)
+    self.transport.write(buf)
+
+  def flush(self):
+    self.transport.flush()
+
+
 class ImpalaClient(object):
 
+  # Seconds to block on the prefetch queue before re-checking it. Bounded waits keep the
+  # calling thread responsive to signals (e.g. Ctrl+C) while a fetch RPC is in flight.
+  PREFETCH_QUEUE_TIMEOUT_S = 0.1
+
+  # Bounds of the interval, in seconds, between two polls of the query state.
+  MIN_POLL_INTERVAL_S = 0.01
+  MAX_POLL_INTERVAL_S = 1.0
+  # Factor by which the poll interval grows after each poll.
+  POLL_BACKOFF_FACTOR = 1.5
+  # Once the poll interval reaches this value, the query's scan progress is used to
+  # estimate the remaining time and shorten the interval if the query is almost done.
+  PROGRESS_ESTIMATE_THRESHOLD_S = 0.25
+  # Minimum time in seconds between two checks of the scan progress while polling.
+  PROGRESS_CHECK_INTERVAL_S = 5.0
+
   def __init__(self, impalad, use_kerberos=False, kerberos_service_name="impala",
                use_ssl=False, ca_cert=None, user=None, ldap_password=None,
-               use_ldap=False):
+               use_ldap=False, connection_broker=None):
     self.connected = False
     self.impalad = impalad
     self.imp_service = None
@@ -70,9 +117,23 @@ class ImpalaClient(object):
     self.ca_cert = ca_cert
     self.user, self.ldap_password = user, ldap_password
     self.use_ldap = use_ldap
+    # The unix socket of a connection broker to borrow connections from, if any.
+    self.connection_broker = connection_broker
+    # Set if a connection broker was configured but a connection could not be borrowed
+    # from it, in which case a direct connection is used.
+    self.connection_broker_error = None
     self.default_query_options = {}
     self.query_state = QueryState._NAMES_TO_VALUES
     self.fetch_batch_size = 1024
+    # Serializes RPCs on the shared transport, since result prefetching issues RPCs from
+    # a background thread. The Ctrl+C handler must not issue RPCs over this client: it
+    # runs in the main thread, possibly while an RPC is in progress, and would either
+    # block on the lock held by the prefetch thread or deadlock on its own.
+    self.rpc_lock = threading.Lock()
+    # The number of RPCs issued and the seconds spent in them, see get_rpc_stats().
+    self.num_rpcs = 0
+    self.rpc_secs = 0.0
+    self.counting_transport = None
 
   def _options_to_string_list(self, set_query_options):
     return ["%s=%s" % (k, v) for (k, v) in set_query_options.iteritems()]
@@ -223,19 +284,42 @@ class ImpalaClient(object):
 
     The instance of the impala service is then pinged to
     test the connection and get back the server version
+
+    If a connection broker is configured, an already established connection is borrowed
+    from it. If that is not possible, a new connection is opened.
     """
+    self._open_transport()
+    self.imp_service = ImpalaService.Client(self._new_protocol())
+    result = self.ping_impala_service()
+    self.connected = True
+    return result
+
+  def _open_transport(self):
     if self.transport is not None:
       self.transport.close()
       self.transport = None
 
     self.connected = False
-    self.transport = self._get_transport()
-    self.transport.open()
-    protocol = TBinaryProtocol.TBinaryProtocol(self.transport)
-    self.imp_service = ImpalaService.Client(protocol)
-    result = self.ping_impala_service()
-    self.connected = True
-    return result
+    self.connection_broker_error = None
+    if self.connection_broker is not None:
+      self.transport = self._get_broker_transport()
+    if self.transport is None:
+      self.transport = self._get_transport()
+      self.transport.open()
+
+  def _new_protocol(self):
+    """Returns the protocol for RPCs over the open transport."""
+    self.counting_transport = CountingTransport(self.transport)
+    return TBinaryProtocol.TBinaryProtocol(self.counting_transport)
+
+  def get_rpc_stats(self):
+    """Returns the number of RPCs issued so far, the seconds spent in them, and the
+    bytes sent and received over the current connection."""
+    bytes_sent, bytes_received = 0, 0
+    if self.counting_transport is not None:
+      bytes_sent = self.counting_transport.bytes_sent
+      bytes_received = self.counting_transport.bytes_received
+    return self.num_rpcs, self.rpc_secs, bytes_sent, bytes_received
 
   def ping_impala_service(self):
     return self.imp_service.PingImpalaService()
@@ -271,6 +355,10 @@ class ImpalaClient(object):
       sock = TSocket(host, port)
     if not (self.use_ldap or self.use_kerberos):
       return TBufferedTransport(sock)
+    # The sasl module is only imported if it is needed, since loading it also loads
+    # pkg_resources, which slows down the startup of the shell.
+    import sasl
+    from thrift_sasl import TSaslClientTransport
     # Initializes a sasl client
     def sasl_factory():
       sasl_client = sasl.Client()
@@ -288,6 +376,18 @@ class ImpalaClient(object):
     else:
       return TSaslClientTransport(sasl_factory, "PLAIN", sock)
 
+  def _get_broker_transport(self):
+    """Returns an open transport to a connection borrowed from the connection broker, or
+    None if the broker is not available."""
+    from connection_broker import BrokerSocket
+    transport = TBufferedTransport(BrokerSocket(self.connection_broker, self.impalad))
+    try:
+      transport.open()
+    except TTransportException, e:
+      self.connection_broker_error = str(e)
+      return None
+    return transport
+
   def create_beeswax_query(self, query_str, set_query_options):
     """Create a beeswax query object from a query string"""
     query = BeeswaxService.Query()
@@ -304,7 +404,17 @@ class ImpalaClient(object):
     return last_query_handle
 
   def wait_to_finish(self, last_query_handle, periodic_callback=None):
+    """Polls the query state until the query has finished. The poll interval starts small
+    so that short queries are not delayed, and then backs off adaptively (see
+    _get_sleep_interval()).
+
+    Statements that return rows do not need to be polled: the first fetch() blocks on the
+    server until results are available, so callers can skip this method for them.
+    """
     loop_start = time.time()
+    backoff_interval = self.MIN_POLL_INTERVAL_S
+    # When the scan progress was last checked, and the end time estimated from it.
+    estimate = [0.0, None]
     while True:
       query_state = self.get_query_state(last_query_handle)
       if query_state == self.query_state["FINISHED"]:
@@ -316,31 +426,87 @@ class ImpalaClient(object):
           raise DisconnectedException("Not connected to impalad.")
 
       if periodic_callback is not None: periodic_callback()
-      time.sleep(self._get_sleep_interval(loop_start))
+      backoff_interval = min(backoff_interval * self.POLL_BACKOFF_FACTOR,
+                             self.MAX_POLL_INTERVAL_S)
+      time.sleep(self._get_sleep_interval(loop_start, last_query_handle,
+                                          backoff_interval, estimate))
+
+  def _fetch_batch(self, query_handle):
+    """Issues a single fetch RPC. Returns the fetched rows, split into columns, and
+    whether more rows are available."""
+    rpc_result = self._do_rpc(
+      lambda: self.imp_service.fetch(query_handle, False,
+                                     self.fetch_batch_size))
+    result, status = rpc_result
+    if status != RpcStatus.OK:
+      raise RPCException()
+    return [row.split('\t') for row in result.data], result.has_more
 
   def fetch(self, query_handle):
     """Fetch all the results.
-    This function returns a generator to create an iterable of the result rows.
+    This function returns a generator to create an iterable of the result rows. Each
+    element is the list of rows returned by a single fetch RPC, so rows are streamed to
+    the caller as soon as they arrive rather than being accumulated. Empty intermediate
+    batches are skipped, but the last batch is always returned, so callers see at least
+    one (possibly empty) batch.
+
+    The first fetch RPC is issued from the calling thread. It blocks on the server until
+    the query is ready to return rows, so it doubles as a wait for the query to finish.
+    The remaining fetch RPCs are issued by a background thread, which requests the next
+    batch while the caller is still processing the current one. At most one batch is
+    queued ahead of the caller, so memory usage stays bounded regardless of the result
+    size.
     """
-    result_rows = []
-    while True:
-      rpc_result = self._do_rpc(
-        lambda: self.imp_service.fetch(query_handle, False,
-                                       self.fetch_batch_size))
-
-      result, status = rpc_result
-
-      if status != RpcStatus.OK:
-        raise RPCException()
+    rows, has_more = self._fetch_batch(query_handle)
+    while not rows and has_more:
+      rows, has_more = self._fetch_batch(query_handle)
+    if not has_more:
+      yield rows
+      return
 
-      result_rows.extend(result.data)
+    batches = Queue(maxsize=1)
+    done = threading.Event()
+
+    def enqueue(item):
+      # Give up if the consumer went away, e.g. because the generator was closed early.
+      while not done.is_set():
+        try:
+          batches.put(item, True, self.PREFETCH_QUEUE_TIMEOUT_S)
+          return True
+        except Full:
+          pass
+      return False
 
-      if len(result_rows) >= self.fetch_batch_size or not result.has_more:
-        rows = [row.split('\t') for row in result_rows]
-        result_rows = []
+    def prefetch():
+      try:
+        while not done.is_set():
+          rows, has_more = self._fetch_batch(query_handle)
+          if (rows or not has_more) and not enqueue((rows, has_more, None)):
+            return
+          if not has_more:
+            return
+      except Exception, e:
+        enqueue((None, False, e))
+
+    prefetch_thread = threading.Thread(target=prefetch, name="Result prefetch")
+    prefetch_thread.daemon = True
+    prefetch_thread.start()
+    try:
+      yield rows
+      while True:
+        try:
+          rows, has_more, error = batches.get(True, self.PREFETCH_QUEUE_TIMEOUT_S)
+        except Empty:
+          if prefetch_thread.is_alive() or not batches.empty():
+            continue
+          raise RPCException("Result prefetch thread exited unexpectedly")
+        if error is not None:
+          raise error
         yield rows
-        if not result.has_more:
+        if not has_more:
           break
+    finally:
+      done.set()
 
   def close_insert(self, last_query_handle):
     """Fetches the results of an INSERT query"""
@@ -404,7 +570,13 @@ class ImpalaClient(object):
       raise DisconnectedException("Not connected (use CONNECT to establish a connection)")
       return None, RpcStatus.ERROR
     try:
-      ret = rpc()
+      with self.rpc_lock:
+        start_time = time.time()
+        try:
+          ret = rpc()
+        finally:
+          self.num_rpcs += 1
+          self.rpc_secs += time.time() - start_time
       status = RpcStatus.OK
       # TODO: In the future more advanced error detection/handling can be done based on
       # the TStatus return value. For now, just print any error(s) that were encountered
@@ -428,15 +600,49 @@ class ImpalaClient(object):
         raise RPCException("Application Exception : %s" % t)
     return None, RpcStatus.ERROR
 
-  def _get_sleep_interval(self, start_time):
-    """Returns a step function of time to sleep in seconds before polling
-    again. Maximum sleep is 1s, minimum is 0.1s"""
-    elapsed = time.time() - start_time
-    if elapsed < 10.0:
-      return 0.1
-    elif elapsed < 60.0:
-      return 0.5
-    return 1.0
+  def _get_sleep_interval(self, start_time, last_query_handle, backoff_interval,
+                          estimate):
+    """Returns the time to sleep in seconds before polling the query state again.
+
+    'backoff_interval' is the current step of the geometric backoff from
+    MIN_POLL_INTERVAL_S to MAX_POLL_INTERVAL_S; the caller grows it independently of
+    the value returned here. Once it exceeds PROGRESS_ESTIMATE_THRESHOLD_S, the scan
+    progress reported by GetExecSummary() is used to estimate when the query ends, and
+    the interval is capped at half of the remaining time, so that long intervals do not
+    overshoot the end of the query by much. The progress is checked at most every
+    PROGRESS_CHECK_INTERVAL_S seconds, and the estimate is reused in between.
+
+    'estimate' is a list of the time the progress was last checked and the estimated
+    end time of the query, or None if it cannot be estimated, and is updated by this
+    method.
+    """
+    if backoff_interval < self.PROGRESS_ESTIMATE_THRESHOLD_S:
+      return backoff_interval
+    now = time.time()
+    if now - estimate[0] >= self.PROGRESS_CHECK_INTERVAL_S:
+      estimate[0] = now
+      estimate[1] = self._estimate_end_time(start_time, last_query_handle, now)
+    # An estimated end time that passed already proved to be wrong.
+    if estimate[1] is None or estimate[1] <= now:
+      return backoff_interval
+    return max(self.MIN_POLL_INTERVAL_S, min(backoff_interval, (estimate[1] - now) / 2))
+
+  def _estimate_end_time(self, start_time, last_query_handle, now):
+    """Returns when the query is expected to end, extrapolated from the fraction of its
+    scan ranges that completed since 'start_time', or None if that is not possible. No
+    estimate is made once all scan ranges have completed, since the query may keep
+    running for a long time after its scans are done."""
+    try:
+      summary = self.get_summary(last_query_handle)
+    except RPCException:
+      return None
+    if summary is None or not summary.progress:
+      return None
+    completed = summary.progress.num_completed_scan_ranges
+    total = summary.progress.total_scan_ranges
+    if not completed or not total or completed >= total:
+      return None
+    return now + (now - start_time) * (total - completed) / float(completed)
 
   def get_column_names(self, last_query_handle):
     rpc_result = self._do_rpc(
@@ -445,6 +651,14 @@ class ImpalaClient(object):
     if not metadata is None:
       return [fs.name for fs in metadata.schema.fieldSchemas]
 
+  def get_column_types(self, last_query_handle):
+    """Returns the type names of the result columns, e.g. 'int' or 'decimal(10,2)'."""
+    rpc_result = self._do_rpc(
+        lambda: self.imp_service.get_results_metadata(last_query_handle))
+    metadata, _ = rpc_result
+    if not metadata is None:
+      return [fs.type for fs in metadata.schema.fieldSchemas]
+
   def expect_result_metadata(self, query_str):
     """ Given a query string, return True if impalad expects result metadata"""
     excluded_query_types = ['use', 'alter', 'drop']
@@ -463,3 +677,213 @@ class ImpalaClient(object):
     if log and log.strip():
       return "WARNINGS: %s" % log
     return ""
+
+
+class HS2QueryHandle(object):
+  """The handle of a query executed over HiveServer2."""
+
+  def __init__(self, operation_handle):
+    self.operation_handle = operation_handle
+    # The query id, as it is shown by the impalad, from the two little-endian halves of
+    # the operation id.
+    guid = operation_handle.operationId.guid
+    self.id = '%s:%s' % (guid[7::-1].encode('hex'), guid[15:7:-1].encode('hex'))
+
+
+class ImpalaHS2Client(ImpalaClient):
+  """An ImpalaClient that talks to the HiveServer2 service of an impalad instead of
+  Beeswax.
+
+  Results are fetched with FetchResults() in columnar form and returned as
+  ColumnarBatches. Values keep their types until they are formatted, so they are never
+  joined into tab separated rows on the server and split again on the client, which
+  also keeps values with embedded tabs intact.
+
+  HiveServer2 does not report the number of rows inserted by a statement, so
+  close_insert() returns None.
+  """
+
+  # The fields of TColumn, exactly one of which is set, depending on the column type.
+  COLUMN_FIELDS = ['boolVal', 'byteVal', 'i16Val', 'i32Val', 'i64Val', 'doubleVal',
+                   'stringVal', 'binaryVal']
+
+  def __init__(self, *args, **kwargs):
+    ImpalaClient.__init__(self, *args, **kwargs)
+    # The HiveServer2 types are only imported if HiveServer2 is used, so that shells
+    # that use Beeswax do not load them at startup.
+    from ImpalaService import ttypes as impala_service
+    from TCLIService import ttypes as cli_service
+    self.impala_service = impala_service
+    self.cli_service = cli_service
+    self.session_handle = None
+    # The default query options of the session, and the address of the web server.
+    self.session_configuration = {}
+    self.operation_states = {
+        self.cli_service.TOperationState.FINISHED_STATE: self.query_state["FINISHED"],
+        self.cli_service.TOperationState.CANCELED_STATE: self.query_state["EXCEPTION"],
+        self.cli_service.TOperationState.CLOSED_STATE: self.query_state["EXCEPTION"],
+        self.cli_service.TOperationState.ERROR_STATE: self.query_state["EXCEPTION"],
+        self.cli_service.TOperationState.UKNOWN_STATE: self.query_state["EXCEPTION"]}
+
+  def connect(self):
+    """Creates a connection to the HiveServer2 service of an impalad and opens a session.
+    Returns the server version and the address of its web server."""
+    # The service is only needed, and imported, if HiveServer2 is used.
+    from ImpalaService import ImpalaHiveServer2Service
+    self._open_transport()
+    self.imp_service = ImpalaHiveServer2Service.Client(self._new_protocol())
+    request = self.cli_service.TOpenSessionReq(
+        client_protocol=self.cli_service.TProtocolVersion.HIVE_CLI_SERVICE_PROTOCOL_V6,
+        username=self.user, configuration={})
+    response = self._check_status(self.imp_service.OpenSession(request))
+    self.session_handle = response.sessionHandle
+    self.session_configuration = response.configuration or {}
+    self.connected = True
+    webserver_address = self.session_configuration.get("http_addr")
+    if webserver_address is not None:
+      webserver_address = "http://" + webserver_address
+    return self.impala_service.TPingImpalaServiceResp(
+        version=self.ping_impala_service(), webserver_address=webserver_address)
+
+  def ping_impala_service(self):
+    request = self.cli_service.TGetInfoReq(sessionHandle=self.session_handle,
+        infoType=self.cli_service.TGetInfoType.CLI_DBMS_VER)
+    response = self._do_hs2_rpc(lambda: self.imp_service.GetInfo(request))
+    return response.infoValue.stringValue
+
+  def test_connection(self):
+    if self.connected:
+      self.ping_impala_service()
+
+  def close_connection(self):
+    if self.connected and self.session_handle is not None:
+      try:
+        self.imp_service.CloseSession(
+            self.cli_service.TCloseSessionReq(sessionHandle=self.session_handle))
+      except Exception:
+        # The session is closed with the connection anyway.
+        pass
+    self.session_handle = None
+    ImpalaClient.close_connection(self)
+
+  def build_default_query_options_dict(self):
+    for key, value in self.session_configuration.iteritems():
+      if key != "http_addr":
+        self.default_query_options[key.upper()] = value
+
+  def execute_query(self, query):
+    conf_overlay = dict([option.split("=", 1) for option in query.configuration])
+    request = self.cli_service.TExecuteStatementReq(sessionHandle=self.session_handle,
+        statement=query.query, confOverlay=conf_overlay, runAsync=True)
+    response = self._do_hs2_rpc(lambda: self.imp_service.ExecuteStatement(request))
+    return HS2QueryHandle(response.operationHandle)
+
+  def _fetch_batch(self, query_handle):
+    request = self.cli_service.TFetchResultsReq(
+        operationHandle=query_handle.operation_handle,
+        orientation=self.cli_service.TFetchOrientation.FETCH_NEXT,
+        maxRows=self.fetch_batch_size)
+    response = self._do_hs2_rpc(lambda: self.imp_service.FetchResults(request))
+    columns = map(self._decode_column, response.results.columns or [])
+    num_rows = columns and len(columns[0]) or 0
+    return ColumnarBatch(columns, num_rows), response.hasMoreRows
+
+  def _decode_column(self, column):
+    """Returns the values of the TColumn 'column' as a list, with None for NULLs."""
+    for field in self.COLUMN_FIELDS:
+      typed_column = getattr(column, field)
+      if typed_column is not None:
+        break
+    values = typed_column.values
+    nulls = typed_column.nulls
+    # Bit i of the bitmap is set if value i is NULL. Most columns have no NULLs.
+    if nulls and nulls.strip('\x00'):
+      values = list(values)
+      for byte_index, byte in enumerate(nulls):
+        bits = ord(byte)
+        if not bits:
+          continue
+        for bit in xrange(8):
+          index = byte_index * 8 + bit
+          if bits & (1 << bit) and index < len(values):
+            values[index] = None
+    return values
+
+  def close_insert(self, last_query_handle):
+    self.close_query(last_query_handle)
+    return None
+
+  def close_query(self, last_query_handle, query_handle_closed=False):
+    if query_handle_closed:
+      return True
+    request = self.cli_service.TCloseOperationReq(
+        operationHandle=last_query_handle.operation_handle)
+    self._do_hs2_rpc(lambda: self.imp_service.CloseOperation(request))
+    return True
+
+  def cancel_query(self, last_query_handle, query_handle_closed=False):
+    if query_handle_closed:
+      return True
+    request = self.cli_service.TCancelOperationReq(
+        operationHandle=last_query_handle.operation_handle)
+    self._do_hs2_rpc(lambda: self.imp_service.CancelOperation(request))
+    return True
+
+  def get_query_state(self, last_query_handle):
+    request = self.cli_service.TGetOperationStatusReq(
+        operationHandle=last_query_handle.operation_handle)
+    response = self._do_hs2_rpc(lambda: self.imp_service.GetOperationStatus(request))
+    return self.operation_states.get(response.operationState,
+                                     self.query_state["RUNNING"])
+
+  def get_runtime_profile(self, last_query_handle):
+    request = self.impala_service.TGetRuntimeProfileReq(
+        operationHandle=last_query_handle.operation_handle,
+        sessionHandle=self.session_handle)
+    response = self._do_hs2_rpc(lambda: self.imp_service.GetRuntimeProfile(request))
+    return response.profile
+
+  def get_summary(self, last_query_handle):
+    request = self.impala_service.TGetExecSummaryReq(
+        operationHandle=last_query_handle.operation_handle,
+        sessionHandle=self.session_handle)
+    response = self._do_hs2_rpc(lambda: self.imp_service.GetExecSummary(request))
+    return response.summary
+
+  def get_column_names(self, last_query_handle):
+    request = self.cli_service.TGetResultSetMetadataReq(
+        operationHandle=last_query_handle.operation_handle)
+    response = self._do_hs2_rpc(lambda: self.imp_service.GetResultSetMetadata(request))
+    return [column.columnName for column in response.schema.columns]
+
+  def get_column_types(self, last_query_handle):
+    request = self.cli_service.TGetResultSetMetadataReq(
+        operationHandle=last_query_handle.operation_handle)
+    response = self._do_hs2_rpc(lambda: self.imp_service.GetResultSetMetadata(request))
+    # The names of the type ids are of the form INT_TYPE. Impala only returns primitive
+    # types, without their parameters.
+    return [self.cli_service.TTypeId._VALUES_TO_NAMES[
+                column.typeDesc.types[0].primitiveEntry.type][:-len('_TYPE')].lower()
+            for column in response.schema.columns]
+
+  def get_warning_log(self, last_query_handle):
+    if last_query_handle is None:
+      return "Query could not be executed"
+    request = self.cli_service.TGetLogReq(
+        operationHandle=last_query_handle.operation_handle)
+    log = self._do_hs2_rpc(lambda: self.imp_service.GetLog(request)).log
+    if log and log.strip():
+      return "WARNINGS: %s" % log
+    return ""
+
+  def _do_hs2_rpc(self, rpc):
+    """Executes the provided callable and returns its response, or raises an
+    RPCException if the response has an error status."""
+    response, _ = self._do_rpc(rpc)
+    return self._check_status(response)
+
+  def _check_status(self, response):
+    if response.status.statusCode not in (self.cli_service.TStatusCode.SUCCESS_STATUS,
+        self.cli_service.TStatusCode.SUCCESS_WITH_INFO_STATUS):
+      raise RPCException("ERROR: %s" % response.status.errorMessage)
+    return response
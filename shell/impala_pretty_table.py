@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# prettytable is slow to import, so this module is only imported once a table needs to
+# be printed.
+
+import prettytable
+
+class ImpalaPrettyTable(prettytable.PrettyTable):
+  """Patched version of PrettyTable that TODO"""
+  def _unicode(self, value):
+    if not isinstance(value, basestring):
+      value = str(value)
+    if not isinstance(value, unicode):
+      # If a value cannot be encoded, replace it with a placeholder.
+      value = unicode(value, self.encoding, "replace")
+    return value
@@ -23,30 +23,39 @@ import cmd
 import errno
 import getpass
 import os
-import prettytable
 import random
 import re
 import shlex
 import signal
 import socket
-import sqlparse
 import subprocess
 import sys
 import textwrap
+import threading
 import time
 
-from impala_client import (ImpalaClient, DisconnectedException, QueryStateException,
-                           RPCException, TApplicationException)
+from impala_client import (ImpalaClient, ImpalaHS2Client, DisconnectedException,
+                           QueryStateException, RPCException, TApplicationException)
 from impala_shell_config_defaults import impala_shell_defaults
+from itertools import chain
 from option_parser import get_option_parser, get_config_from_file
 from shell_output import DelimitedOutputFormatter, OutputStream, PrettyOutputFormatter
-from shell_output import OverwritingStdErrOutputStream
+from shell_output import OverwritingStdErrOutputStream, StreamingPrettyOutputFormatter
+from progress_refresher import ProgressRefresher
+from statement_timing import ClientProfiler, StatementTiming
+from statement_splitter import (LINE_COMMENT, StatementSplitter, decode_statement,
+                                split_statements)
 from subprocess import call
 from thrift.Thrift import TException
 
 VERSION_FORMAT = "Impala Shell v%(version)s (%(git_hash)s) built on %(build_date)s"
 VERSION_STRING = "build version not available"
 HISTORY_LENGTH = 100
+# Number of bytes read from a query file at a time.
+QUERY_FILE_CHUNK_SIZE = 64 * 1024
+# The client classes and default impalad ports of the supported protocols.
+CLIENT_CLASSES = {'beeswax': ImpalaClient, 'hs2': ImpalaHS2Client}
+DEFAULT_PORTS = {'beeswax': '21000', 'hs2': '21050'}
 
 # Tarball / packaging build makes impala_build_version available
 try:
@@ -67,16 +76,6 @@ class CmdStatus:
   ABORT = True
   ERROR = False
 
-class ImpalaPrettyTable(prettytable.PrettyTable):
-  """Patched version of PrettyTable that TODO"""
-  def _unicode(self, value):
-    if not isinstance(value, basestring):
-      value = str(value)
-    if not isinstance(value, unicode):
-      # If a value cannot be encoded, replace it with a placeholder.
-      value = unicode(value, self.encoding, "replace")
-    return value
-
 class ImpalaShell(cmd.Cmd):
   """ Simple Impala Shell.
 
@@ -96,6 +95,10 @@ class ImpalaShell(cmd.Cmd):
   CANCELLATION_MESSAGE = ' Cancelling Query'
   # Number of times to attempt cancellation before giving up.
   CANCELLATION_TRIES = 3
+  # Seconds between updates of the progress of an EXPORT command.
+  EXPORT_WAIT_INTERVAL_S = 0.5
+  # Statements that end with this are executed in the background, see job_control.py.
+  BACKGROUND_SUFFIX = '&'
   # Commands are terminated with the following delimiter.
   CMD_DELIM = ';'
   # Valid variable name pattern
@@ -118,6 +121,16 @@ class ImpalaShell(cmd.Cmd):
 
   # Minimum time in seconds between two calls to get the exec summary.
   PROGRESS_UPDATE_INTERVAL = 1.0
+  # The columns of the exec summary, see do_summary().
+  SUMMARY_COLUMN_NAMES = ["Operator", "#Hosts", "Avg Time", "Max Time", "#Rows",
+                          "Est. #Rows", "Peak Mem", "Est. Peak Mem", "Detail"]
+
+  # Commands that are sent to Impala as statements and may run concurrently in pipelined
+  # mode. All other commands wait for the previously submitted statements to finish.
+  PIPELINED_COMMANDS = frozenset(['alter', 'compute', 'create', 'delete', 'describe',
+                                  'drop', 'explain', 'insert', 'invalidate', 'load',
+                                  'refresh', 'select', 'show', 'truncate', 'update',
+                                  'upsert', 'values', 'with'])
 
   def __init__(self, options):
     cmd.Cmd.__init__(self)
@@ -131,6 +144,8 @@ class ImpalaShell(cmd.Cmd):
     self.user = options.user
     self.ldap_password = options.ldap_password
     self.use_ldap = options.use_ldap
+    self.connection_broker = options.connection_broker
+    self.protocol = options.protocol
 
     self.verbose = options.verbose
     self.prompt = ImpalaShell.DISCONNECTED_PROMPT
@@ -139,9 +154,18 @@ class ImpalaShell(cmd.Cmd):
 
     self.refresh_after_connect = options.refresh_after_connect
     self.current_db = options.default_db
+    # The history file of older versions of the shell, which is imported into the
+    # history log if there is no log yet.
     self.history_file = os.path.expanduser("~/.impalahistory")
-    # Stores the state of user input until a delimiter is seen.
-    self.partial_cmd = str()
+    self.history_log_file = os.path.expanduser("~/.impala_history_log")
+    # The raw text of the last complete command the user entered, and the start time of
+    # the command being executed, which are recorded in the history log.
+    self.last_completed_cmd = None
+    self.history_start_time = None
+    # Stores the lines of user input until a delimiter is seen.
+    self.partial_cmd = []
+    # Tracks quotes and comments in user input to detect the end of a command.
+    self.input_splitter = StatementSplitter()
     # Stores the old prompt while the user input is incomplete.
     self.cached_prompt = str()
 
@@ -151,9 +175,23 @@ class ImpalaShell(cmd.Cmd):
     self.output_file = options.output_file
     self.output_delimiter = options.output_delimiter
     self.write_delimited = options.write_delimited
+    self.output_format = options.output_format
     self.print_header = options.print_header
+    # Set once a result was written to the Parquet --output_file, which cannot hold the
+    # result of a second statement.
+    self.parquet_output_written = False
 
     self.progress_stream = OverwritingStdErrOutputStream()
+    # The StatementTiming of the last statement, see do_timing().
+    self.last_timing = None
+    self.timing_file = options.timing_file
+    self.client_profiler = None
+    if options.client_profile:
+      self.client_profiler = ClientProfiler(options.client_profile)
+    # The connection over which live progress and summary are fetched, see
+    # _start_progress_refresher(). The lock is held while it is connected or closed.
+    self.progress_client = None
+    self.progress_client_lock = threading.RLock()
 
     self.set_query_options = {}
     self.set_variables = options.variables
@@ -171,6 +209,36 @@ class ImpalaShell(cmd.Cmd):
 
     self.ignore_query_failure = options.ignore_query_failure
 
+    # Number of sessions over which statements from a query file are pipelined.
+    self.pipeline_sessions = options.pipeline_sessions
+    # The StatementPipeline used while executing a query file in pipelined mode.
+    self.pipeline = None
+    # The ParallelExport of the running EXPORT command, and the maximum number of
+    # partitions it executes at a time.
+    self.export = None
+    self.export_sessions = options.export_sessions
+    # The ParallelSource of the running SOURCE PARALLEL command.
+    self.parallel_source = None
+    # The JobManager of the statements executed in the background, created on first use.
+    self.jobs = None
+    # The job whose results are being fetched by the FETCH command.
+    self.foreground_job = None
+
+    # The local cache of query results, if enabled with --result_cache.
+    self.result_cache = None
+    # Disabled with 'cache off'.
+    self.use_result_cache = True
+    # Set while executing a statement with 'cache bypass'.
+    self.bypass_result_cache = False
+    if options.result_cache:
+      from result_cache import ResultCache
+      try:
+        self.result_cache = ResultCache(options.result_cache_dir,
+            options.result_cache_max_mb * 1024 * 1024, options.result_cache_ttl_s)
+      except (IOError, OSError), e:
+        print_to_stderr("Unable to use the result cache in %s: %s" %
+                        (options.result_cache_dir, e))
+
     # Due to a readline bug in centos/rhel7, importing it causes control characters to be
     # printed. This breaks any scripting against the shell in non-interactive mode. Since
     # the non-interactive mode does not need readline - do not import it.
@@ -185,6 +253,20 @@ class ImpalaShell(cmd.Cmd):
       except ImportError:
         self._disable_readline()
 
+    # The log of the executed statements, see history_log.py.
+    self.history_log = None
+    if self.interactive:
+      from history_log import HistoryLog
+      self.history_log = HistoryLog(self.history_log_file,
+                                    options.history_max_mb * 1024 * 1024)
+
+    # The cache of the names used for TAB completion, see completion_cache.py.
+    self.completion_cache = None
+    if self.readline and options.completion_cache_ttl_s > 0:
+      from completion_cache import CompletionCache
+      self.completion_cache = CompletionCache(self._new_pipeline_session,
+                                              options.completion_cache_ttl_s)
+
     if options.impalad is not None:
       self.do_connect(options.impalad)
 
@@ -268,6 +350,7 @@ class ImpalaShell(cmd.Cmd):
       tokens = args.strip().split(' ')
       tokens[0] = tokens[0].lower()
       return ' '.join(tokens).rstrip(ImpalaShell.CMD_DELIM)
+    self.last_completed_cmd = None
     # Handle EOF if input is interactive
     tokens = args.strip().split(' ')
     tokens[0] = tokens[0].lower()
@@ -280,7 +363,8 @@ class ImpalaShell(cmd.Cmd):
         # If a command is in progress and the user hits a Ctrl-D, clear its state
         # and reset the prompt.
         self.prompt = self.cached_prompt
-        self.partial_cmd = str()
+        self.partial_cmd = []
+        self.input_splitter.reset()
         # The print statement makes the new prompt appear in a new line.
         # Also print an extra newline to indicate that the current command has
         # been cancelled.
@@ -297,66 +381,11 @@ class ImpalaShell(cmd.Cmd):
     args = ' '.join(tokens).strip()
     return args.rstrip(ImpalaShell.CMD_DELIM)
 
-  def _shlex_split(self, line):
-    """Reimplement shlex.split() so that escaped single quotes
-    are actually escaped. shlex.split() only escapes double quotes
-    by default. This method will throw a ValueError if an open
-    quotation (either single or double) is found.
-    """
-    my_split = shlex.shlex(line, posix=True)
-    my_split.escapedquotes = '"\''
-    my_split.whitespace_split = True
-    my_split.commenters = ''
-    return list(my_split)
-
-  def _cmd_ends_with_delim(self, line):
-    """Check if the input command ends with a command delimiter.
-
-    A command ending with the delimiter and containing an open quotation character is
-    not considered terminated. If no open quotation is found, it's considered
-    terminated.
-    """
-    if line.endswith(ImpalaShell.CMD_DELIM):
-      try:
-        # Look for an open quotation in the entire command, and not just the
-        # current line.
-        if self.partial_cmd: line = '%s %s' % (self.partial_cmd, line)
-        self._shlex_split(line)
-        return True
-      # If the command ends with a delimiter, check if it has an open quotation.
-      # shlex in self._split() throws a ValueError iff an open quotation is found.
-      # A quotation can either be a single quote or a double quote.
-      except ValueError:
-        pass
-
-    # This checks to see if there are any backslashed quotes
-    # outside of quotes, since backslashed quotes
-    # outside of single or double quotes should not be escaped.
-    # Ex. 'abc\'xyz' -> closed because \' is escaped
-    #     \'abcxyz   -> open because \' is not escaped
-    #     \'abcxyz'  -> closed
-    # Iterate through the line and switch the state if a single or double quote is found
-    # and ignore escaped single and double quotes if the line is considered open (meaning
-    # a previous single or double quote has not been closed yet)
-      state_closed = True;
-      opener = None;
-      for i, char in enumerate(line):
-        if state_closed and (char in ['\'', '\"']):
-          state_closed = False
-          opener = char
-        elif not state_closed and opener == char:
-          if line[i - 1] != '\\':
-            state_closed = True
-            opener = None;
-
-      return state_closed
-
-    return False
-
   def _check_for_command_completion(self, cmd):
     """Check for a delimiter at the end of user input.
 
-    The end of the user input is scanned for a legal delimiter.
+    The user input is fed to input_splitter, which keeps track of open quotes and
+    comments across lines, and the end of the input is checked for a legal delimiter.
     If a delimiter is not found:
       - Input is not send to onecmd()
         - onecmd() is a method in Cmd which routes the user input to the
@@ -367,22 +396,27 @@ class ImpalaShell(cmd.Cmd):
       - The contents of partial_cmd are put in history, as they represent
         a completed command.
       - The contents are passed to the appropriate method for execution.
-      - partial_cmd is reset to an empty string.
+      - partial_cmd is reset to an empty list.
     """
     if self.readline: current_history_len = self.readline.get_current_history_length()
+    self.input_splitter.feed(cmd)
+    if (self.input_splitter.state == LINE_COMMENT and
+        cmd.endswith(ImpalaShell.CMD_DELIM)):
+      # A delimiter at the end of the line ends the command, even if it is part of a
+      # '--' comment.
+      self.input_splitter.reset()
+    else:
+      self.input_splitter.feed('\n')
     # Input is incomplete, store the contents and do nothing.
-    if not self._cmd_ends_with_delim(cmd):
+    if not self.input_splitter.at_statement_boundary():
       # The user input is incomplete, change the prompt to reflect this.
       if not self.partial_cmd and cmd:
         self.cached_prompt = self.prompt
         self.prompt = '> '.rjust(len(self.cached_prompt))
 
-      # partial_cmd is already populated, add the current input after a newline.
-      if self.partial_cmd and cmd:
-        self.partial_cmd = "%s\n%s" % (self.partial_cmd, cmd)
-      else:
-        # If the input string is empty or partial_cmd is empty.
-        self.partial_cmd = "%s%s" % (self.partial_cmd, cmd)
+      # Lines of partial_cmd are joined with newlines once the command is complete.
+      if cmd:
+        self.partial_cmd.append(cmd)
       # Remove the most recent item from history if:
       #   -- The current state of user input in incomplete.
       #   -- The most recent user input is not an empty string
@@ -392,41 +426,66 @@ class ImpalaShell(cmd.Cmd):
       return str()
     elif self.partial_cmd:  # input ends with a delimiter and partial_cmd is not empty
       if cmd != ImpalaShell.CMD_DELIM:
-        completed_cmd = "%s\n%s" % (self.partial_cmd, cmd)
+        self.partial_cmd.append(cmd)
       else:
-        completed_cmd = "%s%s" % (self.partial_cmd, cmd)
-      # Reset partial_cmd to an empty string
-      self.partial_cmd = str()
+        self.partial_cmd[-1] += cmd
+      completed_cmd = decode_statement('\n'.join(self.partial_cmd))
+      # Reset partial_cmd to an empty list
+      self.partial_cmd = []
       # Replace the most recent history item with the completed command.
-      completed_cmd = sqlparse.format(completed_cmd)
       if self.readline and current_history_len > 0:
         self.readline.replace_history_item(current_history_len - 1,
             completed_cmd.encode('utf-8'))
       # Revert the prompt to its earlier state
       self.prompt = self.cached_prompt
     else:  # Input has a delimiter and partial_cmd is empty
-      completed_cmd = sqlparse.format(cmd)
+      completed_cmd = decode_statement(cmd)
+    self.last_completed_cmd = completed_cmd
     return completed_cmd
 
-  def _new_impala_client(self):
-    return ImpalaClient(self.impalad, self.use_kerberos,
-                        self.kerberos_service_name, self.use_ssl,
-                        self.ca_cert, self.user, self.ldap_password,
-                        self.use_ldap)
+  def _new_impala_client(self, impalad=None):
+    return CLIENT_CLASSES[self.protocol](impalad or self.impalad, self.use_kerberos,
+                                         self.kerberos_service_name, self.use_ssl,
+                                         self.ca_cert, self.user, self.ldap_password,
+                                         self.use_ldap, self.connection_broker)
 
   def _signal_handler(self, signal, frame):
     """Handles query cancellation on a Ctrl+C event"""
+    if self.pipeline is not None:
+      print_to_stderr(ImpalaShell.CANCELLATION_MESSAGE)
+      self.pipeline.cancel()
+      return
+    if self.export is not None:
+      print_to_stderr(ImpalaShell.CANCELLATION_MESSAGE)
+      self.export.cancel()
+      return
+    if self.parallel_source is not None:
+      print_to_stderr(ImpalaShell.CANCELLATION_MESSAGE)
+      self.parallel_source.cancel()
+      return
+    if self.foreground_job is not None:
+      print_to_stderr(ImpalaShell.CANCELLATION_MESSAGE)
+      self._cancel_job(self.foreground_job)
+      return
+    if self.jobs is not None and self.jobs.waiting:
+      # Stop waiting, the jobs keep running.
+      self.jobs.interrupt_wait()
+      return
     if self.last_query_handle is None or self.query_handle_closed:
       return
-    # Create a new connection to the impalad and cancel the query.
+    # Create a new connection to the impalad and cancel and close the query over it. The
+    # connection of the shell may be busy with an RPC of the query, e.g. a fetch.
     for cancel_try in xrange(ImpalaShell.CANCELLATION_TRIES):
       try:
         self.query_handle_closed = True
         print_to_stderr(ImpalaShell.CANCELLATION_MESSAGE)
         new_imp_client = self._new_impala_client()
         new_imp_client.connect()
-        new_imp_client.cancel_query(self.last_query_handle, False)
-        self.imp_client.close_query(self.last_query_handle)
+        try:
+          new_imp_client.cancel_query(self.last_query_handle, False)
+          new_imp_client.close_query(self.last_query_handle)
+        finally:
+          new_imp_client.close_connection()
         self._validate_database()
         break
       except Exception, e:
@@ -466,9 +525,9 @@ class ImpalaShell(cmd.Cmd):
   def precmd(self, args):
     args = self.sanitise_input(args)
     if not args: return args
-    # Split args using sqlparse. If there are multiple queries present in user input,
-    # the length of the returned query list will be greater than one.
-    parsed_cmds = sqlparse.split(args)
+    # If there are multiple queries present in user input, the length of the returned
+    # query list will be greater than one.
+    parsed_cmds = split_statements(args)
     if len(parsed_cmds) > 1:
       # The last command needs a delimiter to be successfully executed.
       parsed_cmds[-1] += ImpalaShell.CMD_DELIM
@@ -476,6 +535,13 @@ class ImpalaShell(cmd.Cmd):
       # If cmdqueue is populated, then commands are executed from the cmdqueue, and user
       # input is ignored. Send an empty string as the user input just to be safe.
       return str()
+    if not parsed_cmds:
+      # The input only consists of comments.
+      return str()
+    # Drop a trailing comment that follows the delimiter, if any.
+    args = parsed_cmds[0].rstrip(ImpalaShell.CMD_DELIM)
+    if self.last_completed_cmd is not None:
+      self.history_start_time = time.time()
     try:
       self.imp_client.test_connection()
     except TException:
@@ -495,14 +561,37 @@ class ImpalaShell(cmd.Cmd):
     # TODO: This may have to be changed to a super() call once we move to Python 3
     if line == None:
       return CmdStatus.ERROR
+    elif self._is_background_statement(line):
+      if not self.interactive:
+        print_to_stderr("Error: Statements ending with '%s' can only be executed in the "
+                        "background in interactive mode." % ImpalaShell.BACKGROUND_SUFFIX)
+        return CmdStatus.ERROR
+      sql = line.rstrip()[:-len(ImpalaShell.BACKGROUND_SUFFIX)].rstrip()
+      return self._submit_job(sql)
     else:
       return cmd.Cmd.onecmd(self, line)
 
   def postcmd(self, status, args):
     # status conveys to shell how the shell should continue execution
     # should always be a CmdStatus
+    if self.jobs is not None:
+      self._report_jobs(self.jobs.get_unreported_jobs())
+    if self.completion_cache is not None and args:
+      self.completion_cache.invalidate(args, self._get_current_db())
+    if self.history_start_time is not None and self.history_log is not None:
+      self._log_history(self.last_completed_cmd, self.history_start_time,
+                        time.time() - self.history_start_time, status is CmdStatus.ERROR)
+      self.history_start_time = None
     return status
 
+  def _log_history(self, statement, start_time, elapsed_secs=None, failed=False):
+    try:
+      self.history_log.append(statement.encode('utf-8'), start_time, elapsed_secs,
+                              failed)
+    except (IOError, OSError), e:
+      print_to_stderr("Unable to write to the history log (disabling it): %s" % e)
+      self.history_log = None
+
   def do_summary(self, args):
     summary = None
     try:
@@ -519,7 +608,11 @@ class ImpalaShell(cmd.Cmd):
     table = self._default_summary_table()
     self.imp_client.build_summary_table(summary, 0, False, 0, False, output)
     formatter = PrettyOutputFormatter(table)
-    self.output_stream = OutputStream(formatter, filename=self.output_file)
+    # The output file only holds query results if they are written in a binary format.
+    output_file = None
+    if self.output_format == 'text':
+      output_file = self.output_file
+    self.output_stream = OutputStream(formatter, filename=output_file)
     self.output_stream.write(output)
 
   def _handle_shell_options(self, token, value):
@@ -607,6 +700,10 @@ class ImpalaShell(cmd.Cmd):
 
   def do_quit(self, args):
     """Quit the Impala shell"""
+    if self.jobs is not None:
+      self.jobs.close()
+    if self.completion_cache is not None:
+      self.completion_cache.close()
     self._print_if_verbose("Goodbye " + self.user)
     self.is_alive = False
     return CmdStatus.ABORT
@@ -617,9 +714,10 @@ class ImpalaShell(cmd.Cmd):
 
   def do_connect(self, args):
     """Connect to an Impalad instance:
-    Usage: connect, defaults to the fqdn of the localhost and port 21000
+    Usage: connect, defaults to the fqdn of the localhost and port 21000 (21050 with
+             --protocol=hs2)
            connect <hostname:port>
-           connect <hostname>, defaults to port 21000
+           connect <hostname>, defaults to port 21000 (21050 with --protocol=hs2)
 
     """
     # Assume the user wants to connect to the local impalad if no connection string is
@@ -636,9 +734,10 @@ class ImpalaShell(cmd.Cmd):
                       "<hostname[:port]>")
       return CmdStatus.ERROR
     elif len(host_port) == 1:
-      host_port.append('21000')
+      host_port.append(DEFAULT_PORTS[self.protocol])
     self.impalad = tuple(host_port)
     if self.imp_client: self.imp_client.close_connection()
+    self._close_progress_client()
     self.imp_client = self._new_impala_client()
     self._connect()
     # If the connection fails and the Kerberos has not been enabled,
@@ -658,6 +757,9 @@ class ImpalaShell(cmd.Cmd):
         pass
 
     if self.imp_client.connected:
+      if self.completion_cache is not None:
+        self.completion_cache.reset()
+        self.completion_cache.prefetch(self._get_current_db())
       self._print_if_verbose('Connected to %s:%s' % self.impalad)
       self._print_if_verbose('Server version: %s' % self.server_version)
       self.prompt = "[%s:%s] > " % self.impalad
@@ -671,7 +773,8 @@ class ImpalaShell(cmd.Cmd):
       print_to_stderr(e)
     # In the case that we lost connection while a command was being entered,
     # we may have a dangling command, clear partial_cmd
-    self.partial_cmd = str()
+    self.partial_cmd = []
+    self.input_splitter.reset()
     # Check if any of query options set by the user are inconsistent
     # with the impalad being connected to
     for set_option in self.set_query_options:
@@ -683,6 +786,10 @@ class ImpalaShell(cmd.Cmd):
   def _connect(self):
     try:
       result = self.imp_client.connect()
+      if self.imp_client.connection_broker_error is not None:
+        print_to_stderr("Unable to use the connection broker at %s, connecting "
+                        "directly: %s" % (self.connection_broker,
+                                          self.imp_client.connection_broker_error))
       self.server_version = result.version
       self.webserver_address = result.webserver_address
     except TApplicationException:
@@ -805,56 +912,153 @@ class ImpalaShell(cmd.Cmd):
 
   def _format_outputstream(self):
     column_names = self.imp_client.get_column_names(self.last_query_handle)
-    if self.write_delimited:
+    column_types = None
+    if self.output_format == 'parquet':
+      column_types = self.imp_client.get_column_types(self.last_query_handle)
+    self.output_stream = self._create_output_stream(column_names, column_types)
+    return column_names
+
+  def _create_output_stream(self, column_names, column_types=None):
+    if self.output_format == 'parquet':
+      from parquet_output import ParquetOutputStream
+      output_stream = ParquetOutputStream(self.output_file, column_names, column_types)
+      self.parquet_output_written = True
+    elif self.write_delimited:
       formatter = DelimitedOutputFormatter(field_delim=self.output_delimiter)
-      self.output_stream = OutputStream(formatter, filename=self.output_file)
+      output_stream = OutputStream(formatter, filename=self.output_file, buffered=True)
       # print the column names
       if self.print_header:
-        self.output_stream.write([column_names])
+        output_stream.write([column_names])
     else:
-      prettytable = self.construct_table_with_header(column_names)
-      formatter = PrettyOutputFormatter(prettytable)
-      self.output_stream = OutputStream(formatter, filename=self.output_file)
-
-  def _periodic_wait_callback(self):
-    """If enough time elapsed since the last call to the periodic callback,
-    execute the RPC to get the query exec summary and depending on the set options
-    print either the progress or the summary or both to stderr.
-    """
-    if not self.print_progress and not self.print_summary: return
+      # Column names may be encoded as utf-8
+      formatter = StreamingPrettyOutputFormatter(
+          [column.decode('utf-8', 'ignore') for column in column_names])
+      output_stream = OutputStream(formatter, filename=self.output_file)
+    return output_stream
+
+  def _finish_output_stream(self, output_stream, fetched_all):
+    """Finishes 'output_stream' once all rows were written to it, or aborts it if
+    fetching them failed. An aborted Parquet output file is removed, so that another
+    statement may write it."""
+    if fetched_all:
+      output_stream.finish()
+      return
+    output_stream.abort()
+    if self.output_format == 'parquet':
+      self.parquet_output_written = False
+
+  def _check_parquet_output(self):
+    """Returns False, after printing an error, if the result of a statement cannot be
+    written because the Parquet --output_file already holds the result of another
+    one."""
+    if self.output_format != 'parquet' or not self.parquet_output_written:
+      return True
+    print_to_stderr("Error: %s already holds the result of a previous statement. "
+                    "--output_format=parquet supports a single statement that returns "
+                    "rows." % self.output_file)
+    return False
 
-    checkpoint = time.time()
-    if checkpoint - self.last_summary > self.PROGRESS_UPDATE_INTERVAL:
-      summary = self.imp_client.get_summary(self.last_query_handle)
-      if summary and summary.progress:
-        progress = summary.progress
-
-        # If the data is not complete return and wait for a good result.
-        if not progress.total_scan_ranges and not progress.num_completed_scan_ranges:
-          self.last_summary = time.time()
-          return
-
-        data = ""
-        if self.print_progress and progress.total_scan_ranges > 0:
-          val = ((summary.progress.num_completed_scan_ranges * 100) /
-                 summary.progress.total_scan_ranges)
-          fragment_text = "[%s%s] %s%%\n" % ("#" * val, " " * (100 - val), val)
-          data += fragment_text
-
-        if self.print_summary:
-          table = self._default_summary_table()
-          output = []
-          self.imp_client.build_summary_table(summary, 0, False, 0, False, output)
-          formatter = PrettyOutputFormatter(table)
-          data += formatter.format(output) + "\n"
-
-        self.progress_stream.write(data)
-      self.last_summary = time.time()
+  def _get_result_cache_key(self, sql, is_insert):
+    """Returns the key under which the result of 'sql' is cached, or None if it must not
+    be cached. Results that 'sql' may make stale are removed from the cache."""
+    if self.result_cache is None:
+      return None
+    cache_key = None
+    if not is_insert:
+      cache_key = self.result_cache.get_key(sql, self.current_db, self.set_query_options)
+    if cache_key is None:
+      self.result_cache.invalidate(sql)
+    # Cached results do not record the column types needed for Parquet output.
+    if not self.use_result_cache or self.output_format != 'text':
+      return None
+    return cache_key
+
+  def _print_cached_result(self, cached_result):
+    start_time = time.time()
+    output_stream = self._create_output_stream(cached_result.column_names)
+    rows = cached_result.rows
+    try:
+      for i in xrange(0, len(rows), self.imp_client.fetch_batch_size):
+        output_stream.write(rows[i:i + self.imp_client.fetch_batch_size])
+    finally:
+      output_stream.finish()
+    self._print_if_verbose("Fetched %d row(s) in %2.2fs from the result cache "
+        "(cached at %s)" % (len(rows), time.time() - start_time,
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(cached_result.created))))
+    return CmdStatus.SUCCESS
+
+  def _start_progress_refresher(self):
+    """Starts displaying the live progress and/or summary of the last query, if enabled,
+    and returns the ProgressRefresher that does it. The exec summary is fetched from a
+    background thread over a separate connection, so fetching the results is not
+    delayed by it."""
+    if not self.print_progress and not self.print_summary:
+      return None
+    refresher = ProgressRefresher(self._get_progress_client, self.last_query_handle,
+        self._render_progress, self.progress_stream, self.PROGRESS_UPDATE_INTERVAL)
+    refresher.start()
+    return refresher
+
+  def _stop_progress_refresher(self, refresher):
+    if refresher is not None:
+      refresher.stop()
+
+  def _get_progress_client(self):
+    """Returns the connection used by the ProgressRefresher, connecting it if needed. It
+    is kept open across queries. Called from the refresher's background thread, and
+    the refresher of the previous query may still be connecting it."""
+    self.progress_client_lock.acquire()
+    try:
+      if self.progress_client is None or not self.progress_client.connected:
+        self._close_progress_client()
+        progress_client = self._new_impala_client()
+        progress_client.connect()
+        self.progress_client = progress_client
+      return self.progress_client
+    finally:
+      self.progress_client_lock.release()
+
+  def _close_progress_client(self):
+    self.progress_client_lock.acquire()
+    try:
+      if self.progress_client is not None:
+        try:
+          self.progress_client.close_connection()
+        except Exception:
+          pass
+        self.progress_client = None
+    finally:
+      self.progress_client_lock.release()
+
+  def _render_progress(self, summary, client):
+    """Returns the text that displays the progress and/or the summary in 'summary', or
+    None if they are not known yet. Called from the ProgressRefresher's thread, which
+    uses its own 'client'."""
+    progress = summary.progress
+    # If the data is not complete return and wait for a good result.
+    if not progress or \
+        (not progress.total_scan_ranges and not progress.num_completed_scan_ranges):
+      return None
+
+    data = ""
+    if self.print_progress and progress.total_scan_ranges > 0:
+      val = ((progress.num_completed_scan_ranges * 100) / progress.total_scan_ranges)
+      fragment_text = "[%s%s] %s%%\n" % ("#" * val, " " * (100 - val), val)
+      data += fragment_text
+
+    if self.print_summary:
+      output = []
+      client.build_summary_table(summary, 0, False, 0, False, output)
+      formatter = StreamingPrettyOutputFormatter(self.SUMMARY_COLUMN_NAMES)
+      rows = [[isinstance(value, basestring) and value or str(value) for value in row]
+              for row in output]
+      table = formatter.format(rows)
+      if table is not None:
+        data += table + "\n" + formatter.finish() + "\n"
+    return data
 
   def _default_summary_table(self):
-    return self.construct_table_with_header(["Operator", "#Hosts", "Avg Time", "Max Time",
-                                             "#Rows", "Est. #Rows", "Peak Mem",
-                                             "Est. Peak Mem", "Detail"])
+    return self.construct_table_with_header(self.SUMMARY_COLUMN_NAMES)
 
   def _execute_stmt(self, query, is_insert=False, print_web_link=False):
     """ The logic of executing any query statement
@@ -869,6 +1073,18 @@ class ImpalaShell(cmd.Cmd):
     """
 
     self._print_if_verbose("Query: %s" % query.query)
+    if not is_insert and self.imp_client.expect_result_metadata(query.query) and \
+        not self._check_parquet_output():
+      return CmdStatus.ERROR
+    cache_key = self._get_result_cache_key(query.query, is_insert)
+    if cache_key is not None and not self.bypass_result_cache:
+      cached_result = self.result_cache.get(cache_key)
+      if cached_result is not None:
+        return self._print_cached_result(cached_result)
+    progress_refresher = None
+    timing = StatementTiming(query.query, self.imp_client.get_rpc_stats())
+    if self.client_profiler is not None:
+      self.client_profiler.start()
     # TODO: Clean up this try block and refactor it (IMPALA-3814)
     try:
       if self.webserver_address == ImpalaShell.UNKNOWN_WEBSERVER:
@@ -881,40 +1097,81 @@ class ImpalaShell(cmd.Cmd):
       start_time = time.time()
       self.last_query_handle = self.imp_client.execute_query(query)
       self.query_handle_closed = False
-      self.last_summary = time.time()
+      timing.add('submit', time.time() - start_time)
+      timing.query_id = self.last_query_handle.id
+      progress_refresher = self._start_progress_refresher()
       if print_web_link:
         self._print_if_verbose(
             "Query progress can be monitored at: %s/query_plan?query_id=%s" %
             (self.webserver_address, self.last_query_handle.id))
 
-      wait_to_finish = self.imp_client.wait_to_finish(self.last_query_handle,
-          self._periodic_wait_callback)
-      # Reset the progress stream.
-      self.progress_stream.clear()
+      # Statements that return rows are not polled, the first fetch RPC blocks on the
+      # server until the query is ready, which avoids the latency added by polling.
+      if is_insert or not self.imp_client.expect_result_metadata(query.query):
+        phase_start = time.time()
+        try:
+          self.imp_client.wait_to_finish(self.last_query_handle)
+        finally:
+          self._stop_progress_refresher(progress_refresher)
+          timing.add('execute', time.time() - phase_start)
 
       if is_insert:
+        phase_start = time.time()
         # retrieve the error log
         warning_log = self.imp_client.get_warning_log(self.last_query_handle)
         num_rows = self.imp_client.close_insert(self.last_query_handle)
+        timing.add('close', time.time() - phase_start)
       else:
         # impalad does not support the fetching of metadata for certain types of queries.
         if not self.imp_client.expect_result_metadata(query.query):
+          phase_start = time.time()
           # Close the query
           self.imp_client.close_query(self.last_query_handle)
           self.query_handle_closed = True
+          timing.add('close', time.time() - phase_start)
+          timing.succeeded = True
           return CmdStatus.SUCCESS
 
-        self._format_outputstream()
+        phase_start = time.time()
+        column_names = self._format_outputstream()
         # fetch returns a generator
         rows_fetched = self.imp_client.fetch(self.last_query_handle)
         num_rows = 0
-
-        for rows in rows_fetched:
-          self.output_stream.write(rows)
-          num_rows += len(rows)
-
+        # The rows to store in the result cache, unless the result is too large.
+        cached_rows = None
+        if cache_key is not None:
+          cached_rows = []
+          cached_bytes = 0
+
+        # Waiting for the first rows counts as execution, for the others as fetching.
+        phase = 'execute'
+        fetched_all = False
+        try:
+          for rows in rows_fetched:
+            timing.add(phase, time.time() - phase_start)
+            phase = 'fetch'
+            # The live progress is erased once the results start to arrive.
+            self._stop_progress_refresher(progress_refresher)
+            self.output_stream.write(rows)
+            num_rows += len(rows)
+            if cached_rows is not None:
+              cached_bytes += sum([len(value) for row in rows for value in row])
+              if cached_bytes > self.result_cache.max_entry_bytes:
+                cached_rows = None
+              else:
+                cached_rows.extend(rows)
+            phase_start = time.time()
+          fetched_all = True
+        finally:
+          self._stop_progress_refresher(progress_refresher)
+          self._finish_output_stream(self.output_stream, fetched_all)
+          timing.add_output_stream(self.output_stream)
+          timing.num_rows = num_rows
+
+        phase_start = time.time()
         # retrieve the error log
         warning_log = self.imp_client.get_warning_log(self.last_query_handle)
+        timing.add('close', time.time() - phase_start)
 
       end_time = time.time()
 
@@ -923,15 +1180,24 @@ class ImpalaShell(cmd.Cmd):
       # print insert when is_insert is true (which is 1)
       # print fetch when is_insert is false (which is 0)
       verb = ["Fetch", "Insert"][is_insert]
-      self._print_if_verbose("%sed %d row(s) in %2.2fs" % (verb, num_rows,
-                                                               end_time - start_time))
+      self._print_if_verbose(get_row_count_message(verb, num_rows,
+                                                   end_time - start_time))
 
+      phase_start = time.time()
       if not is_insert:
         self.imp_client.close_query(self.last_query_handle, self.query_handle_closed)
       self.query_handle_closed = True
 
+      if not is_insert and cached_rows is not None:
+        try:
+          self.result_cache.put(cache_key, query.query, column_names, cached_rows)
+        except (IOError, OSError), e:
+          print_to_stderr("Unable to store the result in the result cache: %s" % e)
+
       profile = self.imp_client.get_runtime_profile(self.last_query_handle)
       self.print_runtime_profile(profile)
+      timing.add('close', time.time() - phase_start)
+      timing.succeeded = True
       return CmdStatus.SUCCESS
     except RPCException, e:
       # could not complete the rpc successfully
@@ -960,14 +1226,45 @@ class ImpalaShell(cmd.Cmd):
       print_to_stderr('Unknown Exception : %s' % (u,))
       self.imp_client.connected = False
       self.prompt = ImpalaShell.DISCONNECTED_PROMPT
+    finally:
+      self._stop_progress_refresher(progress_refresher)
+      self._finish_timing(timing)
     return CmdStatus.ERROR
 
+  def _finish_timing(self, timing):
+    """Completes the timing of a statement, and appends it to --timing_file."""
+    timing.finish(self.imp_client.get_rpc_stats())
+    if self.client_profiler is not None:
+      timing.profile = self.client_profiler.stop()
+    self.last_timing = timing
+    if not self.timing_file:
+      return
+    import json
+    try:
+      timing_file = open(self.timing_file, 'a')
+      try:
+        timing_file.write(json.dumps(timing.to_dict()) + '\n')
+      finally:
+        timing_file.close()
+    except IOError, e:
+      print_to_stderr("Unable to write the timing to %s: %s" % (self.timing_file, e))
+
+  def do_timing(self, args):
+    """Prints how long the last statement spent in each phase of its execution on the
+    client (see statement_timing.py), and its client profile with --client_profile."""
+    if self.last_timing is None:
+      print_to_stderr("No statement has been executed yet")
+      return CmdStatus.ERROR
+    print_to_stderr(self.last_timing.format())
+    return CmdStatus.SUCCESS
+
   def construct_table_with_header(self, column_names):
     """ Constructs the table header for a given query handle.
 
     Should be called after the query has finished and before data is fetched.
     All data is left aligned.
     """
+    from impala_pretty_table import ImpalaPrettyTable
     table = ImpalaPrettyTable()
     for column in column_names:
       # Column names may be encoded as utf-8
@@ -1002,6 +1299,8 @@ class ImpalaShell(cmd.Cmd):
                                                  self.set_query_options)
     if self._execute_stmt(query) is CmdStatus.SUCCESS:
       self.current_db = args
+      if self.completion_cache is not None:
+        self.completion_cache.prefetch(self._get_current_db())
     else:
       return CmdStatus.ERROR
 
@@ -1033,16 +1332,395 @@ class ImpalaShell(cmd.Cmd):
     return self._execute_stmt(query)
 
   def do_history(self, args):
-    """Display command history"""
-    # Deal with readline peculiarity. When history does not exists,
-    # readline returns 1 as the history length and stores 'None' at index 0.
-    if self.readline and self.readline.get_current_history_length() > 0:
-      for index in xrange(1, self.readline.get_current_history_length() + 1):
-        cmd = self.readline.get_history_item(index)
-        print_to_stderr('[%d]: %s' % (index, cmd))
+    """Displays, searches or replays the statements in the history log, which are
+    identified by the numbers in brackets.
+    Usage: HISTORY
+           HISTORY /<regular expression>/
+           HISTORY REPLAY <number>[-<number>]
+    HISTORY shows the last statements, and /<regular expression>/ all statements that
+    match it, with when they were executed and how long they took. REPLAY executes a
+    range of statements again and compares how long they took.
+    """
+    if self.history_log is None:
+      print_to_stderr("The history log is only kept in interactive mode, and is "
+                      "disabled if it cannot be read or written.")
+      return CmdStatus.ERROR
+    args = args.strip()
+    try:
+      if not args:
+        for entry in self.history_log.get_last(HISTORY_LENGTH):
+          print_to_stderr('[%d]: %s' % (entry.id, entry.statement))
+        return CmdStatus.SUCCESS
+      if len(args) > 1 and args.startswith('/') and args.endswith('/'):
+        try:
+          entries = self.history_log.search(args[1:-1])
+        except re.error, e:
+          print_to_stderr("Invalid regular expression: %s" % e)
+          return CmdStatus.ERROR
+        for entry in entries:
+          print_to_stderr('[%d] %s: %s' % (entry.id, format_history_entry(entry),
+                                           entry.statement))
+        return CmdStatus.SUCCESS
+      match = re.match(r'^replay\s+(\d+)(?:\s*-\s*(\d+))?$', args, re.I)
+      if match is not None:
+        first_id = int(match.group(1))
+        return self._replay_history(first_id, int(match.group(2) or first_id))
+    except (IOError, OSError), e:
+      print_to_stderr("Unable to read the history log: %s" % e)
+      return CmdStatus.ERROR
+    print_to_stderr("Usage: HISTORY [/<regular expression>/ | "
+                    "REPLAY <number>[-<number>]]")
+    return CmdStatus.ERROR
+
+  def _replay_history(self, first_id, last_id):
+    """Executes the statements with ids 'first_id' to 'last_id' of the history log
+    again, and prints how long each one took, now and when it was logged."""
+    entries = self.history_log.get_range(first_id, last_id)
+    if not entries:
+      print_to_stderr("No statements in the history log between %d and %d" % (
+          first_id, last_id))
+      return CmdStatus.ERROR
+    # The replayed statements are not logged, but the HISTORY command is.
+    last_completed_cmd = self.last_completed_cmd
+    table = self.construct_table_with_header(
+        ["#", "Status", "Time", "Logged Time", "Statement"])
+    failed = False
+    try:
+      for entry in entries:
+        status = None
+        elapsed = '-'
+        tokens = entry.statement.split(None, 1)
+        if entry.truncated:
+          result = "Skipped (truncated)"
+        elif tokens and tokens[0].lower() in ('history', 'quit', 'exit'):
+          result = "Skipped"
+        else:
+          print_to_stderr("Replaying [%d]: %s" % (entry.id, entry.statement))
+          start_time = time.time()
+          status = CmdStatus.SUCCESS
+          for query in parse_query_text(entry.statement):
+            status = self.onecmd(self.sanitise_input(query))
+            if status is CmdStatus.ERROR:
+              break
+          elapsed = "%.2fs" % (time.time() - start_time)
+          result = status is CmdStatus.ERROR and "Failed" or "Succeeded"
+          failed = failed or status is CmdStatus.ERROR
+        logged_elapsed = '-'
+        if entry.elapsed_secs is not None:
+          logged_elapsed = "%.2fs" % entry.elapsed_secs
+        statement = ' '.join(entry.statement.split())
+        if len(statement) > 60:
+          statement = statement[:57] + '...'
+        table.add_row([entry.id, result, elapsed, logged_elapsed, statement])
+        if status is CmdStatus.ABORT:
+          return status
+    finally:
+      self.last_completed_cmd = last_completed_cmd
+    print_to_stderr(table)
+    if failed:
+      return CmdStatus.ERROR
+    return CmdStatus.SUCCESS
+
+  def do_cache(self, args):
+    """Inspects or controls the local result cache (see --result_cache).
+    CACHE: prints the state of the cache.
+    CACHE CLEAR: removes all cached results.
+    CACHE ON|OFF: enables or disables serving and storing cached results.
+    CACHE BYPASS <query>: executes the query without serving a cached result.
+    """
+    if self.result_cache is None:
+      print_to_stderr("The result cache is not enabled, start the shell with "
+                      "--result_cache to enable it.")
+      return CmdStatus.ERROR
+    tokens = args.split(None, 1)
+    subcommand = tokens and tokens[0].lower()
+    if not tokens:
+      num_entries, num_bytes = self.result_cache.get_size()
+      print_to_stderr("Result cache in %s is %s: %d result(s), %.1f of %.1f MB, "
+          "expiring after %ds. Hits: %d, misses: %d." % (self.result_cache.cache_dir,
+          ["off", "on"][self.use_result_cache], num_entries, num_bytes / 1048576.0,
+          self.result_cache.max_bytes / 1048576.0, self.result_cache.ttl_s,
+          self.result_cache.hits, self.result_cache.misses))
+    elif subcommand == 'clear' and len(tokens) == 1:
+      self.result_cache.clear()
+      print_to_stderr("Cleared the result cache")
+    elif subcommand in ('on', 'off') and len(tokens) == 1:
+      self.use_result_cache = subcommand == 'on'
+      print_to_stderr("Result cache turned %s" % subcommand)
+    elif subcommand == 'bypass' and len(tokens) == 2:
+      # Route the query to its command handler like sanitise_input() does.
+      query = tokens[1].split(' ', 1)
+      query[0] = query[0].lower()
+      self.bypass_result_cache = True
+      try:
+        return self.onecmd(' '.join(query))
+      finally:
+        self.bypass_result_cache = False
+    else:
+      print_to_stderr("Usage: CACHE [CLEAR | ON | OFF | BYPASS <query>]")
+      return CmdStatus.ERROR
+    return CmdStatus.SUCCESS
+
+  def do_export(self, args):
+    """Exports the result of a query into one file per partition. Up to
+    --export_sessions partitions are executed concurrently, each over its own session,
+    and retried if they fail.
+    Usage: EXPORT <directory> PARTITIONS <n> [ON <host:port>[,<host:port>...]]
+               BY {<expression> | RANGE(<column>, <low>, <high>)} <query>
+    Rows are assigned to partitions by the hash of <expression>, which may refer to the
+    columns of the result, or by dividing [<low>, <high>) into <n> ranges of the integer
+    <column>. Partition i is written to <directory>/part-<i>.txt, delimited by
+    --output_delimiter, or to part-<i>.parq with --output_format=parquet. The partitions
+    run on the impalads given with ON in turn, or on the connected impalad.
+    """
+    from parallel_export import (ExportPartition, ParallelExport, get_partition_queries,
+        parse_export_args)
+    export_args = parse_export_args(args)
+    if export_args is None:
+      print_to_stderr("Usage: EXPORT <directory> PARTITIONS <n> "
+                      "[ON <host:port>[,<host:port>...]] "
+                      "BY {<expression> | RANGE(<column>, <low>, <high>)} <query>")
+      return CmdStatus.ERROR
+    if not self.imp_client.connected:
+      print_to_stderr('Not connected to Impala, could not export.')
+      return CmdStatus.ERROR
+    directory = os.path.expanduser(export_args.path)
+    try:
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+    except OSError, e:
+      print_to_stderr("Unable to create %s: %s" % (directory, e))
+      return CmdStatus.ERROR
+    extension = self.output_format == 'parquet' and 'parq' or 'txt'
+    partitions = []
+    for i, sql in enumerate(get_partition_queries(export_args)):
+      impalad = None
+      if export_args.impalads:
+        impalad = export_args.impalads[i % len(export_args.impalads)]
+      path = os.path.join(directory, 'part-%05d.%s' % (i, extension))
+      partitions.append(ExportPartition(i, sql, path, impalad))
+
+    start_time = time.time()
+    self.export = ParallelExport(self._new_export_session, self._create_export_stream,
+                                 partitions, self.export_sessions, self.current_db,
+                                 self.set_query_options)
+    self.export.start()
+    try:
+      while True:
+        done = self.export.is_done()
+        events = self.export.get_events(not done and self.EXPORT_WAIT_INTERVAL_S or 0)
+        if self.print_progress:
+          self.progress_stream.clear()
+        for event in events:
+          self._print_if_verbose(event)
+        if done:
+          break
+        if self.print_progress:
+          num_done = len([p for p in partitions if p.done.is_set()])
+          self.progress_stream.write("Exported %d row(s), %d of %d partition(s) done\n" %
+                                     (self.export.get_num_rows(), num_done,
+                                      len(partitions)))
+      self.export.close()
+    finally:
+      self.export = None
+    failed = [str(p.index) for p in partitions if p.error is not None]
+    if failed:
+      print_to_stderr("Could not export partition(s) %s" % ', '.join(failed))
+      return CmdStatus.ERROR
+    self._print_if_verbose("Exported %d row(s) into %d file(s) in %s in %2.2fs" % (
+        sum([p.num_rows for p in partitions]), len(partitions), directory,
+        time.time() - start_time))
+    return CmdStatus.SUCCESS
+
+  def _is_background_statement(self, line):
+    tokens = line.split(None, 1)
+    return bool(tokens and tokens[0].lower() in ImpalaShell.PIPELINED_COMMANDS and
+                line.rstrip().endswith(ImpalaShell.BACKGROUND_SUFFIX) and
+                not line.rstrip().endswith(ImpalaShell.BACKGROUND_SUFFIX * 2))
+
+  def _submit_job(self, sql):
+    """Starts executing 'sql' in the background, see job_control.py."""
+    if not self.imp_client.connected:
+      print_to_stderr('Not connected to Impala, could not execute queries.')
+      return CmdStatus.ERROR
+    if self.jobs is None:
+      from job_control import JobManager
+      self.jobs = JobManager(self._new_pipeline_session)
+    if self.result_cache is not None:
+      self.result_cache.invalidate(sql)
+    job = self.jobs.submit(sql, self.current_db, self.set_query_options)
+    if job is None:
+      print_to_stderr("Too many jobs, FETCH or CANCEL some of them first.")
+      return CmdStatus.ERROR
+    print_to_stderr("[%d] Submitted: %s" % (job.id, ' '.join(sql.split())))
+    return CmdStatus.SUCCESS
+
+  def _get_job(self, args, usage):
+    """Returns the job whose id is 'args', optionally prefixed with '%', or None after
+    printing an error."""
+    job_id = args.strip().lstrip('%')
+    if not job_id.isdigit():
+      print_to_stderr("Usage: %s" % usage)
+      return None
+    job = None
+    if self.jobs is not None:
+      job = self.jobs.get(int(job_id))
+    if job is None:
+      print_to_stderr("No such job: %s" % job_id)
+    return job
+
+  def _report_jobs(self, jobs):
+    """Prints the state of 'jobs' that are done. Returns False if any of them failed."""
+    succeeded = True
+    for job in jobs:
+      if not job.done.is_set():
+        continue
+      print_to_stderr(job.get_status_message())
+      if job.state == job.FINISHED and job.is_insert:
+        self._print_if_verbose(get_row_count_message("Insert", job.num_rows,
+                                                     job.get_elapsed_secs()))
+      succeeded = succeeded and job.state in (job.READY, job.FINISHED)
+      self.jobs.report(job)
+    return succeeded
+
+  def _cancel_job(self, job):
+    try:
+      self.jobs.cancel(job)
+    except Exception, e:
+      print_to_stderr("Failed to cancel job %d: %s" % (job.id, e))
+
+  def do_jobs(self, args):
+    """Lists the statements that are executed in the background. In interactive mode, a
+    statement is executed in the background if it ends with '&', e.g.
+    'select count(*) from t &;'.
+    Usage: JOBS
+    """
+    if self.jobs is None or not self.jobs.get_jobs():
+      print_to_stderr("No jobs.")
+      return CmdStatus.SUCCESS
+    table = self.construct_table_with_header(
+        ["Job", "State", "Elapsed", "Query Id", "Statement"])
+    for job in self.jobs.get_jobs():
+      statement = ' '.join(job.sql.split())
+      if len(statement) > 60:
+        statement = statement[:57] + '...'
+      table.add_row([job.id, job.state, "%.2fs" % job.get_elapsed_secs(),
+                     job.get_query_id() or '', statement])
+    print_to_stderr(table)
+    # Listed jobs count as reported, except for the failed ones, whose errors are shown
+    # on the next prompt.
+    for job in self.jobs.get_unreported_jobs():
+      if job.state != job.FAILED:
+        self.jobs.report(job)
+    return CmdStatus.SUCCESS
+
+  def do_wait(self, args):
+    """Waits for a background statement to finish, or for all of them without a job id.
+    Ctrl+C stops waiting without cancelling the statements.
+    Usage: WAIT [<job id>]
+    """
+    if args.strip():
+      job = self._get_job(args, "WAIT [<job id>]")
+      if job is None:
+        return CmdStatus.ERROR
+      jobs = [job]
+    elif self.jobs is not None:
+      jobs = self.jobs.get_jobs()
     else:
-      print_to_stderr("The readline module was either not found or disabled. Command "
-                      "history will not be collected.")
+      return CmdStatus.SUCCESS
+    if not self.jobs.wait(jobs):
+      print_to_stderr("Stopped waiting, the jobs keep running in the background.")
+      return CmdStatus.ERROR
+    failed = [job for job in jobs if job.state == job.FAILED]
+    self._report_jobs(self.jobs.get_unreported_jobs())
+    if failed:
+      return CmdStatus.ERROR
+    return CmdStatus.SUCCESS
+
+  def do_fetch(self, args):
+    """Prints the results of a background statement, waiting for it if it is still
+    running. Ctrl+C cancels the statement.
+    Usage: FETCH <job id>
+    """
+    job = self._get_job(args, "FETCH <job id>")
+    if job is None or not self._check_parquet_output():
+      return CmdStatus.ERROR
+    self.foreground_job = job
+    try:
+      self.jobs.wait([job])
+      if job.state != job.READY:
+        if self._report_jobs([job]):
+          return CmdStatus.SUCCESS
+        return CmdStatus.ERROR
+      start_time = time.time()
+      try:
+        column_names = job.client.get_column_names(job.query_handle)
+        column_types = None
+        if self.output_format == 'parquet':
+          column_types = job.client.get_column_types(job.query_handle)
+        num_rows = 0
+        output_stream = self._create_output_stream(column_names, column_types)
+        fetched_all = False
+        try:
+          for rows in job.client.fetch(job.query_handle):
+            output_stream.write(rows)
+            num_rows += len(rows)
+          fetched_all = True
+        finally:
+          self._finish_output_stream(output_stream, fetched_all)
+        job.client.close_query(job.query_handle)
+        job.state = job.FINISHED
+      except Exception, e:
+        if job.cancelled:
+          print_to_stderr("[%d] Cancelled" % job.id)
+        else:
+          print_to_stderr(e)
+        return CmdStatus.ERROR
+      if job.warning_log:
+        self._print_if_verbose(job.warning_log)
+      self._print_if_verbose(get_row_count_message("Fetch", num_rows,
+                                                   time.time() - start_time))
+      return CmdStatus.SUCCESS
+    finally:
+      self.foreground_job = None
+      job.reported = True
+      self.jobs.remove(job)
+
+  def do_cancel(self, args):
+    """Cancels a background statement, or discards the results of a finished one.
+    Usage: CANCEL <job id>
+    """
+    job = self._get_job(args, "CANCEL <job id>")
+    if job is None:
+      return CmdStatus.ERROR
+    self._cancel_job(job)
+    if job.done.is_set():
+      self.jobs.remove(job)
+      print_to_stderr(job.get_status_message())
+    # A running job is reported once its statement was cancelled.
+    return CmdStatus.SUCCESS
+
+  def _new_export_session(self, impalad):
+    imp_client = self._new_impala_client(impalad)
+    imp_client.connect()
+    return imp_client
+
+  def _create_export_stream(self, path, column_names, column_types):
+    if self.output_format == 'parquet':
+      from parquet_output import ParquetOutputStream
+      return ParquetOutputStream(path, column_names, column_types)
+    # OutputStream appends to the file, but a retried partition starts over. Truncating
+    # the file also makes sure it can be written, instead of falling back to stdout.
+    open(path, 'wb').close()
+    formatter = DelimitedOutputFormatter(field_delim=self.output_delimiter)
+    output_stream = OutputStream(formatter, filename=path, buffered=True)
+    if self.print_header:
+      output_stream.write([column_names])
+    return output_stream
+
+  def do_sync(self, args):
+    """Waits for all previous statements to finish before executing the next one. This
+    only has an effect when statements are pipelined (see --pipeline_sessions)."""
 
   def do_tip(self, args):
     """Print a random tip"""
@@ -1052,43 +1730,61 @@ class ImpalaShell(cmd.Cmd):
     return self.do_source(args)
 
   def do_source(self, args):
+    """Executes the statements in a file.
+    Usage: SOURCE <file>
+           SOURCE PARALLEL <glob> <n>
+    With PARALLEL, the files that match <glob> are executed concurrently, up to <n> at
+    a time, each over its own session (see parallel_source.py).
+    """
+    tokens = args.split()
+    if tokens and tokens[0].lower() == 'parallel':
+      if len(tokens) != 3 or not tokens[2].isdigit() or int(tokens[2]) < 1:
+        print_to_stderr("Usage: SOURCE PARALLEL <glob> <n>")
+        return CmdStatus.ERROR
+      if self.execute_query_files_parallel(tokens[1], int(tokens[2])):
+        return CmdStatus.SUCCESS
+      return CmdStatus.ERROR
     try:
       cmd_file = open(args, "r")
     except Exception, e:
       print_to_stderr("Error opening file '%s': %s" % (args, e))
       return CmdStatus.ERROR
-    if self.execute_query_list(parse_query_text(cmd_file.read())):
+    if self.execute_query_list(parse_query_file(cmd_file)):
       return CmdStatus.SUCCESS
     else:
       return CmdStatus.ERROR
 
   def preloop(self):
-    """Load the history file if it exists"""
-    if self.readline:
-      # The history file is created when the Impala shell is invoked and commands are
-      # issued. In the first invocation of the shell, the history file will not exist.
-      # Clearly, this is not an error, return.
-      if not os.path.exists(self.history_file): return
-      try:
-        self.readline.read_history_file(self.history_file)
-        self._replace_history_delimiters(ImpalaShell.HISTORY_FILE_QUERY_DELIM, '\n')
-      except IOError, i:
-        msg = "Unable to load command history (disabling history collection): %s" % i
-        print_to_stderr(msg)
-        # This history file exists but is not readable, disable readline.
-        self._disable_readline()
-
-  def postloop(self):
-    """Save session commands in history."""
+    """Loads the last statements of the history log into readline. Only the last
+    HISTORY_LENGTH statements are read, however large the log is."""
+    if self.history_log is None:
+      return
+    try:
+      if not self.history_log.exists():
+        self._import_history_file()
+      entries = self.history_log.get_last(HISTORY_LENGTH)
+    except (IOError, OSError), e:
+      print_to_stderr("Unable to load the history log (disabling it): %s" % e)
+      self.history_log = None
+      return
     if self.readline:
-      try:
-        self._replace_history_delimiters('\n', ImpalaShell.HISTORY_FILE_QUERY_DELIM)
-        self.readline.write_history_file(self.history_file)
-      except IOError, i:
-        msg = "Unable to save command history (disabling history collection): %s" % i
-        print_to_stderr(msg)
-        # The history file is not writable, disable readline.
-        self._disable_readline()
+      # cmdloop() is restarted after a Ctrl+C, which must not load the history again.
+      self.readline.clear_history()
+      for entry in entries:
+        self.readline.add_history(entry.statement)
+
+  def _import_history_file(self):
+    """Imports the history file of older versions of the shell into the history log.
+    Statements are separated by HISTORY_FILE_QUERY_DELIM instead of newlines there."""
+    if not self.readline or not os.path.exists(self.history_file):
+      return
+    self.readline.clear_history()
+    self.readline.read_history_file(self.history_file)
+    self._replace_history_delimiters(ImpalaShell.HISTORY_FILE_QUERY_DELIM, '\n')
+    for index in xrange(1, self.readline.get_current_history_length() + 1):
+      statement = self.readline.get_history_item(index)
+      if statement:
+        self.history_log.append(statement, 0)
 
   def _replace_history_delimiters(self, src_delim, tgt_delim):
     """Replaces source_delim with target_delim for all items in history.
@@ -1129,17 +1825,169 @@ class ImpalaShell(cmd.Cmd):
     # If the user input is lower case or mixed case, return lower case commands.
     return cmd_names
 
+  def completedefault(self, text, line, begidx, endidx):
+    """Completes database, table and column names from the completion cache, without
+    waiting for the impalad."""
+    if self.completion_cache is None:
+      return []
+    names = self.completion_cache.complete(text, line, self._get_current_db())
+    if text.isupper(): return [name.upper() for name in names]
+    return names
+
+  def _get_current_db(self):
+    return (self.current_db or ImpalaShell.DEFAULT_DB).strip('`')
+
   def execute_query_list(self, queries):
+    """Executes 'queries', which may be any iterable, e.g. a generator that parses the
+    queries from a file while they are executed."""
     if not self.imp_client.connected:
       print_to_stderr('Not connected to Impala, could not execute queries.')
       return False
-    queries = [ self.sanitise_input(q) for q in self.cmdqueue + queries ]
+    queries = (self.sanitise_input(q) for q in chain(list(self.cmdqueue), queries))
     for q in queries:
       if self.onecmd(q) is CmdStatus.ERROR:
         print_to_stderr('Could not execute command: %s' % q)
         if not self.ignore_query_failure: return False
     return True
 
+  def execute_query_list_pipelined(self, queries):
+    """Like execute_query_list(), but statements that do not depend on each other run
+    concurrently over up to 'pipeline_sessions' sessions (see statement_pipeline.py).
+    Results are printed in the order of the statements. Commands that are
+    processed by the shell, such as SET, USE or SYNC, wait for all previous statements
+    to finish before they are executed.
+    """
+    from statement_pipeline import PipelinedStatement, StatementPipeline
+    if not self.imp_client.connected:
+      print_to_stderr('Not connected to Impala, could not execute queries.')
+      return False
+    queries = (self.sanitise_input(q) for q in chain(list(self.cmdqueue), queries))
+    self.pipeline = StatementPipeline(self._new_pipeline_session, self.pipeline_sessions)
+    # Submitted statements whose results have not been printed yet. Their rows are
+    # printed while waiting for the pipeline, since the row buffers are bounded.
+    submitted = []
+    print_results = lambda: self._print_pipelined_results(submitted)
+    success = False
+    try:
+      for q in queries:
+        if q.split(None, 1) and q.split(None, 1)[0] in ImpalaShell.PIPELINED_COMMANDS:
+          sql = self._replace_variables(q)
+          if sql is None:
+            print_to_stderr('Could not execute command: %s' % q)
+            if not self.ignore_query_failure: return False
+            continue
+          if self.result_cache is not None:
+            self.result_cache.invalidate(sql)
+          statement = PipelinedStatement(sql, self.set_query_options, self.current_db)
+          if not self.pipeline.submit(statement, print_results): return False
+          submitted.append(statement)
+        else:
+          if not self.pipeline.drain(print_results): return False
+          if not self._print_pipelined_results(submitted): return False
+          if self.onecmd(q) is CmdStatus.ERROR:
+            print_to_stderr('Could not execute command: %s' % q)
+            if not self.ignore_query_failure: return False
+        if not self._print_pipelined_results(submitted): return False
+      if not self.pipeline.drain(print_results): return False
+      success = self._print_pipelined_results(submitted)
+      return success
+    finally:
+      if not success:
+        # Statements following a failed one would not have been executed serially.
+        self.pipeline.cancel()
+        self.pipeline.drain()
+      self.pipeline.close()
+      self.pipeline = None
+
+  def execute_query_files_parallel(self, pattern, num_sessions):
+    """Executes the query files that match the glob 'pattern' concurrently over up to
+    'num_sessions' sessions. Prints the progress and a summary of the failed files.
+    Returns whether all files succeeded."""
+    from glob import glob
+    from parallel_source import ParallelSource, SourceFile
+    if not self.imp_client.connected:
+      print_to_stderr('Not connected to Impala, could not execute queries.')
+      return False
+    files = [SourceFile(path) for path in sorted(glob(os.path.expanduser(pattern)))]
+    if not files:
+      print_to_stderr("No files match '%s'" % pattern)
+      return False
+    start_time = time.time()
+    self.parallel_source = ParallelSource(self._new_pipeline_session, files,
+        num_sessions, self.current_db, self.set_query_options,
+        parse_query_file, self._prepare_source_statement,
+        ImpalaShell.PIPELINED_COMMANDS, ImpalaShell.VALID_SHELL_OPTIONS.keys(),
+        self.ignore_query_failure)
+    self.parallel_source.start()
+    try:
+      while True:
+        done = self.parallel_source.is_done()
+        events = self.parallel_source.get_events(
+            not done and self.EXPORT_WAIT_INTERVAL_S or 0)
+        if self.print_progress:
+          self.progress_stream.clear()
+        for event in events:
+          self._print_if_verbose(event)
+        if done:
+          break
+        if self.print_progress:
+          num_done = len([f for f in files if f.done.is_set()])
+          num_failed = len([f for f in files if f.error is not None])
+          self.progress_stream.write("%d of %d file(s) done, %d failed\n" % (
+              num_done, len(files), num_failed))
+      self.parallel_source.close()
+    finally:
+      self.parallel_source = None
+    failed = [f for f in files if f.error is not None]
+    self._print_if_verbose("Executed %d file(s) in %2.2fs, %d failed" % (
+        len(files), time.time() - start_time, len(failed)))
+    for source_file in failed:
+      print_to_stderr("Failed: %s" % source_file.path)
+      if source_file.failed_statement is not None:
+        print_to_stderr("  Statement: %s" % source_file.failed_statement)
+      print_to_stderr("  Error: %s" % str(source_file.error).strip())
+    return not failed
+
+  def _prepare_source_statement(self, statement):
+    return self._replace_variables(self.sanitise_input(statement))
+
+  def _new_pipeline_session(self):
+    imp_client = self._new_impala_client()
+    imp_client.connect()
+    return imp_client
+
+  def _print_pipelined_results(self, statements):
+    """Prints the rows fetched so far by the statement at the head of 'statements', then
+    the results of the finished statements at its head and removes them from it. Returns
+    False if one of them failed and execution should not continue."""
+    while statements:
+      statement = statements[0]
+      done = statement.done.is_set()
+      if statement.output_stream is None and statement.column_names is not None:
+        self._print_if_verbose("Query: %s" % statement.sql)
+        statement.output_stream = self._create_output_stream(statement.column_names)
+      if statement.output_stream is not None:
+        while not statement.row_batches.empty():
+          statement.output_stream.write(statement.row_batches.get_nowait())
+      if not done:
+        return True
+      statements.pop(0)
+      if statement.output_stream is None:
+        self._print_if_verbose("Query: %s" % statement.sql)
+      else:
+        statement.output_stream.finish()
+      if statement.error is not None:
+        print_to_stderr(statement.error)
+        print_to_stderr('Could not execute command: %s' % statement.sql)
+        if not self.ignore_query_failure: return False
+        continue
+      if statement.warning_log:
+        self._print_if_verbose(statement.warning_log)
+      if statement.is_insert or statement.column_names is not None:
+        verb = ["Fetch", "Insert"][statement.is_insert]
+        self._print_if_verbose(get_row_count_message(verb, statement.num_rows,
+                                                     statement.elapsed_secs))
+    return True
 
 TIPS=[
   "Press TAB twice to see a list of available commands.",
@@ -1148,7 +1996,7 @@ TIPS=[
   "To see live updates on a query's progress, run 'set LIVE_SUMMARY=1;'.",
   "To see a summary of a query's progress that updates in real-time, run 'set \
 LIVE_PROGRESS=1;'.",
-  "The HISTORY command lists all shell commands in chronological order.",
+  "The HISTORY command lists, searches and replays the statements of past sessions.",
   "The '-B' command line flag turns off pretty-printing for query results. Use this flag \
 to remove formatting from results you want to save for later, or to benchmark Impala.",
   "You can run a single query from the command line using the '-q' option.",
@@ -1190,25 +2038,46 @@ Welcome to the Impala shell.
 def print_to_stderr(message):
   print >> sys.stderr, message
 
+def format_history_entry(entry):
+  """Returns when the statement of a history log entry was executed, how long it took
+  and whether it failed, as far as known."""
+  text = '-'
+  if entry.start_time:
+    text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.start_time))
+  if entry.elapsed_secs is not None:
+    text += " %.2fs" % entry.elapsed_secs
+  if entry.failed:
+    text += " failed"
+  return text
+
+def get_row_count_message(verb, num_rows, elapsed_secs):
+  """Returns the message printed after a statement returned or inserted 'num_rows' rows.
+  'num_rows' is None if the number of inserted rows is not known."""
+  if num_rows is None:
+    return "%sed row(s) in %2.2fs" % (verb, elapsed_secs)
+  return "%sed %d row(s) in %2.2fs" % (verb, num_rows, elapsed_secs)
+
 def parse_query_text(query_text, utf8_encode_policy='strict'):
-  """Parse query file text to extract queries and encode into utf-8"""
-  query_list = [q.encode('utf-8', utf8_encode_policy) for q in sqlparse.split(query_text)]
-  # Remove trailing comments in the input, if any. We do this because sqlparse splits the
-  # input at query boundaries and associates the query only with preceding comments
-  # (following comments are associated with the next query). This is a problem with
-  # trailing comments. For example, consider the following input:
-  # -------------
-  # -- comment1
-  # select 1;
-  # -- comment2
-  # -------------
-  # When sqlparse splits the query, "comment1" is associated with the query "select 1" and
-  # "--comment2" is sent as is. Impala's parser however doesn't consider it a valid SQL
-  # and throws an exception. We identify such trailing comments and ignore them (do not
-  # send them to Impala).
-  if query_list and not sqlparse.format(query_list[-1], strip_comments=True).strip("\n"):
-    query_list.pop()
-  return query_list
+  """Parse query file text to extract queries and encode into utf-8. Trailing comments
+  in the input, if any, are dropped, since Impala's parser doesn't consider a statement
+  that only consists of comments valid SQL."""
+  return [q.encode('utf-8', utf8_encode_policy)
+          for q in split_statements(decode_statement(query_text))]
+
+def parse_query_file(query_file, utf8_encode_policy='strict'):
+  """Like parse_query_text(), but reads the text from 'query_file' in chunks and yields
+  each query as soon as it is complete. Only one query is held in memory at a time."""
+  splitter = StatementSplitter()
+  while True:
+    chunk = query_file.read(QUERY_FILE_CHUNK_SIZE)
+    if not chunk:
+      break
+    # Delimiters, quotes and comment markers are single bytes in utf-8, so the chunks
+    # can be split before they are decoded.
+    for query in splitter.feed(chunk):
+      yield decode_statement(query).encode('utf-8', utf8_encode_policy)
+  for query in splitter.flush():
+    yield decode_statement(query).encode('utf-8', utf8_encode_policy)
 
 def parse_variables(keyvals):
   """Parse variable assignments passed as arguments in the command line"""
@@ -1226,9 +2095,34 @@ def parse_variables(keyvals):
         vars[match.groups()[0].upper()] = match.groups()[1]
   return vars
 
+def run_connection_broker(options):
+  """Runs a connection broker that authenticates with the shell's options until it is
+  interrupted."""
+  from connection_broker import ConnectionBroker
+
+  def new_client(impalad):
+    client = CLIENT_CLASSES[options.protocol](impalad, options.use_kerberos,
+        options.kerberos_service_name, options.ssl, options.ca_cert, options.user,
+        options.ldap_password, options.use_ldap)
+    client.connect()
+    return client
+
+  broker = ConnectionBroker(options.connection_broker, new_client)
+  print_to_stderr("Connection broker listening on %s" % options.connection_broker)
+  try:
+    try:
+      broker.serve_forever()
+    except KeyboardInterrupt:
+      pass
+  finally:
+    broker.close()
+
 def execute_queries_non_interactive_mode(options):
   """Run queries in non-interactive mode."""
-  if options.query_file:
+  if options.parallel_query_files:
+    # The query file is a glob pattern, the files are opened by the shell.
+    queries = None
+  elif options.query_file:
     try:
       # "-" here signifies input from STDIN
       if options.query_file == "-":
@@ -1239,14 +2133,21 @@ def execute_queries_non_interactive_mode(options):
       print_to_stderr("Could not open file '%s': %s" % (options.query_file, e))
       sys.exit(1)
 
-    query_text = query_file_handle.read()
+    queries = parse_query_file(query_file_handle)
   elif options.query:
-    query_text = options.query
+    queries = parse_query_text(options.query)
   else:
     return
 
-  queries = parse_query_text(query_text)
-  if not ImpalaShell(options).execute_query_list(queries):
+  shell = ImpalaShell(options)
+  if options.parallel_query_files:
+    success = shell.execute_query_files_parallel(options.query_file,
+                                                 options.parallel_query_files)
+  elif options.query_file and options.pipeline_sessions > 1:
+    success = shell.execute_query_list_pipelined(queries)
+  else:
+    success = shell.execute_query_list(queries)
+  if not success:
     sys.exit(1)
 
 if __name__ == "__main__":
@@ -1267,6 +2168,7 @@ if __name__ == "__main__":
     print_to_stderr('%s not found.\n' % user_config)
     sys.exit(1)
 
+  default_impalad = impala_shell_defaults['impalad']
   # default options loaded in from impala_shell_config_defaults.py
   # options defaults overwritten by those in config file
   try:
@@ -1279,6 +2181,10 @@ if __name__ == "__main__":
   parser = get_option_parser(impala_shell_defaults)
   options, args = parser.parse_args()
 
+  # The built-in default impalad uses the Beeswax port.
+  if options.impalad == default_impalad and options.protocol == 'hs2':
+    options.impalad = "%s:%s" % (socket.getfqdn(), DEFAULT_PORTS['hs2'])
+
   # Arguments that could not be parsed are stored in args. Print an error and exit.
   if len(args) > 0:
     print_to_stderr('Error, could not parse arguments "%s"' % (' ').join(args))
@@ -1346,6 +2252,33 @@ if __name__ == "__main__":
       print_to_stderr('Error opening output file for writing: %s' % e)
       sys.exit(1)
 
+  if options.output_format == 'parquet':
+    if not options.output_file:
+      print_to_stderr("--output_format=parquet requires --output_file")
+      sys.exit(1)
+    if options.pipeline_sessions > 1:
+      print_to_stderr("--output_format=parquet cannot be used with --pipeline_sessions")
+      sys.exit(1)
+
+  if options.parallel_query_files is not None:
+    if not options.query_file or options.parallel_query_files < 1:
+      print_to_stderr("--parallel_query_files requires a positive number of files and "
+                      "--query_file")
+      sys.exit(1)
+
+  if options.export_sessions < 1:
+    print_to_stderr("--export_sessions must be positive")
+    sys.exit(1)
+
+  if options.connection_broker:
+    options.connection_broker = os.path.expanduser(options.connection_broker)
+  if options.run_connection_broker:
+    if not options.connection_broker:
+      print_to_stderr("--run_connection_broker requires --connection_broker")
+      sys.exit(1)
+    run_connection_broker(options)
+    sys.exit(0)
+
   options.variables = parse_variables(options.keyval)
   if options.query or options.query_file:
     if options.print_progress or options.print_summary:
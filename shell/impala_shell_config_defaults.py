@@ -30,6 +30,7 @@ impala_shell_defaults = {
             'use_kerberos': False,
             'output_file': None,
             'write_delimited': False,
+            'output_format': 'text',
             'print_header': False,
             'output_delimiter': '\\t',
             'kerberos_service_name': 'impala',
@@ -45,5 +46,19 @@ impala_shell_defaults = {
             'ca_cert': None,
             'config_file': os.path.expanduser("~/.impalarc"),
             'print_progress' : False,
-            'print_summary' : False
+            'print_summary' : False,
+            'pipeline_sessions': None,
+            'parallel_query_files': None,
+            'export_sessions': 8,
+            'result_cache': False,
+            'result_cache_dir': os.path.expanduser("~/.impala_shell_cache"),
+            'result_cache_max_mb': 256,
+            'result_cache_ttl_s': 3600,
+            'protocol': 'beeswax',
+            'timing_file': None,
+            'client_profile': None,
+            'connection_broker': None,
+            'run_connection_broker': False,
+            'completion_cache_ttl_s': 600,
+            'history_max_mb': 16
             }
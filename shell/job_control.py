@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Background execution of statements in the interactive shell.
+#
+# A statement that ends with '&' runs as a job, over a session of its own, while the
+# shell keeps accepting commands. The job waits for the statement to finish and, if the
+# statement returns rows, keeps the query open until its results are fetched with the
+# FETCH command or it is cancelled. The rows are fetched only then, so a job does not
+# buffer its results in the shell.
+
+import threading
+import time
+
+from statement_pipeline import is_insert_statement
+
+
+class Job(object):
+  """A statement executed in the background."""
+
+  RUNNING = 'Running'
+  # The statement returns rows that are ready to be fetched.
+  READY = 'Ready'
+  FINISHED = 'Finished'
+  FAILED = 'Failed'
+  CANCELLED = 'Cancelled'
+
+  def __init__(self, job_id, sql, db, query_options):
+    self.id = job_id
+    self.sql = sql
+    self.db = db
+    self.query_options = dict(query_options)
+    self.is_insert = is_insert_statement(sql)
+    self.state = Job.RUNNING
+    # The session of the job, until the job is removed.
+    self.client = None
+    self.query_handle = None
+    self.num_rows = None
+    self.warning_log = None
+    self.error = None
+    self.cancelled = False
+    # Whether the shell told the user that the job is done.
+    self.reported = False
+    self.start_time = time.time()
+    self.end_time = None
+    self.done = threading.Event()
+
+  def get_elapsed_secs(self):
+    return (self.end_time or time.time()) - self.start_time
+
+  def get_query_id(self):
+    if self.query_handle is None:
+      return None
+    return self.query_handle.id
+
+  def get_status_message(self):
+    """Returns a line that describes the job and its state, as the shell prints it."""
+    message = "[%d] %s: %s" % (self.id, self.state, ' '.join(self.sql.split()))
+    if self.state == Job.READY:
+      message += " (FETCH %d to print the results)" % self.id
+    elif self.state == Job.FAILED:
+      message += "\n%s" % self.error
+    return message
+
+
+class JobManager(object):
+  """Runs statements as jobs, each over its own session. 'client_factory' must return a
+  new ImpalaClient that is already connected."""
+
+  # Number of jobs that may hold a session at the same time.
+  MAX_JOBS = 16
+  # Seconds between checks of whether waiting for jobs was interrupted.
+  WAIT_INTERVAL_S = 0.1
+
+  def __init__(self, client_factory):
+    self.client_factory = client_factory
+    self.jobs = {}
+    self.next_job_id = 1
+    # Set to interrupt wait().
+    self.wait_interrupted = threading.Event()
+    self.waiting = False
+
+  def submit(self, sql, db, query_options):
+    """Starts executing 'sql' in database 'db' with 'query_options' as a new job.
+    Returns the job, or None if there are too many jobs."""
+    if len(self.jobs) >= self.MAX_JOBS:
+      return None
+    job = Job(self.next_job_id, sql, db, query_options)
+    self.next_job_id += 1
+    self.jobs[job.id] = job
+    worker = threading.Thread(target=self._run_job, args=(job,), name="Job %d" % job.id)
+    worker.daemon = True
+    worker.start()
+    return job
+
+  def get(self, job_id):
+    return self.jobs.get(job_id)
+
+  def get_jobs(self):
+    """Returns the jobs ordered by their ids."""
+    return [self.jobs[job_id] for job_id in sorted(self.jobs)]
+
+  def get_unreported_jobs(self):
+    """Returns the jobs that are done but have not been reported to the user yet."""
+    return [job for job in self.get_jobs() if job.done.is_set() and not job.reported]
+
+  def report(self, job):
+    """Marks 'job' as reported. Jobs without results to fetch are removed then."""
+    job.reported = True
+    if job.state != Job.READY:
+      self.remove(job)
+
+  def wait(self, jobs):
+    """Waits until 'jobs' are done. Returns False if interrupted by interrupt_wait()."""
+    self.wait_interrupted.clear()
+    self.waiting = True
+    try:
+      for job in jobs:
+        while not job.done.is_set():
+          if self.wait_interrupted.is_set():
+            return False
+          job.done.wait(self.WAIT_INTERVAL_S)
+      return True
+    finally:
+      self.waiting = False
+
+  def interrupt_wait(self):
+    self.wait_interrupted.set()
+
+  def cancel(self, job):
+    """Cancels 'job' if its query is still open. The cancellation request is sent over a
+    new connection, since the session of the job may be busy."""
+    job.cancelled = True
+    if job.query_handle is None or job.state not in (Job.RUNNING, Job.READY):
+      return
+    client = self.client_factory()
+    try:
+      client.cancel_query(job.query_handle)
+    finally:
+      client.close_connection()
+
+  def remove(self, job):
+    """Closes the query and the session of 'job' and forgets it. A job whose results were
+    not fetched counts as cancelled."""
+    if job.state == Job.READY:
+      job.state = Job.CANCELLED
+      try:
+        job.client.close_query(job.query_handle)
+      except Exception:
+        # The query may have been cancelled.
+        pass
+    self._close_session(job)
+    self.jobs.pop(job.id, None)
+
+  def close(self):
+    """Cancels the running jobs and closes all sessions, e.g. when the shell exits."""
+    for job in self.get_jobs():
+      if not job.done.is_set():
+        try:
+          self.cancel(job)
+        except Exception:
+          pass
+      else:
+        self.remove(job)
+
+  def _run_job(self, job):
+    try:
+      try:
+        job.client = self.client_factory()
+        self._execute(job)
+      except Exception, e:
+        if job.cancelled:
+          job.state = Job.CANCELLED
+        else:
+          job.state = Job.FAILED
+          job.error = e
+    finally:
+      job.end_time = time.time()
+      if job.state != Job.READY:
+        self._close_session(job)
+      job.done.set()
+
+  def _execute(self, job):
+    client = job.client
+    if job.db:
+      use_query = client.create_beeswax_query('use `%s`' % job.db.strip('`'), {})
+      handle = client.execute_query(use_query)
+      client.wait_to_finish(handle)
+      client.close_query(handle)
+    if job.cancelled:
+      raise Exception("Cancelled")
+    query = client.create_beeswax_query(job.sql, job.query_options)
+    job.query_handle = client.execute_query(query)
+    if job.cancelled:
+      # The job was cancelled before its query was known.
+      client.cancel_query(job.query_handle)
+      raise Exception("Cancelled")
+    client.wait_to_finish(job.query_handle)
+    job.warning_log = client.get_warning_log(job.query_handle)
+    if job.is_insert:
+      job.num_rows = client.close_insert(job.query_handle)
+    elif client.expect_result_metadata(job.sql):
+      job.state = Job.READY
+      return
+    else:
+      client.close_query(job.query_handle)
+    job.state = Job.FINISHED
+
+  def _close_session(self, job):
+    if job.client is None:
+      return
+    try:
+      job.client.close_connection()
+    except Exception:
+      pass
+    job.client = None
@@ -114,6 +114,19 @@ cp ${SHELL_HOME}/impala_shell_config_defaults.py ${TARBALL_ROOT}/lib
 cp ${SHELL_HOME}/impala_client.py ${TARBALL_ROOT}/lib
 cp ${SHELL_HOME}/TSSLSocketWithWildcardSAN.py ${TARBALL_ROOT}/lib
 cp ${SHELL_HOME}/shell_output.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/statement_pipeline.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/statement_splitter.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/result_cache.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/parquet_output.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/parallel_export.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/parallel_source.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/statement_timing.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/job_control.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/completion_cache.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/history_log.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/progress_refresher.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/connection_broker.py ${TARBALL_ROOT}/lib
+cp ${SHELL_HOME}/impala_pretty_table.py ${TARBALL_ROOT}/lib
 cp ${SHELL_HOME}/pkg_resources.py ${TARBALL_ROOT}/lib
 cp ${SHELL_HOME}/impala-shell ${TARBALL_ROOT}
 cp ${SHELL_HOME}/impala_shell.py ${TARBALL_ROOT}
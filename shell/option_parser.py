@@ -25,7 +25,8 @@
 # refresh_after_connect=true
 #
 
-import ConfigParser
+import os
+
 from impala_shell_config_defaults import impala_shell_defaults
 from optparse import OptionParser
 
@@ -36,7 +37,10 @@ def get_config_from_file(config_filename):
   because ConfigParser reads values as strings
 
   """
-
+  if not os.path.isfile(config_filename):
+    return []
+  # Most invocations of the shell do not use a configuration file.
+  import ConfigParser
   config = ConfigParser.ConfigParser()
   config.read(config_filename)
   section_title = "impala"
@@ -88,6 +92,12 @@ def get_option_parser(defaults):
   parser.add_option("-B", "--delimited", dest="write_delimited",
                     action="store_true",
                     help="Output rows in delimited mode")
+  parser.add_option("--output_format", dest="output_format", type="choice",
+                    choices=["text", "parquet"],
+                    help="Format of the query results written to --output_file. "
+                    "'parquet' writes a Parquet file with the column types of the "
+                    "result, in row groups as the results are fetched. Each result "
+                    "replaces the file, so only one query should return results.")
   parser.add_option("--print_header", dest="print_header",
                     action="store_true",
                     help="Print column names in delimited mode"
@@ -151,6 +161,71 @@ def get_option_parser(defaults):
                     help="Shell command to run to retrieve the LDAP password")
   parser.add_option("--var", dest="keyval", action="append",
                     help="Define variable(s) to be used within the Impala session.")
+  parser.add_option("--pipeline_sessions", dest="pipeline_sessions", type="int",
+                    help="If greater than 1, statements from the query file (-f) that "
+                    "do not depend on each other are executed concurrently over up to "
+                    "this many sessions. Results are printed in the order of the "
+                    "statements. A statement that returns rows waits while it has "
+                    "more rows buffered than can be printed, until the statements "
+                    "before it finished. A SYNC statement waits for all previous "
+                    "statements to finish.")
+  parser.add_option("--parallel_query_files", dest="parallel_query_files", type="int",
+                    help="Execute the query files that match the glob pattern given "
+                    "with -f concurrently, each over its own session, with up to this "
+                    "many files at a time. The rows returned by queries are not printed. "
+                    "Also available as the SOURCE PARALLEL command.")
+  parser.add_option("--export_sessions", dest="export_sessions", type="int",
+                    help="Maximum number of partitions that the EXPORT command "
+                    "executes at a time, each over its own session.")
+  parser.add_option("--result_cache", dest="result_cache", action="store_true",
+                    help="Cache the results of SELECT, WITH and VALUES queries on local "
+                    "disk and serve repeated queries from the cache. Results are "
+                    "invalidated by statements that write the tables they mention. "
+                    "Use the CACHE command to inspect or control the cache.")
+  parser.add_option("--result_cache_dir", dest="result_cache_dir",
+                    help="Directory in which query results are cached. It must be "
+                    "owned by the current user and not be writable by others.")
+  parser.add_option("--result_cache_max_mb", dest="result_cache_max_mb", type="int",
+                    help="Maximum size of the result cache in MB. The least recently "
+                    "used results are evicted first.")
+  parser.add_option("--result_cache_ttl_s", dest="result_cache_ttl_s", type="int",
+                    help="Number of seconds after which a cached result expires.")
+  parser.add_option("--protocol", dest="protocol", type="choice",
+                    choices=["beeswax", "hs2"],
+                    help="Protocol used to talk to the impalad, either 'beeswax' or "
+                    "'hs2'. With 'hs2', results are fetched in columnar form from the "
+                    "HiveServer2 port, which is the default port then, and the number "
+                    "of inserted rows is not reported.")
+  parser.add_option("--timing_file", dest="timing_file",
+                    help="Append how long each statement spent in each phase of its "
+                    "execution on the client, and its RPC counts and bytes, to this "
+                    "file as JSON lines. The TIMING command prints the timing of the "
+                    "last statement.")
+  parser.add_option("--client_profile", dest="client_profile",
+                    help="Profile the shell with cProfile while it executes a statement "
+                    "and write the stats of the last statement to this file. The TIMING "
+                    "command also prints the most expensive functions.")
+  parser.add_option("--connection_broker", dest="connection_broker",
+                    help="Path of the unix socket of a connection broker. Connections "
+                    "to the impalad are borrowed from the broker, which keeps them "
+                    "authenticated between shells, instead of being established by "
+                    "the shell. Falls back to a direct connection if the broker is not "
+                    "running.")
+  parser.add_option("--run_connection_broker", dest="run_connection_broker",
+                    action="store_true",
+                    help="Run a connection broker on the unix socket given by "
+                    "--connection_broker instead of a shell. The broker authenticates "
+                    "with the options given to it, and runs until it is interrupted.")
+  parser.add_option("--history_max_mb", dest="history_max_mb", type="int",
+                    help="Maximum size in MB of the log of the statements executed in "
+                    "interactive shells, which the HISTORY command searches and "
+                    "replays. The oldest statements are dropped first.")
+  parser.add_option("--completion_cache_ttl_s", dest="completion_cache_ttl_s",
+                    type="int",
+                    help="Number of seconds after which the database, table and column "
+                    "names that the interactive shell caches for TAB completion are "
+                    "fetched again. The names are fetched in the background. 0 disables "
+                    "the completion of names.")
 
   # add default values to the help text
   for option in parser.option_list:
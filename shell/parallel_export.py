@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Parallel export of the result of a query into one file per partition.
+#
+# The query is split into partitions by wrapping it into one query per partition that
+# selects the rows of that partition, either by the hash of an expression or by ranges
+# of an integer column. Up to a given number of partition queries run concurrently, each
+# over its own session, and each result is written to its own file as it is fetched, so
+# the export is not limited by how fast a single session can fetch rows from its
+# coordinator. A partition that fails is retried from the start over a new session.
+
+import re
+import threading
+import time
+
+from Queue import Queue, Empty
+
+# Matches the arguments of the EXPORT command, see parse_export_args().
+EXPORT_ARGS_PATTERN = re.compile(
+    r'^(?P<path>\S+)\s+partitions\s+(?P<num_partitions>\d+)\s+'
+    r'(?:on\s+(?P<impalads>\S+)\s+)?by\s+'
+    r'(?:range\s*\(\s*(?P<column>[^,()]+?)\s*,'
+    r'\s*(?P<low>-?\d+)\s*,\s*(?P<high>-?\d+)\s*\)'
+    r'|(?P<expression>.+?))\s+(?P<query>(?:select|with|values)\b.*)$', re.I | re.S)
+
+
+class ExportArgs(object):
+  """The parsed arguments of an EXPORT command."""
+
+  def __init__(self, path, num_partitions, impalads, query, expression=None,
+               column=None, low=None, high=None):
+    self.path = path
+    self.num_partitions = num_partitions
+    self.impalads = impalads
+    self.query = query
+    self.expression = expression
+    self.column = column
+    self.low = low
+    self.high = high
+
+
+def parse_export_args(args):
+  """Parses the arguments of
+    EXPORT <path> PARTITIONS <n> [ON <host:port>[,<host:port>...]]
+        BY {<expression> | RANGE(<column>, <low>, <high>)} <query>
+  Returns an ExportArgs, or None if 'args' does not match."""
+  match = EXPORT_ARGS_PATTERN.match(args.strip())
+  if match is None or int(match.group('num_partitions')) < 1:
+    return None
+  impalads = []
+  if match.group('impalads'):
+    impalads = [tuple(impalad.split(':', 1))
+                for impalad in match.group('impalads').split(',')]
+    if [impalad for impalad in impalads if len(impalad) != 2]:
+      return None
+  low, high = match.group('low'), match.group('high')
+  if low is not None:
+    low, high = int(low), int(high)
+    if low >= high:
+      return None
+  return ExportArgs(match.group('path'), int(match.group('num_partitions')), impalads,
+                    match.group('query').strip().rstrip(';'),
+                    expression=match.group('expression'), column=match.group('column'),
+                    low=low, high=high)
+
+
+def get_partition_queries(export_args):
+  """Returns the queries that select the rows of each partition of the export."""
+  query = export_args.query
+  num_partitions = export_args.num_partitions
+  if export_args.expression is not None:
+    # NULL hashes belong to the first partition.
+    conditions = ['coalesce(pmod(fnv_hash(%s), %d), 0) = %d' % (
+        export_args.expression, num_partitions, i) for i in xrange(num_partitions)]
+  else:
+    column = export_args.column
+    low, high = export_args.low, export_args.high
+    bounds = [low + (high - low) * i / num_partitions for i in xrange(1, num_partitions)]
+    # The first and last partitions are open-ended, so no row is lost if the range is
+    # too narrow. NULLs belong to the first partition.
+    conditions = []
+    for i in xrange(num_partitions):
+      lower = []
+      if i > 0:
+        lower = ['%s >= %d' % (column, bounds[i - 1])]
+      upper = []
+      if i < num_partitions - 1:
+        upper = ['%s < %d' % (column, bounds[i])]
+      if i == 0:
+        upper = ['(%s is null or %s)' % (column, ' and '.join(upper or ['true']))]
+      conditions.append(' and '.join(lower + upper))
+  return ['select * from (%s) export_query where %s' % (query, condition)
+          for condition in conditions]
+
+
+class ExportPartition(object):
+  """A partition of an export, written to the file 'path'."""
+
+  def __init__(self, index, sql, path, impalad=None):
+    self.index = index
+    self.sql = sql
+    self.path = path
+    # The impalad to run the partition on, or None for the shell's impalad.
+    self.impalad = impalad
+    self.query_handle = None
+    self.num_rows = 0
+    self.attempts = 0
+    self.error = None
+    self.elapsed_secs = None
+    self.done = threading.Event()
+
+
+class ParallelExport(object):
+  """Exports 'partitions' over up to 'num_sessions' sessions at a time, one per
+  partition.
+
+  'client_factory' is called with the impalad of a partition and must return a new
+  ImpalaClient that is already connected. 'stream_factory' is called with the path,
+  column names and column types of a partition and must return an output stream with
+  the interface of OutputStream that writes to the path, replacing its contents. The
+  queries run in database 'db' with 'query_options'.
+  """
+
+  # Number of times a partition is executed before the export fails.
+  MAX_ATTEMPTS = 3
+  # Seconds to wait before a failed partition is retried.
+  RETRY_DELAY_S = 1
+
+  def __init__(self, client_factory, stream_factory, partitions, num_sessions, db,
+               query_options):
+    self.client_factory = client_factory
+    self.stream_factory = stream_factory
+    self.partitions = partitions
+    self.num_sessions = num_sessions
+    self.db = db
+    self.query_options = dict(query_options)
+    self.pending = Queue()
+    # Messages about finished, failed and retried partitions for the shell to print.
+    self.events = Queue()
+    self.cancelled = False
+    self.workers = []
+
+  def start(self):
+    for partition in self.partitions:
+      self.pending.put(partition)
+    for i in xrange(min(self.num_sessions, len(self.partitions))):
+      worker = threading.Thread(target=self._run_worker, name="Export worker %d" % i)
+      worker.daemon = True
+      self.workers.append(worker)
+      worker.start()
+
+  def is_done(self):
+    for partition in self.partitions:
+      if not partition.done.is_set():
+        return False
+    return True
+
+  def get_events(self, timeout_s):
+    """Returns the messages posted since the last call, waiting up to 'timeout_s'
+    seconds for the first one."""
+    events = []
+    try:
+      events.append(self.events.get(True, timeout_s))
+      while True:
+        events.append(self.events.get_nowait())
+    except Empty:
+      pass
+    return events
+
+  def get_num_rows(self):
+    return sum([partition.num_rows for partition in self.partitions])
+
+  def cancel(self):
+    """Cancels the running partitions, and skips the ones that have not started.
+    Cancellation requests are sent over new
+    connections, since the sessions are busy fetching results."""
+    self.cancelled = True
+    for partition in self.partitions:
+      if partition.done.is_set() or partition.query_handle is None:
+        continue
+      try:
+        client = self.client_factory(partition.impalad)
+        try:
+          client.cancel_query(partition.query_handle)
+        finally:
+          client.close_connection()
+      except Exception:
+        # The partition may have finished in the meantime.
+        pass
+
+  def close(self):
+    """Waits for the workers to exit. Must be called once is_done() returned True."""
+    for worker in self.workers:
+      worker.join()
+    self.workers = []
+
+  def _run_worker(self):
+    while True:
+      try:
+        partition = self.pending.get_nowait()
+      except Empty:
+        return
+      self._run_partition(partition)
+
+  def _run_partition(self, partition):
+    start_time = time.time()
+    try:
+      while True:
+        partition.attempts += 1
+        partition.num_rows = 0
+        client = None
+        try:
+          try:
+            if self.cancelled:
+              raise Exception("Cancelled")
+            client = self.client_factory(partition.impalad)
+            self._export(client, partition)
+            self.events.put("Exported partition %d: %d row(s) in %2.2fs" % (
+                partition.index, partition.num_rows, time.time() - start_time))
+            return
+          except Exception, e:
+            if self.cancelled or partition.attempts >= self.MAX_ATTEMPTS:
+              partition.error = e
+              self.events.put("Failed to export partition %d: %s" % (partition.index, e))
+              return
+            self.events.put("Retrying partition %d (attempt %d/%d) after error: %s" % (
+                partition.index, partition.attempts + 1, self.MAX_ATTEMPTS, e))
+        finally:
+          if client is not None:
+            try:
+              client.close_connection()
+            except Exception:
+              pass
+        time.sleep(self.RETRY_DELAY_S)
+    finally:
+      partition.elapsed_secs = time.time() - start_time
+      partition.done.set()
+
+  def _export(self, client, partition):
+    if self.db:
+      use_query = client.create_beeswax_query('use `%s`' % self.db.strip('`'), {})
+      handle = client.execute_query(use_query)
+      client.wait_to_finish(handle)
+      client.close_query(handle)
+    query = client.create_beeswax_query(partition.sql, self.query_options)
+    partition.query_handle = client.execute_query(query)
+    column_names = client.get_column_names(partition.query_handle)
+    column_types = client.get_column_types(partition.query_handle)
+    output_stream = self.stream_factory(partition.path, column_names, column_types)
+    try:
+      for rows in client.fetch(partition.query_handle):
+        output_stream.write(rows)
+        partition.num_rows += len(rows)
+    except:
+      output_stream.abort()
+      raise
+    output_stream.finish()
+    client.close_query(partition.query_handle)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Concurrent execution of independent query files.
+#
+# Up to a given number of files are executed at the same time. The statements of each
+# file are executed in order over a new session, so USE and SET in a file only affect
+# the rest of that file. A file stops at its first failed statement, unless failures are
+# ignored. The rows returned by queries are counted but not printed, since the results
+# of concurrent files would be interleaved.
+
+import threading
+import time
+
+from Queue import Queue, Empty
+from statement_pipeline import is_insert_statement
+
+
+class SourceFile(object):
+  """A query file executed by a ParallelSource."""
+
+  def __init__(self, path):
+    self.path = path
+    self.num_statements = 0
+    self.num_rows = 0
+    # The running statement, and the one that failed.
+    self.query_handle = None
+    self.failed_statement = None
+    self.error = None
+    self.elapsed_secs = None
+    self.done = threading.Event()
+
+
+class ParallelSource(object):
+  """Executes the query files 'files' over up to 'num_sessions' sessions at a time.
+
+  'client_factory' must return a new ImpalaClient that is already connected. 'parse_file'
+  is called with an open file and returns its statements. 'prepare' is called with each
+  statement and returns it ready to be executed, e.g. with its variables substituted, or
+  None if it is invalid. Statements start in database 'db' with 'query_options'. Only
+  statements whose first word is in 'commands' are executed, and USE, SET and UNSET,
+  since the files do not run in the shell. For the same reason, SET and UNSET only
+  change query options: the shell options 'shell_options' and variables are rejected.
+  """
+
+  def __init__(self, client_factory, files, num_sessions, db, query_options, parse_file,
+               prepare, commands, shell_options=(), ignore_query_failure=False):
+    self.client_factory = client_factory
+    self.files = files
+    self.num_sessions = num_sessions
+    self.db = db
+    self.query_options = dict(query_options)
+    self.parse_file = parse_file
+    self.prepare = prepare
+    self.commands = commands
+    self.shell_options = [option.upper() for option in shell_options]
+    self.ignore_query_failure = ignore_query_failure
+    self.pending = Queue()
+    # Messages about finished and failed files for the shell to print.
+    self.events = Queue()
+    self.cancelled = False
+    self.workers = []
+
+  def start(self):
+    for source_file in self.files:
+      self.pending.put(source_file)
+    for i in xrange(min(self.num_sessions, len(self.files))):
+      worker = threading.Thread(target=self._run_worker, name="Source worker %d" % i)
+      worker.daemon = True
+      self.workers.append(worker)
+      worker.start()
+
+  def is_done(self):
+    for source_file in self.files:
+      if not source_file.done.is_set():
+        return False
+    return True
+
+  def get_events(self, timeout_s):
+    """Returns the messages posted since the last call, waiting up to 'timeout_s'
+    seconds for the first one."""
+    events = []
+    try:
+      events.append(self.events.get(True, timeout_s))
+      while True:
+        events.append(self.events.get_nowait())
+    except Empty:
+      pass
+    return events
+
+  def cancel(self):
+    """Cancels the running statements, and skips the files that have not started.
+    Cancellation requests are sent over new connections, since the sessions are busy."""
+    self.cancelled = True
+    for source_file in self.files:
+      query_handle = source_file.query_handle
+      if source_file.done.is_set() or query_handle is None:
+        continue
+      try:
+        client = self.client_factory()
+        try:
+          client.cancel_query(query_handle)
+        finally:
+          client.close_connection()
+      except Exception:
+        # The statement may have finished in the meantime.
+        pass
+
+  def close(self):
+    """Waits for the workers to exit. Must be called once is_done() returned True."""
+    for worker in self.workers:
+      worker.join()
+    self.workers = []
+
+  def _run_worker(self):
+    while True:
+      try:
+        source_file = self.pending.get_nowait()
+      except Empty:
+        return
+      start_time = time.time()
+      try:
+        if self.cancelled:
+          source_file.error = "Cancelled"
+        else:
+          self._run_file(source_file)
+        if source_file.error is None:
+          self.events.put("Executed %s: %d statement(s) in %2.2fs" % (
+              source_file.path, source_file.num_statements, time.time() - start_time))
+        else:
+          self.events.put("Failed to execute %s: %s" % (source_file.path,
+                                                         source_file.error))
+      finally:
+        source_file.elapsed_secs = time.time() - start_time
+        source_file.done.set()
+
+  def _run_file(self, source_file):
+    client = None
+    try:
+      try:
+        handle = open(source_file.path, 'r')
+        try:
+          client = self.client_factory()
+          query_options = dict(self.query_options)
+          if self.db:
+            self._execute(client, 'use `%s`' % self.db.strip('`'), {}, source_file)
+          for statement in self.parse_file(handle):
+            if self.cancelled:
+              raise Exception("Cancelled")
+            try:
+              self._run_statement(client, statement, query_options, source_file)
+            except Exception, e:
+              if source_file.failed_statement is None:
+                source_file.failed_statement = statement
+                source_file.error = e
+              if not self.ignore_query_failure:
+                return
+        finally:
+          handle.close()
+      except Exception, e:
+        source_file.error = e
+    finally:
+      source_file.query_handle = None
+      if client is not None:
+        try:
+          client.close_connection()
+        except Exception:
+          pass
+
+  def _run_statement(self, client, statement, query_options, source_file):
+    sql = self.prepare(statement)
+    if sql is None:
+      raise Exception("Invalid statement")
+    tokens = sql.split(None, 1)
+    if not tokens:
+      return
+    command = tokens[0].lower()
+    if command in ('set', 'unset'):
+      args = len(tokens) > 1 and tokens[1] or ''
+      if command == 'set' and '=' in args:
+        option, value = [token.strip() for token in args.split('=', 1)]
+      elif command == 'unset' and args.strip():
+        option, value = args.strip(), None
+      else:
+        raise Exception("Usage: SET <option>=<value> or UNSET <option>")
+      option = option.upper()
+      # Variables are namespaced, e.g. VAR:<name>, unlike query options.
+      if option in self.shell_options or ':' in option:
+        raise Exception("%s %s is not supported in parallel files" % (
+            command.upper(), option))
+      if value is None:
+        query_options.pop(option, None)
+      else:
+        query_options[option] = value
+    elif command == 'use' or command in self.commands:
+      self._execute(client, sql, query_options, source_file)
+    else:
+      raise Exception("Command not supported in parallel files: %s" % command)
+    source_file.num_statements += 1
+
+  def _execute(self, client, sql, query_options, source_file):
+    query = client.create_beeswax_query(sql, query_options)
+    source_file.query_handle = client.execute_query(query)
+    if is_insert_statement(sql):
+      client.wait_to_finish(source_file.query_handle)
+      source_file.num_rows += client.close_insert(source_file.query_handle) or 0
+    elif client.expect_result_metadata(sql):
+      for rows in client.fetch(source_file.query_handle):
+        source_file.num_rows += len(rows)
+      client.close_query(source_file.query_handle)
+    else:
+      client.wait_to_finish(source_file.query_handle)
+      client.close_query(source_file.query_handle)
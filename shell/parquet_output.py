@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Writes query results to Parquet files.
+#
+# Rows are buffered per column until a row group is complete and then written out, so
+# memory use is bounded by the row group size, however large the result is. Every
+# column chunk consists of a single data page of PLAIN encoded values, compressed with
+# gzip. All columns are optional, and their definition levels are encoded with the
+# RLE / bit-packed hybrid encoding.
+#
+# Boolean, integer and floating point columns are written with the corresponding
+# Parquet types. Values of all other types, e.g. strings, timestamps and decimals, are
+# written as UTF8 strings, in the form in which the shell displays them.
+#
+# A file is only complete once its footer is written. If not all rows could be written,
+# the file is removed rather than left looking like a complete, but truncated, result.
+
+import os
+import struct
+import time
+import zlib
+
+from parquet.ttypes import (ColumnChunk, ColumnMetaData, CompressionCodec,
+    ConvertedType, DataPageHeader, Encoding, FieldRepetitionType, FileMetaData,
+    PageHeader, PageType, RowGroup, SchemaElement, Type)
+from shell_output import ColumnarBatch
+from thrift.protocol import TCompactProtocol
+from thrift.transport import TTransport
+
+MAGIC = 'PAR1'
+CREATED_BY = 'impala-shell'
+
+# The Parquet types of the column types that are not written as strings, and the
+# functions that parse the values of these types from their display strings.
+PARQUET_TYPES = {
+    'boolean': (Type.BOOLEAN, lambda value: value == 'true'),
+    'tinyint': (Type.INT32, int),
+    'smallint': (Type.INT32, int),
+    'int': (Type.INT32, int),
+    'bigint': (Type.INT64, long),
+    'float': (Type.FLOAT, float),
+    'double': (Type.DOUBLE, float)}
+# The converted types of the column types that are narrower than their Parquet types.
+CONVERTED_TYPES = {'tinyint': ConvertedType.INT_8, 'smallint': ConvertedType.INT_16}
+# The struct format characters of the fixed width Parquet types, and their widths.
+STRUCT_FORMATS = {Type.INT32: ('i', 4), Type.INT64: ('q', 8), Type.FLOAT: ('f', 4),
+                  Type.DOUBLE: ('d', 8)}
+
+
+def encode_varint(value):
+  """Returns the ULEB128 encoding of the non-negative integer 'value'."""
+  encoded = []
+  while value >= 0x80:
+    encoded.append(chr(value & 0x7f | 0x80))
+    value >>= 7
+  encoded.append(chr(value))
+  return ''.join(encoded)
+
+
+def pack_bits(bits):
+  """Packs a list of 0s and 1s into bytes, least significant bit first. The last byte is
+  padded with zeros."""
+  bits = list(bits) + [0] * (-len(bits) % 8)
+  return ''.join([chr(bits[i] | bits[i + 1] << 1 | bits[i + 2] << 2 | bits[i + 3] << 3 |
+                      bits[i + 4] << 4 | bits[i + 5] << 5 | bits[i + 6] << 6 |
+                      bits[i + 7] << 7) for i in xrange(0, len(bits), 8)])
+
+
+def encode_definition_levels(levels, num_nulls):
+  """Returns the definition levels, 1 for a value and 0 for NULL, in the RLE / bit-packed
+  hybrid encoding with a bit width of 1, preceded by their length."""
+  if num_nulls == 0:
+    # A single run of 1s.
+    encoded = encode_varint(len(levels) << 1) + '\x01'
+  else:
+    encoded = encode_varint((len(levels) + 7) / 8 << 1 | 1) + pack_bits(levels)
+  return struct.pack('<i', len(encoded)) + encoded
+
+
+def serialize(thrift_struct):
+  """Returns 'thrift_struct' serialized with the compact protocol, as Parquet metadata
+  is."""
+  transport = TTransport.TMemoryBuffer()
+  thrift_struct.write(TCompactProtocol.TCompactProtocol(transport))
+  return transport.getvalue()
+
+
+def gzip_compress(data):
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+
+class ColumnWriter(object):
+  """Buffers the values of a column for the current row group."""
+
+  def __init__(self, name, column_type):
+    self.name = name
+    # Type parameters, e.g. the precision of decimals, do not affect the Parquet type.
+    base_type = column_type.split('(')[0].strip().lower()
+    self.type, self.parse = PARQUET_TYPES.get(base_type, (Type.BYTE_ARRAY, None))
+    self.converted_type = CONVERTED_TYPES.get(base_type)
+    if self.type == Type.BYTE_ARRAY:
+      self.converted_type = ConvertedType.UTF8
+    self.reset()
+
+  def reset(self):
+    self.values = []
+    self.definition_levels = []
+    self.num_nulls = 0
+    self.buffered_bytes = 0
+
+  def get_schema_element(self):
+    return SchemaElement(name=self.name, type=self.type,
+                         repetition_type=FieldRepetitionType.OPTIONAL,
+                         converted_type=self.converted_type)
+
+  def add_display_values(self, values):
+    """Adds values given as the strings that the shell displays, with 'NULL' for
+    NULLs."""
+    values = list(values)
+    for i, value in enumerate(values):
+      if value == 'NULL':
+        values[i] = None
+    self.add_values(values, self.parse)
+
+  def add_values(self, values, parse=None):
+    """Adds the values in the list 'values', with None for NULLs. 'parse' converts each
+    value to the Python type of the column, if needed."""
+    defined = [value is not None for value in values]
+    num_nulls = len(values) - sum(defined)
+    if num_nulls:
+      values = [value for value in values if value is not None]
+    if parse is not None:
+      values = map(parse, values)
+    if self.type == Type.BYTE_ARRAY:
+      values = [isinstance(value, unicode) and value.encode('utf-8') or str(value)
+                for value in values]
+      self.buffered_bytes += sum(map(len, values)) + 4 * len(values)
+    else:
+      self.buffered_bytes += STRUCT_FORMATS.get(self.type, ('', 1))[1] * len(values)
+    self.values.extend(values)
+    self.definition_levels.extend(defined)
+    self.num_nulls += num_nulls
+
+  def write_chunk(self, handle, offset):
+    """Writes the buffered values as a column chunk to 'handle' at file offset 'offset'.
+    Returns the ColumnChunk and clears the buffer."""
+    data = [encode_definition_levels(self.definition_levels, self.num_nulls)]
+    if self.type == Type.BOOLEAN:
+      data.append(pack_bits(self.values))
+    elif self.type == Type.BYTE_ARRAY:
+      data.extend([struct.pack('<i', len(value)) + value for value in self.values])
+    else:
+      data.append(struct.pack('<%d%s' % (len(self.values), STRUCT_FORMATS[self.type][0]),
+                              *self.values))
+    data = ''.join(data)
+    compressed_data = gzip_compress(data)
+    num_values = len(self.definition_levels)
+    page_header = serialize(PageHeader(type=PageType.DATA_PAGE,
+        uncompressed_page_size=len(data), compressed_page_size=len(compressed_data),
+        data_page_header=DataPageHeader(num_values=num_values, encoding=Encoding.PLAIN,
+            definition_level_encoding=Encoding.RLE,
+            repetition_level_encoding=Encoding.RLE)))
+    handle.write(page_header)
+    handle.write(compressed_data)
+    metadata = ColumnMetaData(type=self.type, encodings=[Encoding.PLAIN, Encoding.RLE],
+        path_in_schema=[self.name], codec=CompressionCodec.GZIP, num_values=num_values,
+        total_uncompressed_size=len(page_header) + len(data),
+        total_compressed_size=len(page_header) + len(compressed_data),
+        data_page_offset=offset)
+    self.reset()
+    return ColumnChunk(file_offset=offset, meta_data=metadata)
+
+
+class ParquetWriter(object):
+  """Writes rows to the Parquet file open as 'handle'. 'column_types' are the type names
+  reported by the impalad. A row group is written once the buffered values take about
+  'row_group_bytes' bytes."""
+
+  def __init__(self, handle, column_names, column_types, row_group_bytes):
+    self.handle = handle
+    self.columns = [ColumnWriter(name, column_type)
+                    for name, column_type in zip(column_names, column_types)]
+    self.row_group_bytes = row_group_bytes
+    self.row_groups = []
+    self.num_rows = 0
+    self.buffered_rows = 0
+    # Seconds spent encoding and writing row groups.
+    self.write_secs = 0.0
+    self.handle.write(MAGIC)
+    self.offset = len(MAGIC)
+
+  def write_rows(self, rows):
+    """Writes a list of rows of display strings."""
+    if not rows:
+      return
+    for column, values in zip(self.columns, zip(*rows)):
+      column.add_display_values(values)
+    self._add_rows(len(rows))
+
+  def write_columns(self, columns, num_rows):
+    """Writes 'num_rows' rows given as a list of typed values per column."""
+    if not num_rows:
+      return
+    for column, values in zip(self.columns, columns):
+      column.add_values(values)
+    self._add_rows(num_rows)
+
+  def close(self):
+    """Writes the remaining rows and the file footer. Does not close 'handle'."""
+    if self.buffered_rows:
+      self._write_row_group()
+    schema = [SchemaElement(name='schema', num_children=len(self.columns))]
+    schema.extend([column.get_schema_element() for column in self.columns])
+    footer = serialize(FileMetaData(version=1, schema=schema, num_rows=self.num_rows,
+                                    row_groups=self.row_groups, created_by=CREATED_BY))
+    self.handle.write(footer)
+    self.handle.write(struct.pack('<i', len(footer)))
+    self.handle.write(MAGIC)
+    self.handle.flush()
+
+  def _add_rows(self, num_rows):
+    self.buffered_rows += num_rows
+    if sum([column.buffered_bytes for column in self.columns]) >= self.row_group_bytes:
+      self._write_row_group()
+
+  def _write_row_group(self):
+    start_time = time.time()
+    start = self.offset
+    chunks = []
+    for column in self.columns:
+      chunk = column.write_chunk(self.handle, self.offset)
+      self.offset += chunk.meta_data.total_compressed_size
+      chunks.append(chunk)
+    self.row_groups.append(RowGroup(columns=chunks, total_byte_size=self.offset - start,
+                                    num_rows=self.buffered_rows))
+    self.num_rows += self.buffered_rows
+    self.buffered_rows = 0
+    self.write_secs += time.time() - start_time
+
+
+class ParquetOutputStream(object):
+  """Writes query results to the Parquet file 'filename', replacing it. Has the
+  interface of OutputStream."""
+
+  # Size of the values buffered before a row group is written.
+  ROW_GROUP_BYTES = 32 * 1024 * 1024
+
+  def __init__(self, filename, column_names, column_types):
+    self.filename = filename
+    self.handle = open(filename, 'wb')
+    self.writer = ParquetWriter(self.handle, column_names, column_types,
+                                self.ROW_GROUP_BYTES)
+    # Like in OutputStream. Buffering values counts as formatting, encoding and writing
+    # row groups as writing.
+    self.format_secs = 0.0
+    self.write_secs = 0.0
+    self.bytes_written = 0
+
+  def write(self, data):
+    start_time = time.time()
+    write_secs = self.writer.write_secs
+    if isinstance(data, ColumnarBatch):
+      self.writer.write_columns(data.columns, len(data))
+    else:
+      self.writer.write_rows(data)
+    self._add_times(start_time, write_secs)
+
+  def flush(self):
+    self.handle.flush()
+
+  def finish(self):
+    start_time = time.time()
+    write_secs = self.writer.write_secs
+    self.writer.close()
+    self.bytes_written = self.handle.tell()
+    self.handle.close()
+    self._add_times(start_time, write_secs)
+
+  def abort(self):
+    """Removes the file, since not all rows could be written to it."""
+    self.handle.close()
+    try:
+      os.remove(self.filename)
+    except OSError:
+      pass
+
+  def _add_times(self, start_time, write_secs):
+    """Splits the time since 'start_time' into formatting and writing, given the
+    writer's write time at 'start_time'."""
+    write_secs = self.writer.write_secs - write_secs
+    self.write_secs += write_secs
+    self.format_secs += time.time() - start_time - write_secs
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+
+class ProgressRefresher(object):
+  """Displays the live progress and summary of a running query from a background thread.
+
+  The thread fetches the query's exec summary over its own connection, so the
+  connection that executes the query and fetches its results is never blocked by it.
+  The summary is requested at most once every 'interval_s' seconds and only redrawn if
+  it changed since the last time.
+
+  'get_client' is called from the background thread and must return a connected
+  ImpalaClient that the shell does not use to execute queries. 'render' is called from
+  the background thread with a changed summary and that client, and returns the text to
+  display, or None if there is nothing to display yet.
+  """
+
+  # Maximum seconds that stop() waits for the background thread. It may take longer,
+  # e.g. to connect its client, but then displays nothing after stop() returned.
+  STOP_TIMEOUT_S = 0.1
+
+  def __init__(self, get_client, query_handle, render, output_stream, interval_s):
+    self.get_client = get_client
+    self.query_handle = query_handle
+    self.render = render
+    self.output_stream = output_stream
+    self.interval_s = interval_s
+    self.stopped = threading.Event()
+    # Held while displaying or erasing text, so that nothing is displayed once stopped.
+    self.output_lock = threading.Lock()
+    self.thread = threading.Thread(target=self._run, name="Progress refresher")
+    self.thread.daemon = True
+
+  def start(self):
+    self.thread.start()
+
+  def stop(self):
+    """Stops the background thread and erases the displayed text. Nothing is displayed
+    after this returns. Does not wait long for the thread to exit, so a short query is
+    not delayed by the connection setup of the thread's client."""
+    self.stopped.set()
+    self.thread.join(self.STOP_TIMEOUT_S)
+    self.output_lock.acquire()
+    try:
+      self.output_stream.clear()
+    finally:
+      self.output_lock.release()
+
+  def _run(self):
+    last_summary = None
+    try:
+      client = self.get_client()
+      while True:
+        self.stopped.wait(self.interval_s)
+        if self.stopped.is_set():
+          return
+        summary = client.get_summary(self.query_handle)
+        if summary is None or summary == last_summary:
+          continue
+        last_summary = summary
+        data = self.render(summary, client)
+        if data is None:
+          continue
+        self.output_lock.acquire()
+        try:
+          if not self.stopped.is_set():
+            self.output_stream.write(data)
+        finally:
+          self.output_lock.release()
+    except Exception:
+      # Progress reporting is best effort, the query's own connection reports errors.
+      pass
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# A local, on-disk cache of query results.
+#
+# Each result is stored in its own file in the cache directory, named after the hash of
+# the normalized query text, the current database and the query options that may affect
+# the result. A file holds two pickled records: a header with the query, the words in
+# it and the creation time, followed by the column names and rows. The modification
+# time of a file is updated whenever the result is read, and the least recently used
+# files are evicted once the cache grows beyond its size limit. Since loading a pickle
+# can execute arbitrary code, only a directory that no other user can write to is used.
+
+import cPickle
+import errno
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from statement_pipeline import get_written_tables, WRITTEN_TABLE_PATTERNS
+
+# Statements whose results may be cached.
+CACHEABLE_STATEMENTS = frozenset(['select', 'with', 'values'])
+# Functions whose results differ between executions of the same query.
+NONDETERMINISTIC_FUNCTIONS = frozenset(['now', 'current_timestamp', 'unix_timestamp',
+    'utc_timestamp', 'rand', 'random', 'uuid', 'pid', 'sleep', 'user',
+    'effective_user'])
+# Query options that only affect how a query is executed, not its result.
+RESULT_NEUTRAL_OPTIONS = frozenset(['MEM_LIMIT', 'REQUEST_POOL', 'QUERY_TIMEOUT_S',
+    'RESERVATION_REQUEST_TIMEOUT', 'V_CPU_CORES', 'RM_INITIAL_MEM', 'SYNC_DDL',
+    'EXPLAIN_LEVEL', 'BATCH_SIZE', 'NUM_SCANNER_THREADS', 'MAX_IO_BUFFERS',
+    'DISABLE_CODEGEN', 'MT_NUM_CORES', 'PREFETCH_MODE', 'REPLICA_PREFERENCE',
+    'SCHEDULE_RANDOM_REPLICA', 'DEBUG_ACTION'])
+
+# Statements that may change data or metadata. Other statements, e.g. USE, SET or SHOW,
+# never make a cached result stale.
+WRITING_STATEMENTS = frozenset(WRITTEN_TABLE_PATTERNS.keys() +
+    ['grant', 'revoke', 'comment']) - frozenset(['with'])
+
+# Matches the whitespace and comments at the start of a statement.
+LEADING_COMMENTS_PATTERN = re.compile(r'^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*', re.S)
+
+# Matches quoted strings and identifiers, which are kept as they are, and runs of
+# whitespace outside of them, which are collapsed.
+NORMALIZE_PATTERN = re.compile(r"""('(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"|`[^`]*`)|\s+""")
+
+ENTRY_SUFFIX = '.result'
+
+
+def normalize_query(query):
+  """Returns 'query' with whitespace outside of quotes collapsed and without a trailing
+  delimiter, so that trivially different versions of a query share a cache entry."""
+  query = NORMALIZE_PATTERN.sub(lambda m: m.group(1) or ' ', query).strip()
+  return query.rstrip(';').rstrip()
+
+
+def strip_leading_comments(statement):
+  """Returns 'statement' without the comments and whitespace before its first
+  keyword."""
+  return LEADING_COMMENTS_PATTERN.sub('', statement, 1)
+
+
+def is_cacheable(query):
+  """Returns True if the result of 'query' may be served from the cache. DML and DDL
+  statements, and queries that call nondeterministic functions, are never cached."""
+  query = strip_leading_comments(query)
+  tokens = query.split(None, 1)
+  if not tokens or tokens[0].lower() not in CACHEABLE_STATEMENTS:
+    return False
+  if get_written_tables(query) != set():
+    return False
+  return NONDETERMINISTIC_FUNCTIONS.isdisjoint(re.findall(r'\w+', query.lower()))
+
+
+class CachedResult(object):
+  """A query result read from the cache."""
+
+  def __init__(self, column_names, rows, created):
+    self.column_names = column_names
+    self.rows = rows
+    self.created = created
+
+
+class ResultCache(object):
+  """Caches query results in 'cache_dir', bounded by 'max_bytes' on disk. Entries expire
+  'ttl_s' seconds after they were created."""
+
+  # A single result may use at most this fraction of the cache size.
+  MAX_ENTRY_FRACTION = 0.25
+
+  def __init__(self, cache_dir, max_bytes, ttl_s):
+    self.cache_dir = os.path.expanduser(cache_dir)
+    self.max_bytes = max_bytes
+    self.ttl_s = ttl_s
+    self.max_entry_bytes = int(max_bytes * self.MAX_ENTRY_FRACTION)
+    self.hits = 0
+    self.misses = 0
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir, 0700)
+    stat = os.stat(self.cache_dir)
+    if stat.st_uid != os.getuid() or stat.st_mode & 022:
+      raise OSError(errno.EACCES, "The result cache directory must be owned by the "
+                    "current user and must not be writable by the group or others")
+
+  def get_key(self, query, db, query_options):
+    """Returns the key of the cache entry for 'query' when run in database 'db' with
+    'query_options', or None if its result must not be cached."""
+    if not is_cacheable(query):
+      return None
+    options = sorted([(name.upper(), str(value)) for name, value in query_options.items()
+                      if name.upper() not in RESULT_NEUTRAL_OPTIONS])
+    text = repr((normalize_query(query), (db or '').strip('`').lower(), options))
+    return hashlib.sha1(text).hexdigest()
+
+  def get(self, key):
+    """Returns the CachedResult stored under 'key', or None if there is none or it
+    expired."""
+    path = self._path(key)
+    try:
+      entry_file = open(path, 'rb')
+    except IOError:
+      self.misses += 1
+      return None
+    try:
+      try:
+        header = cPickle.load(entry_file)
+        if time.time() - header['created'] > self.ttl_s:
+          self._remove(path)
+          self.misses += 1
+          return None
+        column_names, rows = cPickle.load(entry_file)
+      except Exception:
+        # The entry is corrupt or was written by an incompatible version.
+        self._remove(path)
+        self.misses += 1
+        return None
+    finally:
+      entry_file.close()
+    try:
+      # Mark the entry as recently used.
+      os.utime(path, None)
+    except OSError:
+      pass
+    self.hits += 1
+    return CachedResult(column_names, rows, header['created'])
+
+  def put(self, key, query, column_names, rows):
+    """Stores the result of 'query' under 'key' and evicts the least recently used
+    entries if the cache grew too large."""
+    header = {'query': query, 'words': set(re.findall(r'\w+', query.lower())),
+              'created': time.time()}
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+    try:
+      entry_file = os.fdopen(fd, 'wb')
+      try:
+        cPickle.dump(header, entry_file, cPickle.HIGHEST_PROTOCOL)
+        cPickle.dump((column_names, rows), entry_file, cPickle.HIGHEST_PROTOCOL)
+      finally:
+        entry_file.close()
+      # Concurrent shells sharing the cache never see a partially written entry.
+      os.rename(tmp_path, self._path(key))
+    except Exception:
+      self._remove(tmp_path)
+      raise
+    self._evict()
+
+  def invalidate(self, statement):
+    """Removes the entries that 'statement' may make stale. Entries are removed if they
+    mention a table that the statement writes, or all of them if the statement may
+    write tables but which ones cannot be determined."""
+    statement = strip_leading_comments(statement)
+    tables = get_written_tables(statement)
+    if tables is None:
+      tokens = statement.split(None, 1)
+      if not tokens or tokens[0].lower() not in WRITING_STATEMENTS:
+        return
+    elif not tables:
+      return
+    for path in self._entry_paths():
+      if tables is None:
+        self._remove(path)
+        continue
+      try:
+        entry_file = open(path, 'rb')
+        try:
+          words = cPickle.load(entry_file)['words']
+        finally:
+          entry_file.close()
+      except Exception:
+        words = None
+      if words is None or not words.isdisjoint(tables):
+        self._remove(path)
+
+  def clear(self):
+    """Removes all entries."""
+    for path in self._entry_paths():
+      self._remove(path)
+
+  def get_size(self):
+    """Returns the number of entries and their total size in bytes."""
+    sizes = []
+    for path in self._entry_paths():
+      try:
+        sizes.append(os.path.getsize(path))
+      except OSError:
+        pass
+    return len(sizes), sum(sizes)
+
+  def _evict(self):
+    entries = []
+    for path in self._entry_paths():
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, path))
+    total_bytes = sum([size for _, size, _ in entries])
+    entries.sort()
+    while entries and total_bytes > self.max_bytes:
+      _, size, path = entries.pop(0)
+      self._remove(path)
+      total_bytes -= size
+
+  def _entry_paths(self):
+    try:
+      names = os.listdir(self.cache_dir)
+    except OSError:
+      return []
+    return [os.path.join(self.cache_dir, name) for name in names
+            if name.endswith(ENTRY_SUFFIX)]
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+  def _remove(self, path):
+    try:
+      os.remove(path)
+    except OSError:
+      # Another shell may have removed it already.
+      pass
@@ -17,10 +17,61 @@
 # specific language governing permissions and limitations
 # under the License.
 
-import csv
 import re
 import sys
-from cStringIO import StringIO
+import time
+
+
+def format_column(values):
+  """Returns the display strings of the typed values of a column, the way the impalad
+  formats them for Beeswax results. None is NULL."""
+  sample = None
+  for value in values:
+    if value is not None:
+      sample = value
+      break
+  if isinstance(sample, bool):
+    to_string = lambda value: value and 'true' or 'false'
+  elif isinstance(sample, float):
+    # Doubles are printed with 16 significant digits.
+    to_string = '%.16g'.__mod__
+  elif isinstance(sample, (int, long)):
+    to_string = str
+  else:
+    to_string = None
+  if None in values:
+    return [value is None and 'NULL' or (to_string and to_string(value) or value)
+            for value in values]
+  if to_string is None:
+    return list(values)
+  return map(to_string, values)
+
+
+class ColumnarBatch(object):
+  """A batch of result rows stored as one list of typed values per column, with None for
+  NULL. The values are only turned into strings when they are formatted, one column at
+  a time, and are never joined into or split from a row of text.
+
+  Iterating over a batch yields its rows as tuples of display strings, for consumers
+  that do not handle columns.
+  """
+
+  def __init__(self, columns, num_rows):
+    self.columns = columns
+    self.num_rows = num_rows
+    self.string_columns = None
+
+  def __len__(self):
+    return self.num_rows
+
+  def __iter__(self):
+    return iter(zip(*self.get_string_columns()))
+
+  def get_string_columns(self):
+    """Returns the display strings of the values, as one list per column."""
+    if self.string_columns is None:
+      self.string_columns = map(format_column, self.columns)
+    return self.string_columns
 
 
 class PrettyOutputFormatter(object):
@@ -43,6 +94,117 @@ class PrettyOutputFormatter(object):
       print >>sys.stderr, error_msg
       return '\n'.join(['\t'.join(row) for row in rows])
 
+  def finish(self):
+    return None
+
+
+class StreamingPrettyOutputFormatter(object):
+  """Formats rows as a table that looks like the ones PrettyOutputFormatter produces,
+  but renders every batch of rows as a continuation of the same table.
+
+  The column widths are fixed from the header and the first batch of rows, so the
+  header is only printed once and every later row is rendered with constant work per
+  cell. A row that does not fit the current widths ends the table, and a new table
+  with wider columns is started.
+  """
+
+  # Rows without any of these characters are padded with plain string operations. Others
+  # are decoded and measured the way prettytable does it, e.g. to account for wide
+  # characters.
+  SPECIAL_CHARS = re.compile(r'[^\x20-\x7e]')
+
+  def __init__(self, column_names, encoding="UTF-8"):
+    # prettytable is slow to import, and not needed unless a table is printed.
+    from prettytable import _str_block_width
+    self._str_block_width = _str_block_width
+    self.encoding = encoding
+    self.column_names = [self._unicode(name) for name in column_names]
+    self.widths = None
+
+  def format(self, rows):
+    if not rows:
+      return None
+    if isinstance(rows, ColumnarBatch):
+      rows = list(rows)
+    for row in rows:
+      if len(row) != len(self.column_names):
+        # See PrettyOutputFormatter.format().
+        error_msg = ("Prettytable cannot resolve string columns values that have "
+                     " embedded tabs. Reverting to tab delimited text output")
+        print >>sys.stderr, error_msg
+        return '\n'.join(['\t'.join(row) for row in rows])
+    lines = []
+    if self.widths is None:
+      self._widen(rows)
+      lines.append(self._format_header())
+    for i, row in enumerate(rows):
+      line = self._format_row(row)
+      if line is None:
+        # The row does not fit. Start a new table that fits the rest of the batch.
+        lines.append(self.hrule)
+        self._widen(rows[i:])
+        lines.append(self._format_header())
+        line = self._format_row(row)
+      lines.append(line)
+    return '\n'.join(lines)
+
+  def finish(self):
+    """Returns the bottom border of the table, or None if no rows were formatted."""
+    if self.widths is None:
+      return None
+    return self.hrule
+
+  def _unicode(self, value):
+    if not isinstance(value, basestring):
+      value = str(value)
+    if not isinstance(value, unicode):
+      # If a value cannot be encoded, replace it with a placeholder.
+      value = unicode(value, self.encoding, "replace")
+    return value
+
+  def _widen(self, rows):
+    """Widens the columns to fit the header and 'rows'."""
+    if self.widths is None:
+      widths = [self._str_block_width(name) for name in self.column_names]
+    else:
+      widths = list(self.widths)
+    for row in rows:
+      if self.SPECIAL_CHARS.search(''.join(row)) is None:
+        cell_widths = [len(value) for value in row]
+      else:
+        cell_widths = [max([self._str_block_width(line) for line in
+            self._unicode(value).split('\n')]) for value in row]
+      widths = map(max, widths, cell_widths)
+    self.widths = widths
+    self.hrule = '+' + '+'.join(['-' * (width + 2) for width in widths]) + '+'
+
+  def _format_header(self):
+    return '\n'.join([self.hrule, self._format_line(self.column_names), self.hrule])
+
+  def _format_line(self, values):
+    return '| ' + ' | '.join([value + ' ' * (width - self._str_block_width(value))
+                              for value, width in zip(values, self.widths)]) + ' |'
+
+  def _format_row(self, row):
+    """Returns the lines of the table that show 'row', or None if it does not fit the
+    current column widths."""
+    if self.SPECIAL_CHARS.search(''.join(row)) is None:
+      for value, width in zip(row, self.widths):
+        if len(value) > width:
+          return None
+      return '| ' + ' | '.join([value.ljust(width)
+                                for value, width in zip(row, self.widths)]) + ' |'
+    # A value may span multiple lines, which are laid out next to the lines of the other
+    # values in the row.
+    cells = [self._unicode(value).split('\n') for value in row]
+    for lines, width in zip(cells, self.widths):
+      for line in lines:
+        if self._str_block_width(line) > width:
+          return None
+    height = max([len(lines) for lines in cells])
+    return '\n'.join([self._format_line([lines[y] if y < len(lines) else u''
+                                         for lines in cells]) for y in xrange(height)])
+
 
 class DelimitedOutputFormatter(object):
   def __init__(self, field_delim="\t"):
@@ -54,27 +216,81 @@ class DelimitedOutputFormatter(object):
         raise ValueError, error_msg
 
   def format(self, rows):
-    # csv.writer expects a file handle to the input.
-    # cStringIO is used as the temporary buffer.
-    temp_buffer = StringIO()
-    writer = csv.writer(temp_buffer, delimiter=self.field_delim,
-                        lineterminator='\n', quoting=csv.QUOTE_MINIMAL)
-    writer.writerows(rows)
-    rows = temp_buffer.getvalue().rstrip('\n')
-    temp_buffer.close()
-    return rows
+    """Formats the rows the same way a csv.writer with csv.QUOTE_MINIMAL would: a field
+    is quoted if it contains the delimiter, a double quote or a newline. Most rows need
+    no quoting at all, which is detected with a single check on the joined row, so
+    fields are only inspected individually when some quoting is required.
+    """
+    if isinstance(rows, ColumnarBatch):
+      return self._format_columns(rows.get_string_columns())
+    delim = self.field_delim
+    lines = []
+    for row in rows:
+      try:
+        line = delim.join(row)
+      except TypeError:
+        row = [str(field) for field in row]
+        line = delim.join(row)
+      # If the joined row contains no delimiters other than the ones inserted by the
+      # join, and no quotes or newlines, no field in it needs to be quoted.
+      if '"' in line or '\n' in line or line.count(delim) != len(row) - 1 \
+          or not line:
+        line = delim.join([self._quote_field(field) for field in row])
+        # A row consisting of a single empty field is quoted to distinguish it from an
+        # empty row.
+        if len(row) == 1 and not row[0]:
+          line = '""'
+      lines.append(line)
+    return '\n'.join(lines)
+
+  def finish(self):
+    return None
+
+  def _format_columns(self, columns):
+    """Like format(), for rows given as a list of string columns. Whether any field needs
+    quoting is checked once per column."""
+    delim = self.field_delim
+    quoted_columns = []
+    for column in columns:
+      text = ''.join(column)
+      if delim in text or '"' in text or '\n' in text:
+        column = [self._quote_field(field) for field in column]
+      quoted_columns.append(column)
+    if len(quoted_columns) == 1:
+      # See format().
+      return '\n'.join([field or '""' for field in quoted_columns[0]])
+    return '\n'.join(map(delim.join, zip(*quoted_columns)))
+
+  def _quote_field(self, field):
+    if self.field_delim in field or '"' in field or '\n' in field:
+      return '"%s"' % field.replace('"', '""')
+    return field
 
 
 class OutputStream(object):
-  def __init__(self, formatter, filename=None):
+  # When buffering is enabled, output is flushed once this many bytes have been written
+  # since the last flush.
+  FLUSH_THRESHOLD_BYTES = 1024 * 1024
+
+  def __init__(self, formatter, filename=None, buffered=False):
     """Helper class for writing query output.
 
     User should invoke the `write(data)` method of this object.
     `data` is a list of lists.
+
+    If `buffered` is True, output is not flushed after every write, but only once
+    FLUSH_THRESHOLD_BYTES have accumulated or when `flush()` is called. Callers writing
+    many batches should call `flush()` once they are done.
     """
     self.formatter = formatter
     self.handle = sys.stdout
     self.filename = filename
+    self.buffered = buffered
+    self.bytes_since_flush = 0
+    # Seconds spent formatting and writing data, and the number of bytes written.
+    self.format_secs = 0.0
+    self.write_secs = 0.0
+    self.bytes_written = 0
     if self.filename:
       try:
         self.handle = open(self.filename, 'ab')
@@ -83,48 +299,88 @@ class OutputStream(object):
         print >>sys.stderr, "Writing to stdout"
 
   def write(self, data):
-    print >>self.handle, self.formatter.format(data)
+    start_time = time.time()
+    formatted_data = self.formatter.format(data)
+    formatted_time = time.time()
+    self.format_secs += formatted_time - start_time
+    if formatted_data is None:
+      return
+    self._write_formatted(formatted_data)
+    if not self.buffered or self.bytes_since_flush >= self.FLUSH_THRESHOLD_BYTES:
+      self.flush()
+    self.write_secs += time.time() - formatted_time
+
+  def _write_formatted(self, formatted_data):
+    print >>self.handle, formatted_data
+    self.bytes_since_flush += len(formatted_data) + 1
+    self.bytes_written += len(formatted_data) + 1
+
+  def flush(self):
     self.handle.flush()
+    self.bytes_since_flush = 0
+
+  def finish(self):
+    """Writes the output that ends the formatted data, if any, e.g. the bottom border
+    of a table, and flushes. Called once all data has been written."""
+    start_time = time.time()
+    formatted_data = self.formatter.finish()
+    formatted_time = time.time()
+    self.format_secs += formatted_time - start_time
+    if formatted_data is not None:
+      self._write_formatted(formatted_data)
+    self.flush()
+    self.write_secs += time.time() - formatted_time
+
+  def abort(self):
+    """Called instead of finish() if not all data could be written, e.g. because
+    fetching it failed. Text output is readable as far as it was written, so it is
+    finished as usual."""
+    self.finish()
 
   def __del__(self):
     # If the output file cannot be opened, OutputStream defaults to sys.stdout.
     # Don't close the file handle if it points to sys.stdout.
     if self.filename and self.handle != sys.stdout:
       self.handle.close()
+    elif self.bytes_since_flush:
+      self.handle.flush()
 
 
 class OverwritingStdErrOutputStream(object):
   """This class is used to write output to stderr and overwrite the previous text as
-  soon as new content needs to be written."""
+  soon as new content needs to be written. Only the lines that changed since the
+  previous write are redrawn."""
 
   # ANSI Escape code for up.
   UP = "\x1b[A"
 
   def __init__(self):
     self.last_line_count = 0
-    self.last_clean_text = ""
-
-  def _clean_before(self):
-    sys.stderr.write(self.UP * self.last_line_count)
-    sys.stderr.write(self.last_clean_text)
+    self.last_lines = []
 
   def write(self, data):
-    """This method will erase the previously printed text on screen by going
-    up as many new lines as the old text had and overwriting it with whitespace.
-    Afterwards, the new text will be printed."""
-    self._clean_before()
-    new_line_count = data.count("\n")
-    sys.stderr.write(self.UP * min(new_line_count, self.last_line_count))
-    sys.stderr.write(data)
-
-    # Cache the line count and the old text where all text was replaced by
-    # whitespace.
-    self.last_line_count = new_line_count
-    self.last_clean_text = re.sub(r"[^\s]", " ", data)
+    """This method will erase the lines of the previously printed text that differ
+    from 'data', by going up to the first of them and overwriting them with
+    whitespace. Afterwards, the new lines will be printed in their place. Nothing is
+    written if the text did not change."""
+    lines = data.splitlines(True)
+    if lines == self.last_lines:
+      return
+    unchanged = 0
+    while unchanged < min(len(lines), len(self.last_lines)) and \
+        lines[unchanged] == self.last_lines[unchanged]:
+      unchanged += 1
+    # The cursor is on the last line of the old text, go back to the first changed one.
+    old_text = "".join(self.last_lines[unchanged:])
+    sys.stderr.write("\r" + self.UP * (self.last_line_count - unchanged))
+    if old_text:
+      sys.stderr.write(re.sub(r"[^\s]", " ", old_text))
+      sys.stderr.write("\r" + self.UP * old_text.count("\n"))
+    sys.stderr.write("".join(lines[unchanged:]))
+    sys.stderr.flush()
+
+    self.last_line_count = data.count("\n")
+    self.last_lines = lines
 
   def clear(self):
-    sys.stderr.write(self.UP * self.last_line_count)
-    sys.stderr.write(self.last_clean_text)
-    sys.stderr.write(self.UP * self.last_line_count)
-    self.last_line_count = 0
-    self.last_clean_text = ""
+    self.write("")
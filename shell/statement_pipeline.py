@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Concurrent execution of independent statements over a pool of sessions.
+#
+# The shell submits statements to a StatementPipeline in script order. A statement is
+# started as soon as a session is free and no statement it depends on is still running.
+# Two statements depend on each other if one of them writes a table that the other one
+# mentions. Results are buffered per statement so that the shell can print them in
+# script order. The buffer of a statement is bounded: once it is full, the session
+# waits until the shell printed the rows of all previous statements and starts printing
+# the rows of this one, so memory use does not grow with the size of a result.
+
+import re
+import threading
+import time
+
+from Queue import Full, Queue
+
+# Matches the table written by a statement, keyed by the statement's first keyword.
+# The table name is always captured by the last group.
+_TABLE_NAME = r'((?:`[^`]+`|\w+)(?:\.(?:`[^`]+`|\w+))?)'
+_IF_EXISTS = r'(?:if\s+(?:not\s+)?exists\s+)?'
+WRITTEN_TABLE_PATTERNS = {
+  'insert': r'^insert\s+(?:into|overwrite)\s+(?:table\s+)?' + _TABLE_NAME,
+  'upsert': r'^upsert\s+into\s+(?:table\s+)?' + _TABLE_NAME,
+  'with': r'\binsert\s+(?:into|overwrite)\s+(?:table\s+)?' + _TABLE_NAME,
+  'create': r'^create\s+(?:external\s+)?(?:table|view)\s+' + _IF_EXISTS + _TABLE_NAME,
+  'drop': r'^drop\s+(?:table|view|stats|incremental\s+stats)\s+' + _IF_EXISTS +
+      _TABLE_NAME,
+  'alter': r'^alter\s+(?:table|view)\s+' + _TABLE_NAME,
+  'compute': r'^compute\s+(?:incremental\s+)?stats\s+' + _TABLE_NAME,
+  'truncate': r'^truncate\s+(?:table\s+)?' + _IF_EXISTS + _TABLE_NAME,
+  'invalidate': r'^invalidate\s+metadata\s+' + _TABLE_NAME,
+  'refresh': r'^refresh\s+' + _TABLE_NAME,
+  'load': r'\binto\s+table\s+' + _TABLE_NAME,
+  'update': r'^update\s+' + _TABLE_NAME,
+  'delete': r'^delete\s+(?:from\s+)?' + _TABLE_NAME,
+}
+# Matches the new name of a table renamed by ALTER TABLE/VIEW.
+RENAME_PATTERN = r'\brename\s+to\s+' + _TABLE_NAME
+# Statements that never write a table.
+READ_ONLY_STATEMENTS = frozenset(['select', 'values', 'show', 'describe', 'explain'])
+# Maximum number of fetched row batches buffered per statement.
+MAX_BUFFERED_BATCHES = 16
+
+
+def _unqualified_table_name(name):
+  return name.split('.')[-1].strip('`').lower()
+
+
+def get_written_tables(statement):
+  """Returns the set of tables, as lower case names without the database, that the
+  statement writes, or None if the statement's effects cannot be determined. Statements
+  for which None is returned must not run concurrently with any other statement."""
+  tokens = statement.split(None, 1)
+  if not tokens:
+    return set()
+  keyword = tokens[0].lower()
+  if keyword in READ_ONLY_STATEMENTS:
+    return set()
+  pattern = WRITTEN_TABLE_PATTERNS.get(keyword)
+  if pattern is None:
+    return None
+  match = re.search(pattern, statement, re.I)
+  if match is None:
+    # A WITH clause that does not insert only reads.
+    if keyword == 'with':
+      return set()
+    return None
+  tables = set([_unqualified_table_name(match.group(match.lastindex))])
+  if keyword == 'alter':
+    rename = re.search(RENAME_PATTERN, statement, re.I)
+    if rename is not None:
+      tables.add(_unqualified_table_name(rename.group(1)))
+  return tables
+
+
+def is_insert_statement(statement):
+  """Returns whether 'statement' is an INSERT or UPSERT, possibly after a WITH clause."""
+  return bool(re.match(r'^(insert|upsert)\b', statement, re.I) or
+              (re.match(r'^with\b', statement, re.I) and
+               re.search(r'\binsert\b', statement, re.I)))
+
+
+class PipelinedStatement(object):
+  """A statement executed by a StatementPipeline, along with its buffered results."""
+
+  def __init__(self, sql, query_options, db):
+    self.sql = sql
+    self.query_options = dict(query_options)
+    self.db = db
+    self.written_tables = get_written_tables(sql)
+    # Every word in the statement, used to conservatively detect the tables it reads.
+    self.words = set(re.findall(r'\w+', sql.lower()))
+    self.is_insert = is_insert_statement(sql)
+
+    self.query_handle = None
+    self.column_names = None
+    # The fetched row batches that were not printed yet. Once 'done' is set, no more
+    # batches are added.
+    self.row_batches = Queue(MAX_BUFFERED_BATCHES)
+    # The stream to which the shell prints the rows, once it started printing them.
+    self.output_stream = None
+    self.num_rows = 0
+    self.warning_log = None
+    self.error = None
+    self.elapsed_secs = None
+    self.done = threading.Event()
+
+  def conflicts_with(self, other):
+    """Returns True if this statement and 'other' cannot run concurrently."""
+    if self.written_tables is None or other.written_tables is None:
+      return True
+    for table in self.written_tables:
+      if table in other.words:
+        return True
+    for table in other.written_tables:
+      if table in self.words:
+        return True
+    return False
+
+
+class StatementPipeline(object):
+  """Runs statements concurrently over a bounded pool of sessions.
+
+  'client_factory' is called once per session and must return a new ImpalaClient that
+  is already connected. All methods must be called from the same thread.
+
+  Since a session waits while the row buffer of its statement is full, the thread that
+  submits statements must keep printing rows while it waits: submit() and drain() call
+  'on_wait' whenever a statement added rows or finished, and give up if it returns
+  False.
+  """
+
+  # Seconds to block while waiting for a statement to finish before re-checking. Bounded
+  # waits keep the main thread responsive to signals.
+  WAIT_INTERVAL_S = 0.1
+
+  def __init__(self, client_factory, num_sessions):
+    self.client_factory = client_factory
+    self.num_sessions = num_sessions
+    self.pending = Queue()
+    self.running = []
+    self.workers = []
+    self.cancelled = False
+    # Set whenever a statement added rows or finished.
+    self.changed = threading.Event()
+
+  def submit(self, statement, on_wait=None):
+    """Blocks until 'statement' can start without conflicting with a running statement
+    and a session is free, then starts it. Returns False if 'on_wait' returned False
+    before that, in which case the statement is not started."""
+    while True:
+      self.changed.clear()
+      if on_wait is not None and not on_wait():
+        return False
+      self.running = [s for s in self.running if not s.done.is_set()]
+      blocked = len(self.running) >= self.num_sessions
+      for running in self.running:
+        if blocked:
+          break
+        blocked = statement.conflicts_with(running)
+      if not blocked:
+        self.running.append(statement)
+        break
+      self.changed.wait(self.WAIT_INTERVAL_S)
+    if len(self.workers) < min(len(self.running), self.num_sessions):
+      self._start_worker()
+    self.pending.put(statement)
+    return True
+
+  def drain(self, on_wait=None):
+    """Blocks until all submitted statements have finished. Returns False if 'on_wait'
+    returned False before that."""
+    while True:
+      self.changed.clear()
+      if on_wait is not None and not on_wait():
+        return False
+      self.running = [s for s in self.running if not s.done.is_set()]
+      if not self.running:
+        return True
+      self.changed.wait(self.WAIT_INTERVAL_S)
+
+  def cancel(self):
+    """Cancels all running statements. Cancellation requests are sent over new
+    connections, since the sessions are busy executing the statements."""
+    self.cancelled = True
+    for statement in [s for s in self.running if not s.done.is_set()]:
+      if statement.query_handle is None:
+        continue
+      try:
+        client = self.client_factory()
+        try:
+          client.cancel_query(statement.query_handle)
+        finally:
+          client.close_connection()
+      except Exception:
+        # The statement may have finished in the meantime.
+        pass
+
+  def close(self):
+    """Stops the workers and closes their sessions. Must be called after drain()."""
+    for _ in self.workers:
+      self.pending.put(None)
+    for worker in self.workers:
+      worker.join()
+    self.workers = []
+
+  def _start_worker(self):
+    worker = threading.Thread(target=self._run_worker,
+                              name="Pipeline session %d" % len(self.workers))
+    worker.daemon = True
+    self.workers.append(worker)
+    worker.start()
+
+  def _run_worker(self):
+    client = None
+    current_db = None
+    try:
+      while True:
+        statement = self.pending.get()
+        if statement is None:
+          return
+        start_time = time.time()
+        try:
+          if self.cancelled:
+            raise Exception("Cancelled")
+          if client is None:
+            client = self.client_factory()
+          if statement.db and statement.db != current_db:
+            self._execute(client, PipelinedStatement(
+                'use `%s`' % statement.db.strip('`'), {}, None))
+            current_db = statement.db
+          self._execute(client, statement)
+        except Exception, e:
+          statement.error = e
+        statement.elapsed_secs = time.time() - start_time
+        statement.done.set()
+        self.changed.set()
+    finally:
+      if client is not None:
+        client.close_connection()
+
+  def _execute(self, client, statement):
+    """Executes 'statement' on 'client' and buffers its results. Mirrors the steps the
+    shell takes to execute a statement interactively."""
+    query = client.create_beeswax_query(statement.sql, statement.query_options)
+    statement.query_handle = client.execute_query(query)
+    if statement.is_insert:
+      client.wait_to_finish(statement.query_handle)
+      statement.warning_log = client.get_warning_log(statement.query_handle)
+      statement.num_rows = client.close_insert(statement.query_handle)
+      return
+    if not client.expect_result_metadata(statement.sql):
+      client.wait_to_finish(statement.query_handle)
+      client.close_query(statement.query_handle)
+      return
+    statement.column_names = client.get_column_names(statement.query_handle)
+    for rows in client.fetch(statement.query_handle):
+      self._add_batch(statement, rows)
+      statement.num_rows += len(rows)
+    statement.warning_log = client.get_warning_log(statement.query_handle)
+    client.close_query(statement.query_handle)
+
+  def _add_batch(self, statement, rows):
+    """Adds 'rows' to the buffer of 'statement', waiting while it is full."""
+    while True:
+      if self.cancelled:
+        raise Exception("Cancelled")
+      try:
+        statement.row_batches.put(rows, True, self.WAIT_INTERVAL_S)
+        break
+      except Full:
+        pass
+    self.changed.set()
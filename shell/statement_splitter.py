@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Splits the shell's input into statements.
+#
+# The input is fed to a StatementSplitter in arbitrary pieces, e.g. one line at a time.
+# The splitter keeps track of whether it is inside a quoted string or a comment across
+# pieces, so that every piece of input is only scanned once. A statement ends with a
+# semicolon that is neither quoted nor commented out.
+
+import re
+
+# Lexer states.
+NORMAL, SINGLE_QUOTED, DOUBLE_QUOTED, BACKQUOTED, LINE_COMMENT, BLOCK_COMMENT = range(6)
+
+# For each state, matches the tokens that may end the state or start a new one.
+STATE_TRANSITIONS = {
+  NORMAL: re.compile(r"""[;'"`]|--|/\*"""),
+  SINGLE_QUOTED: re.compile(r"[\\']"),
+  DOUBLE_QUOTED: re.compile(r'[\\"]'),
+  BACKQUOTED: re.compile('`'),
+  LINE_COMMENT: re.compile('\n'),
+  BLOCK_COMMENT: re.compile(r'\*/'),
+}
+
+# The state entered by each token that starts a quoted string or a comment.
+OPENING_TOKENS = {"'": SINGLE_QUOTED, '"': DOUBLE_QUOTED, '`': BACKQUOTED,
+                  '--': LINE_COMMENT, '/*': BLOCK_COMMENT}
+
+# For each state, the characters that, at the end of a piece of input, may be the first
+# half of a two character token. They are held back until the next piece arrives.
+SPLIT_TOKEN_PREFIXES = {NORMAL: '-/', BLOCK_COMMENT: '*'}
+
+STATEMENT_DELIMITER = ';'
+
+
+def decode_statement(text):
+  """Returns 'text' as unicode. Byte strings are decoded as utf-8, falling back to
+  'unicode-escape' for invalid input, like sqlparse does."""
+  if isinstance(text, unicode):
+    return text
+  try:
+    return text.decode('utf-8')
+  except UnicodeDecodeError:
+    return text.decode('unicode-escape')
+
+
+def split_statements(text):
+  """Splits 'text' into a list of statements. The last statement does not need to be
+  terminated by a semicolon. Input that only consists of comments is dropped."""
+  splitter = StatementSplitter()
+  return splitter.feed(text) + splitter.flush()
+
+
+class StatementSplitter(object):
+  """Incrementally splits input into statements.
+
+  Statements are returned stripped of surrounding whitespace, including their
+  terminating semicolon. Comments preceding a statement are part of it. A '--' comment
+  that follows a semicolon on the same line is dropped, since it belongs to a statement
+  that has already been returned. Statements without any text outside of comments, such
+  as an empty statement, are dropped as well.
+  """
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    """Discards all pending input."""
+    self.state = NORMAL
+    # The pieces of the current statement.
+    self.pieces = []
+    # Input at the end of the last piece that could not be scanned yet, see
+    # SPLIT_TOKEN_PREFIXES.
+    self.held_back = ''
+    # True if the current statement has any text outside of comments.
+    self.has_text = False
+    # True if the current statement only consists of whitespace so far.
+    self.is_blank = True
+    # True while only spaces and tabs followed the end of the previous statement.
+    self.after_delimiter = False
+    # True while in a comment that is dropped.
+    self.dropping_comment = False
+
+  def at_statement_boundary(self):
+    """Returns True if all input fed so far ended with complete statements, apart from
+    whitespace."""
+    return self.state == NORMAL and not self.held_back and self.is_blank
+
+  def feed(self, text):
+    """Consumes 'text' and returns the list of statements that it completed."""
+    statements = []
+    if self.held_back:
+      text = self.held_back + text
+      self.held_back = ''
+    pos = 0
+    end = len(text)
+    while pos < end:
+      match = STATE_TRANSITIONS[self.state].search(text, pos)
+      if match is None:
+        stop = end
+        if text[end - 1] in SPLIT_TOKEN_PREFIXES.get(self.state, ''):
+          stop = end - 1
+          self.held_back = text[stop:]
+        self._append(text[pos:stop])
+        break
+      token = match.group()
+      if token == '\\':
+        # An escaped character in a quoted string.
+        if match.end() == end:
+          self._append(text[pos:match.start()])
+          self.held_back = token
+          break
+        self._append(text[pos:match.end() + 1])
+        pos = match.end() + 1
+        continue
+      self._append(text[pos:match.start()])
+      pos = match.end()
+      if self.state != NORMAL:
+        # The token closes the quoted string or comment.
+        self._append(token)
+        self.state = NORMAL
+        self.dropping_comment = False
+      elif token == STATEMENT_DELIMITER:
+        self.pieces.append(token)
+        statement = ''.join(self.pieces).strip()
+        if self.has_text:
+          statements.append(statement)
+        self.pieces = []
+        self.has_text = False
+        self.is_blank = True
+        self.after_delimiter = True
+      else:
+        self.state = OPENING_TOKENS[token]
+        self.dropping_comment = self.state == LINE_COMMENT and self.after_delimiter
+        if self.state in (SINGLE_QUOTED, DOUBLE_QUOTED, BACKQUOTED):
+          self.has_text = True
+        self._append(token)
+    return statements
+
+  def flush(self):
+    """Ends the input. Returns the last statement, if it has not been terminated by a
+    semicolon, in a list."""
+    statements = []
+    if self.held_back:
+      self._append(self.held_back)
+      self.held_back = ''
+    if self.has_text:
+      statements.append(''.join(self.pieces).strip())
+    self.reset()
+    return statements
+
+  def _append(self, text):
+    if not text:
+      return
+    if self.after_delimiter and text.strip(' \t'):
+      self.after_delimiter = False
+    if self.dropping_comment:
+      return
+    if self.is_blank and text.strip():
+      self.is_blank = False
+    if self.state == NORMAL and not self.has_text and text.strip():
+      self.has_text = True
+    self.pieces.append(text)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Client-side timing of the statements executed by the shell.
+#
+# For every statement, the shell records how long it spent in each phase, as seen from
+# the client:
+#   submit:   the RPC that starts the statement.
+#   execute:  waiting for the statement to finish, or for its first rows.
+#   fetch:    waiting for more rows after the first ones.
+#   format:   formatting rows for output.
+#   write:    writing formatted output to the terminal or the output file.
+#   close:    closing the statement and retrieving its warnings and profile.
+# Rows are prefetched in the background while the shell formats and writes the previous
+# ones, so 'fetch' is the time the shell was blocked on rows, not the duration of the
+# fetch RPCs. The duration of all RPCs, including the ones of the background fetches, is
+# recorded separately, together with their number and the bytes sent and received.
+
+import time
+
+PHASES = ['submit', 'execute', 'fetch', 'format', 'write', 'close']
+# Number of functions shown in the client profile of a statement.
+PROFILE_FUNCTIONS = 20
+
+
+class StatementTiming(object):
+  """The timing of the execution of 'query'."""
+
+  def __init__(self, query, rpc_stats):
+    self.query = query
+    # The RPC stats of the client before the statement, see ImpalaClient.get_rpc_stats().
+    self.start_rpc_stats = rpc_stats
+    self.start_time = time.time()
+    self.phase_secs = dict([(phase, 0.0) for phase in PHASES])
+    self.total_secs = None
+    self.query_id = None
+    self.num_rows = 0
+    self.bytes_written = 0
+    self.num_rpcs = 0
+    self.rpc_secs = 0.0
+    self.bytes_sent = 0
+    self.bytes_received = 0
+    self.succeeded = False
+    # The client profile of the statement as text, if it was profiled.
+    self.profile = None
+
+  def add(self, phase, secs):
+    self.phase_secs[phase] += secs
+
+  def add_output_stream(self, output_stream):
+    """Adds the time an output stream spent formatting and writing the results."""
+    self.add('format', output_stream.format_secs)
+    self.add('write', output_stream.write_secs)
+    self.bytes_written += output_stream.bytes_written
+
+  def finish(self, rpc_stats):
+    """Records the end of the statement, given the RPC stats of the client after it."""
+    self.total_secs = time.time() - self.start_time
+    # The stats restart if the shell reconnected during the statement.
+    if [stat for stat, start in zip(rpc_stats, self.start_rpc_stats) if stat < start]:
+      deltas = rpc_stats
+    else:
+      deltas = [stat - start for stat, start in zip(rpc_stats, self.start_rpc_stats)]
+    self.num_rpcs, self.rpc_secs, self.bytes_sent, self.bytes_received = deltas
+
+  def to_dict(self):
+    return {'query': self.query, 'query_id': self.query_id,
+            'start_time': self.start_time, 'total_secs': self.total_secs,
+            'succeeded': self.succeeded, 'phase_secs': self.phase_secs,
+            'num_rows': self.num_rows, 'bytes_written': self.bytes_written,
+            'num_rpcs': self.num_rpcs, 'rpc_secs': self.rpc_secs,
+            'bytes_sent': self.bytes_sent, 'bytes_received': self.bytes_received}
+
+  def format(self):
+    """Returns a human readable breakdown of the timing."""
+    lines = ["Query: %s" % self.query]
+    if self.query_id is not None:
+      lines.append("Query id: %s" % self.query_id)
+    total_secs = self.total_secs or 0.0
+    other_secs = max(0.0, total_secs - sum(self.phase_secs.values()))
+    phase_secs = [(phase, self.phase_secs[phase]) for phase in PHASES]
+    for phase, secs in phase_secs + [('other', other_secs)]:
+      lines.append("  %-8s %9.3fs %6.1f%%" % (phase, secs,
+                                              100 * secs / max(total_secs, 1e-9)))
+    lines.append("  %-8s %9.3fs" % ('total', total_secs))
+    lines.append("RPCs: %d in %.3fs, %s sent, %s received" % (self.num_rpcs,
+        self.rpc_secs, format_bytes(self.bytes_sent), format_bytes(self.bytes_received)))
+    output_secs = self.phase_secs['format'] + self.phase_secs['write']
+    rows_per_sec = ''
+    if self.num_rows and output_secs > 0:
+      rows_per_sec = ", %d rows/s formatted and written" % (self.num_rows / output_secs)
+    lines.append("Rows: %d, %s of output%s" % (self.num_rows,
+                                               format_bytes(self.bytes_written),
+                                               rows_per_sec))
+    if self.profile:
+      lines.append("Client profile:")
+      lines.append(self.profile.rstrip())
+    return '\n'.join(lines)
+
+
+def format_bytes(num_bytes):
+  for unit in ['B', 'KB', 'MB']:
+    if num_bytes < 1024:
+      return "%.1f %s" % (num_bytes, unit)
+    num_bytes /= 1024.0
+  return "%.1f GB" % num_bytes
+
+
+class ClientProfiler(object):
+  """Profiles the shell with cProfile while a statement executes, and writes the stats of
+  the last statement to 'path'. Only the shell's main thread is profiled, not the
+  background threads that prefetch rows or report progress."""
+
+  def __init__(self, path):
+    self.path = path
+    self.profile = None
+
+  def start(self):
+    import cProfile
+    self.profile = cProfile.Profile()
+    self.profile.enable()
+
+  def stop(self):
+    """Stops profiling and returns the most expensive functions as text."""
+    import pstats
+    from StringIO import StringIO
+    self.profile.disable()
+    text = StringIO()
+    try:
+      self.profile.dump_stats(self.path)
+    except IOError, e:
+      text.write("Unable to write the client profile to %s: %s\n" % (self.path, e))
+    stats = pstats.Stats(self.profile, stream=text)
+    stats.sort_stats('cumulative').print_stats(PROFILE_FUNCTIONS)
+    self.profile = None
+    return text.getvalue()
@@ -0,0 +1,113 @@
+#!/usr/bin/env impala-python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Measures how long it takes to start the Impala shell.
+#
+# Reports the wall time of 'impala-shell.sh --version', which does not connect to an
+# impalad, and with --impalad also of a delimited 'select 1', as typically run by
+# scripts. It also reports how long it takes to import the shell, and which of the
+# modules that the shell only loads on demand were imported at startup.
+#
+# Usage: tests/shell/benchmark_startup.py [-n ITERATIONS] [--impalad HOST:PORT]
+
+import os
+import subprocess
+import sys
+import time
+
+from optparse import OptionParser
+
+SHELL_HOME = os.environ.get('IMPALA_SHELL_HOME',
+                            os.path.join(os.environ['IMPALA_HOME'], 'shell'))
+SHELL_CMD = os.path.join(os.environ['IMPALA_HOME'], 'bin', 'impala-shell.sh')
+
+# Modules that should not be imported unless the shell needs them.
+ON_DEMAND_MODULES = ['sasl', 'thrift_sasl', 'pkg_resources', 'prettytable', 'sqlparse',
+                     'ConfigParser', 'impala_pretty_table', 'result_cache',
+                     'statement_pipeline', 'connection_broker', 'parquet_output',
+                     'parallel_export', 'job_control', 'completion_cache',
+                     'history_log', 'parallel_source']
+
+IMPORT_SCRIPT = """
+import sys, time
+sys.argv = ['impala_shell.py']
+start = time.time()
+import impala_shell
+print time.time() - start
+print ' '.join([name for name in %r if name in sys.modules])
+""" % ON_DEMAND_MODULES
+
+
+def time_command(args, iterations):
+  """Runs 'args' 'iterations' times and returns the sorted wall times in seconds."""
+  times = []
+  devnull = open(os.devnull, 'w')
+  try:
+    for _ in xrange(iterations):
+      start = time.time()
+      rc = subprocess.call(args, stdout=devnull, stderr=devnull)
+      times.append(time.time() - start)
+      if rc != 0:
+        raise Exception('Command failed with exit code %d: %s' % (rc, ' '.join(args)))
+  finally:
+    devnull.close()
+  return sorted(times)
+
+
+def time_import(iterations):
+  """Imports impala_shell in 'iterations' fresh interpreters. Returns the sorted import
+  times in seconds and the on-demand modules that were imported."""
+  times = []
+  imported = ''
+  for _ in xrange(iterations):
+    output = subprocess.Popen([sys.executable, '-c', IMPORT_SCRIPT], cwd=SHELL_HOME,
+                              stdout=subprocess.PIPE).communicate()[0]
+    import_time, imported = (output.split('\n') + [''])[:2]
+    times.append(float(import_time))
+  return sorted(times), imported.split()
+
+
+def print_times(name, times):
+  print '%-40s min %7.1fms  median %7.1fms' % (name, times[0] * 1000,
+                                               times[len(times) / 2] * 1000)
+
+
+def main():
+  parser = OptionParser()
+  parser.add_option('-n', '--iterations', type='int', default=10,
+                    help='Number of times each measurement is repeated.')
+  parser.add_option('--impalad', help='<host:port> of an impalad to run queries on.')
+  options, _ = parser.parse_args()
+
+  import_times, imported = time_import(options.iterations)
+  print_times('import impala_shell', import_times)
+  print_times('impala-shell --version',
+              time_command([SHELL_CMD, '--version'], options.iterations))
+  if options.impalad:
+    print_times('impala-shell -B -q "select 1"',
+                time_command([SHELL_CMD, '-i', options.impalad, '--quiet', '-B', '-q',
+                              'select 1'], options.iterations))
+  if imported:
+    print 'Modules imported at startup that should be loaded on demand: %s' % (
+        ', '.join(imported))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
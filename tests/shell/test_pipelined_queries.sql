@@ -0,0 +1,10 @@
+create table pipelined_t1 (i int);
+create table pipelined_t2 (i int);
+insert into pipelined_t1 values (1), (2);
+insert into pipelined_t2 values (3);
+sync;
+insert into pipelined_t2 select i from pipelined_t1;
+select count(*) from pipelined_t1;
+select i from pipelined_t2 order by i;
+drop table pipelined_t1;
+drop table pipelined_t2;
@@ -17,15 +17,19 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import json
 import os
 import pytest
 import re
 import signal
+import sys
 
+from parquet.ttypes import ConvertedType, Type
 from subprocess import call
 from tests.common.impala_service import ImpaladService
-from tests.common.impala_test_suite import ImpalaTestSuite
-from time import sleep
+from tests.common.impala_test_suite import ImpalaTestSuite, IMPALAD_HS2_HOST_PORT
+from tests.util.get_parquet_metadata import get_parquet_metadata
+from time import sleep, time
 from util import IMPALAD, SHELL_CMD
 from util import assert_var_substitution, run_impala_shell_cmd, ImpalaShell
 
@@ -189,6 +193,78 @@ class TestImpalaShell(ImpalaTestSuite):
     result = run_impala_shell_cmd(args)
     assert output == result.stdout, "Queries with comments not parsed correctly"
 
+  def test_pipelined_query_file(self, unique_database):
+    """Pipelined statements produce the same output as serial execution."""
+    args = '-d %s -f %s/test_pipelined_queries.sql --quiet -B' % \
+        (unique_database, QUERY_FILE_PATH)
+    serial_result = run_impala_shell_cmd(args)
+    assert serial_result.stdout.split() == ['2', '1', '2', '3']
+    pipelined_result = run_impala_shell_cmd(args + ' --pipeline_sessions=3')
+    assert pipelined_result.stdout == serial_result.stdout
+
+  def test_pipelined_query_file_failure(self, unique_database):
+    """A failed statement stops pipelined execution unless -c is given."""
+    args = '-d %s -f %s/test_pipelined_queries.sql --quiet -B --pipeline_sessions=3' % \
+        (unique_database, QUERY_FILE_PATH)
+    run_impala_shell_cmd('-q "create table %s.pipelined_t1 (i int)"' % unique_database)
+    result = run_impala_shell_cmd(args, expect_success=False)
+    assert 'Could not execute command: create table pipelined_t1' in result.stderr
+    run_impala_shell_cmd('-c ' + args)
+
+  def test_result_cache(self, unique_database, tmpdir):
+    """Repeated queries are served from the result cache until a statement writes a
+    table they mention."""
+    args = '--result_cache --result_cache_dir=%s -d %s -B' % (tmpdir, unique_database)
+    cached_msg = 'from the result cache'
+    run_impala_shell_cmd(args + ' -q "create table t (i int); insert into t values (1)"')
+    result = run_impala_shell_cmd(args + ' -q "select i from t; select  i  from t;"')
+    assert result.stdout.split() == ['1', '1']
+    assert result.stderr.count(cached_msg) == 1
+    # Cached results are shared between shells.
+    result = run_impala_shell_cmd(args + ' -q "select i from t; cache bypass select i'
+                                  ' from t; cache off; select i from t"')
+    assert result.stdout.split() == ['1', '1', '1']
+    assert result.stderr.count(cached_msg) == 1
+    # Statements that cannot write a table keep the cached results.
+    result = run_impala_shell_cmd(args + ' -q "use %s; show tables; /* t */ select 1;'
+                                  ' select i from t"' % unique_database)
+    assert result.stderr.count(cached_msg) == 1
+    result = run_impala_shell_cmd(args + ' -q "insert into t values (2);'
+                                  ' select i from t order by i"')
+    assert result.stdout.split() == ['1', '2']
+    assert cached_msg not in result.stderr
+    result = run_impala_shell_cmd(args + ' -q "cache clear; select i from t order by i"')
+    assert cached_msg not in result.stderr
+    # Other users must not be able to add entries to the cache.
+    tmpdir.chmod(0770)
+    result = run_impala_shell_cmd(args + ' -q "select i from t; select i from t"')
+    assert 'Unable to use the result cache' in result.stderr
+    assert cached_msg not in result.stderr
+
+  def test_connection_broker(self, tmpdir):
+    """Shells borrow connections from a connection broker, and the database selected by
+    one shell does not leak into the next one."""
+    socket_path = os.path.join(str(tmpdir), 'broker.sock')
+    broker = ImpalaShell('--connection_broker=%s --run_connection_broker' % socket_path)
+    try:
+      for _ in xrange(100):
+        if os.path.exists(socket_path): break
+        sleep(0.1)
+      args = '--connection_broker=%s -B' % socket_path
+      result = run_impala_shell_cmd(args + ' -q "use functional;'
+                                    ' select count(*) from alltypestiny"')
+      assert result.stdout.split() == ['8']
+      assert 'Unable to use the connection broker' not in result.stderr
+      result = run_impala_shell_cmd(args + ' -q "select current_database()"')
+      assert result.stdout.split() == ['default']
+      assert 'Unable to use the connection broker' not in result.stderr
+    finally:
+      os.kill(broker.pid(), signal.SIGINT)
+      broker.get_result()
+    # Without a broker, the shell connects directly.
+    result = run_impala_shell_cmd(args + ' -q "select 1"')
+    assert 'Unable to use the connection broker' in result.stderr
+
   def test_completed_query_errors(self):
     args = ('-q "set abort_on_error=false;'
             ' select count(*) from functional_seq_snap.bad_seq_snap"')
@@ -219,6 +295,205 @@ class TestImpalaShell(ImpalaTestSuite):
                                   expect_success=False)
     assert "Illegal delimiter" in result.stderr
 
+  def test_delimited_output_quoting(self):
+    """Only fields containing the delimiter, quotes or newlines are quoted."""
+    args = """-B --quiet --output_delim="," -q "select 'a,b', 'c', 'd|e', ''" """
+    result = run_impala_shell_cmd(args)
+    assert result.stdout.strip() == '"a,b",c,d|e,'
+
+  def test_hs2_columnar_fetch(self):
+    """Results fetched in columnar form over HiveServer2 are formatted like Beeswax
+    results, and values with embedded tabs stay intact."""
+    args = '--protocol=hs2 -i %s -B --quiet' % IMPALAD_HS2_HOST_PORT
+    query = ("select id, cast(id as double) / 3, bool_col, if(id = 1, NULL, "
+             "concat('a', chr(9), 'b')) from functional.alltypestiny where id < 3 "
+             "order by id")
+    result = run_impala_shell_cmd('%s --output_delim="," -q "%s"' % (args, query))
+    assert result.stdout.strip().split('\n') == ['0,0,true,a\tb',
+        '1,0.3333333333333333,false,NULL', '2,0.6666666666666666,true,a\tb']
+    # Results spanning many fetch RPCs are complete.
+    result = run_impala_shell_cmd(
+        args + ' -q "select id from functional.alltypes order by id"')
+    assert result.stdout.strip().split('\n') == [str(i) for i in xrange(7300)]
+
+  def test_parquet_output_format(self, tmpdir):
+    """Results are written to a Parquet file with the types of the result columns."""
+    output_file = os.path.join(str(tmpdir), 'result.parq')
+    query = ("select id, bool_col, tinyint_col, smallint_col, bigint_col, double_col, "
+             "string_col, timestamp_col from functional.alltypes")
+    args = '--output_format=parquet -o %s -q "%s"' % (output_file, query)
+    result = run_impala_shell_cmd(args)
+    assert 'Fetched 7300 row(s)' in result.stderr
+    metadata = get_parquet_metadata(output_file)
+    assert metadata.num_rows == 7300
+    assert sum([row_group.num_rows for row_group in metadata.row_groups]) == 7300
+    assert [(element.name, element.type, element.converted_type)
+            for element in metadata.schema[1:]] == [
+        ('id', Type.INT32, None), ('bool_col', Type.BOOLEAN, None),
+        ('tinyint_col', Type.INT32, ConvertedType.INT_8),
+        ('smallint_col', Type.INT32, ConvertedType.INT_16),
+        ('bigint_col', Type.INT64, None), ('double_col', Type.DOUBLE, None),
+        ('string_col', Type.BYTE_ARRAY, ConvertedType.UTF8),
+        ('timestamp_col', Type.BYTE_ARRAY, ConvertedType.UTF8)]
+    result = run_impala_shell_cmd('--output_format=parquet -q "select 1"',
+                                  expect_success=False)
+    assert '--output_format=parquet requires --output_file' in result.stderr
+
+  def test_parquet_output_multiple_statements(self, tmpdir):
+    """Only one statement may write its result to the Parquet output file, the result of
+    a later statement does not replace it."""
+    output_file = os.path.join(str(tmpdir), 'result.parq')
+    args = ('--output_format=parquet -o %s -q "use functional; '
+            'select id from alltypes; select 1"' % output_file)
+    result = run_impala_shell_cmd(args, expect_success=False)
+    assert 'Fetched 7300 row(s)' in result.stderr
+    assert 'already holds the result of a previous statement' in result.stderr
+    assert get_parquet_metadata(output_file).num_rows == 7300
+
+  def test_export(self, tmpdir):
+    """EXPORT writes every row of the result to exactly one partition file."""
+    for name, partitioning in [('hash', 'id'), ('range', 'range(id, 0, 8)')]:
+      directory = os.path.join(str(tmpdir), name)
+      # Fewer sessions than partitions, so that some partitions wait for a free one.
+      args = ('--export_sessions=2 -q "export %s partitions 3 by %s select id, '
+              'string_col from functional.alltypestiny"' % (directory, partitioning))
+      result = run_impala_shell_cmd(args)
+      assert 'Exported 8 row(s) into 3 file(s)' in result.stderr
+      rows = []
+      for i in xrange(3):
+        partition = open(os.path.join(directory, 'part-%05d.txt' % i)).read()
+        rows.extend(partition.splitlines())
+      assert sorted(rows) == ['%d\t%d' % (i, i % 2) for i in xrange(8)]
+    result = run_impala_shell_cmd('-q "export %s partitions 3 select 1"' % tmpdir,
+                                  expect_success=False)
+    assert 'Usage: EXPORT' in result.stderr
+
+  def test_parallel_query_files(self, tmpdir):
+    """The query files that match the pattern are executed concurrently, and the failed
+    ones are summarized."""
+    for i in xrange(4):
+      tmpdir.join('file%d.sql' % i).write(
+          'use functional;\nset mem_limit=1g;\nselect count(*) from alltypestiny;\n')
+    tmpdir.join('file4.sql').write('select 1;\nselect * from non_existent_table;\n')
+    pattern = os.path.join(str(tmpdir), 'file*.sql')
+    args = '-f "%s" --parallel_query_files=3' % pattern
+    result = run_impala_shell_cmd(args, expect_success=False)
+    for i in xrange(4):
+      path = tmpdir.join('file%d.sql' % i)
+      assert 'Executed %s: 3 statement(s)' % path in result.stderr
+    assert 'Executed 5 file(s)' in result.stderr
+    assert 'Failed: %s' % tmpdir.join('file4.sql') in result.stderr
+    assert 'Statement: select * from non_existent_table' in result.stderr
+    # The same files with the SOURCE PARALLEL command.
+    tmpdir.join('file4.sql').remove()
+    result = run_impala_shell_cmd('-q "source parallel %s 2"' % pattern)
+    assert 'Executed 4 file(s)' in result.stderr
+    assert ', 0 failed' in result.stderr
+    # Shell options and variables cannot be set in a file.
+    for i, statement in enumerate(['set live_progress=true', 'set var:x=1']):
+      tmpdir.join('file%d.sql' % i).write('%s;\nselect 1;\n' % statement)
+    result = run_impala_shell_cmd(args, expect_success=False)
+    assert 'SET LIVE_PROGRESS is not supported in parallel files' in result.stderr
+    assert 'SET VAR:X is not supported in parallel files' in result.stderr
+    assert ', 2 failed' in result.stderr
+
+  def test_background_statement_non_interactive(self):
+    """Statements are only executed in the background in interactive mode."""
+    result = run_impala_shell_cmd('-q "select 1 &; select 2"', expect_success=False)
+    assert "can only be executed in the background in interactive mode" in result.stderr
+    assert "Submitted" not in result.stderr
+
+  def test_statement_timing(self, tmpdir):
+    """The timing of every statement is written to the timing file, and the TIMING
+    command prints the one of the last statement."""
+    timing_file = os.path.join(str(tmpdir), 'timing.json')
+    args = ('--timing_file=%s -q "select id from functional.alltypes; '
+            'select 1; timing"' % timing_file)
+    result = run_impala_shell_cmd(args)
+    # The breakdown printed by TIMING, which the echo of the statement does not match.
+    assert re.search(r'Query: select 1\n(Query id: \S+\n)?  submit +\d+\.\d{3}s',
+                     result.stderr)
+    assert re.search(r'\n  total +\d+\.\d{3}s\nRPCs: \d+ in ', result.stderr)
+    assert 'Rows: 1, ' in result.stderr
+    timings = [json.loads(line) for line in open(timing_file)]
+    assert [timing['query'] for timing in timings] == [
+        'select id from functional.alltypes', 'select 1']
+    assert [timing['num_rows'] for timing in timings] == [7300, 1]
+    for timing in timings:
+      assert timing['succeeded']
+      assert timing['num_rpcs'] > 0 and timing['bytes_received'] > 0
+      assert sum(timing['phase_secs'].values()) <= timing['total_secs']
+
+  def test_fetch_multiple_batches(self):
+    """Results spanning many fetch RPCs are streamed completely and in order."""
+    args = '-q "select id from functional.alltypes order by id" -B --quiet'
+    result = run_impala_shell_cmd(args)
+    actual_output = result.stdout.strip().split('\n')
+    assert actual_output == [str(i) for i in xrange(7300)]
+
+  def test_pretty_output_multiple_batches(self):
+    """Results spanning many fetch RPCs are rendered as one table. Only a row that is
+    wider than the columns sized from the first batch starts another table."""
+    args = '-q "select id from functional.alltypes where id < 2000 order by id" --quiet'
+    result = run_impala_shell_cmd(args)
+    lines = result.stdout.strip().split('\n')
+    headers = [i for i, line in enumerate(lines) if line.split() == ['|', 'id', '|']]
+    assert 1 <= len(headers) <= 2
+    assert headers[0] == 1
+    rows = [line for line in lines if line.startswith('|') and 'id' not in line]
+    assert [row.strip('| ') for row in rows] == [str(i) for i in xrange(2000)]
+    # All lines of a table have the width of its borders.
+    for line in lines[headers[-1]:]:
+      assert len(line) == len(lines[-1])
+    assert lines[-1] == '+------+'
+
+  def test_poll_interval_after_scans_complete(self, monkeypatch):
+    """Once all scan ranges of a query have completed, the poll interval keeps backing
+    off to its maximum instead of dropping back to the minimum on every poll."""
+    # Temporarily add the shell modules to the path to test the client directly.
+    sys.path.append("%s/shell/" % os.environ['IMPALA_HOME'])
+    try:
+      import impala_client
+    finally:
+      sys.path = sys.path[:-1]
+
+    class Progress(object):
+      num_completed_scan_ranges = 10
+      total_scan_ranges = 10
+
+    class Summary(object):
+      progress = Progress()
+
+    class PollingClient(impala_client.ImpalaClient):
+      num_polls = 0
+      num_summaries = 0
+
+      def get_query_state(self, last_query_handle):
+        self.num_polls += 1
+        if self.num_polls > 20: return self.query_state["FINISHED"]
+        return self.query_state["RUNNING"]
+
+      def get_summary(self, last_query_handle):
+        self.num_summaries += 1
+        return Summary()
+
+    sleeps = []
+    monkeypatch.setattr(impala_client.time, 'sleep', sleeps.append)
+    client = PollingClient(IMPALAD)
+    client.wait_to_finish(None)
+    assert len(sleeps) == 20
+    assert sleeps == sorted(sleeps)
+    assert sleeps[-1] == client.MAX_POLL_INTERVAL_S
+    # The sleeps take no time, so the progress is only checked once.
+    assert client.num_summaries == 1
+    # While scans are still running, the interval is capped by the estimated remaining
+    # time. The estimate is reused until the progress is checked again.
+    Progress.num_completed_scan_ranges = 9
+    estimate = [0.0, None]
+    assert client._get_sleep_interval(time() - 0.9, None, 1.0, estimate) < 0.1
+    assert client._get_sleep_interval(time() - 0.9, None, 1.0, estimate) < 0.1
+    assert client.num_summaries == 2
+
   def test_do_methods(self, empty_table):
     """Ensure that the do_ methods in the shell work.
 
@@ -391,6 +666,17 @@ class TestImpalaShell(ImpalaTestSuite):
     result = run_impala_shell_cmd(args)
     assert output == result.stdout, "Queries from STDIN not parsed correctly."
 
+  def test_large_query_file(self):
+    """Test that a query file that is read in several chunks is split correctly, even if
+    strings and comments span chunk boundaries."""
+    args = '-f - --quiet -B'
+    padding = 'x;' * 10000
+    query = ''.join(["select %d, '%s'; -- %s\n/* %s */" % (i, padding, padding, padding)
+                     for i in xrange(10)])
+    result = run_impala_shell_cmd(args, expect_success=True, stdin_input=query)
+    assert [line.split('\t')[0] for line in result.stdout.splitlines()] == \
+        [str(i) for i in xrange(10)]
+
   def test_allow_creds_in_clear(self):
     args = '-l'
     result = run_impala_shell_cmd(args, expect_success=False)
@@ -25,7 +25,7 @@ import shutil
 import signal
 import socket
 import sys
-from time import sleep
+from time import sleep, time
 
 from tests.common.impala_service import ImpaladService
 from tests.common.skip import SkipIfLocal
@@ -34,6 +34,7 @@ from util import assert_var_substitution, ImpalaShell
 SHELL_CMD = "%s/bin/impala-shell.sh" % os.environ['IMPALA_HOME']
 SHELL_HISTORY_FILE = os.path.expanduser("~/.impalahistory")
 TMP_HISTORY_FILE = os.path.expanduser("~/.impalahistorytmp")
+SHELL_HISTORY_LOG = os.path.expanduser("~/.impala_history_log")
 QUERY_FILE_PATH = os.path.join(os.environ['IMPALA_HOME'], 'tests', 'shell')
 
 class TestImpalaShellInteractive(object):
@@ -43,10 +44,14 @@ class TestImpalaShellInteractive(object):
   def setup_class(cls):
     if os.path.exists(SHELL_HISTORY_FILE):
       shutil.move(SHELL_HISTORY_FILE, TMP_HISTORY_FILE)
+    for path in (SHELL_HISTORY_LOG, SHELL_HISTORY_LOG + '.idx'):
+      if os.path.exists(path): shutil.move(path, path + 'tmp')
 
   @classmethod
   def teardown_class(cls):
     if os.path.exists(TMP_HISTORY_FILE): shutil.move(TMP_HISTORY_FILE, SHELL_HISTORY_FILE)
+    for path in (SHELL_HISTORY_LOG, SHELL_HISTORY_LOG + '.idx'):
+      if os.path.exists(path + 'tmp'): shutil.move(path + 'tmp', path)
 
   def _expect_with_cmd(self, proc, cmd, expectations=()):
     """Executes a command on the expect process instance and verifies a set of
@@ -68,6 +73,23 @@ class TestImpalaShellInteractive(object):
     self._expect_with_cmd(proc, "set live_summary=1")
     self._expect_with_cmd(proc, "set", ("LIVE_PROGRESS: True", "LIVE_SUMMARY: True"))
 
+  @pytest.mark.execute_serially
+  def test_table_name_completion(self):
+    """Test that table names are completed with TAB from the completion cache"""
+    proc = pexpect.spawn(SHELL_CMD)
+    proc.expect(":21000] >")
+    self._expect_with_cmd(proc, "use functional")
+    # The table names are fetched in the background after USE, so the statement fails
+    # until they are in the cache.
+    deadline = time() + 30
+    while True:
+      proc.send("select count(*) from alltypestin\t")
+      self._expect_with_cmd(proc, "")
+      if "| 8 " in proc.before: break
+      assert time() < deadline, "The table name was not completed"
+      sleep(0.1)
+    assert "alltypestiny" in proc.before
+
   @pytest.mark.execute_serially
   def test_compute_stats_with_live_progress_options(self):
     """Test that setting LIVE_PROGRESS options won't cause COMPUTE STATS query fail"""
@@ -82,6 +104,21 @@ class TestImpalaShellInteractive(object):
     result = p.get_result()
     assert "Updated 1 partition(s) and 1 column(s)" in result.stdout
 
+  @pytest.mark.execute_serially
+  def test_live_progress_with_results(self):
+    """Test that the results of a query are complete when its live progress and summary
+    are fetched in the background while the results are fetched."""
+    p = ImpalaShell()
+    p.send_cmd("set live_progress=True")
+    p.send_cmd("set live_summary=True")
+    p.send_cmd("select sleep(2000), count(*) from functional.alltypestiny")
+    p.send_cmd("select id from functional.alltypestiny order by id")
+    result = p.get_result()
+    assert "Fetched 1 row(s)" in result.stderr
+    assert "Fetched 8 row(s)" in result.stderr
+    for i in xrange(8):
+      assert "| %d  |" % i in result.stdout
+
   @pytest.mark.execute_serially
   def test_escaped_quotes(self):
     """Test escaping quotes"""
@@ -96,6 +133,16 @@ class TestImpalaShellInteractive(object):
     result = run_impala_shell_interactive("select \"ab\\\"c\";")
     assert "Fetched 1 row(s)" in result.stderr
 
+  @pytest.mark.execute_serially
+  def test_delimiters_in_quotes_and_comments(self):
+    """Test that delimiters in quotes or comments spanning multiple lines do not end
+    a command"""
+    result = run_impala_shell_interactive("select 'a;\nb;'")
+    assert "Fetched 1 row(s)" in result.stderr
+    result = run_impala_shell_interactive("select /* a;\nb; */ 1; select `c;\n`.d from"
+                                          " (select 2 d) `c;\n`")
+    assert result.stderr.count("Fetched 1 row(s)") == 2
+
   @pytest.mark.execute_serially
   def test_cancellation(self):
     impalad = ImpaladService(socket.getfqdn())
@@ -109,6 +156,32 @@ class TestImpalaShellInteractive(object):
     assert "Cancelled" not in result.stderr
     assert impalad.wait_for_num_in_flight_queries(0)
 
+  @pytest.mark.execute_serially
+  def test_background_jobs(self):
+    """Statements that end with '&' run in the background and are controlled with JOBS,
+    WAIT, FETCH and CANCEL."""
+    impalad = ImpaladService(socket.getfqdn())
+    impalad.wait_for_num_in_flight_queries(0)
+    result = run_impala_shell_interactive([
+        "select count(*) from functional.alltypes &;",
+        "use functional;",
+        "select string_col from alltypestiny where id = 1 &;",
+        "select sleep(100000) &;",
+        "jobs;",
+        "cancel 3;",
+        "wait;",
+        "fetch 2;",
+        "fetch 1;",
+        "fetch 1;"])
+    assert "[1] Submitted: select count(*) from functional.alltypes" in result.stderr
+    assert "| Job | State" in result.stderr
+    assert "[3] Cancelled: select sleep(100000)" in result.stderr
+    assert "[1] Ready: select count(*)" in result.stderr
+    # The results are printed in the order they are fetched.
+    assert result.stdout.index("| string_col |") < result.stdout.index("| 7300     |")
+    assert "No such job: 1" in result.stderr
+    assert impalad.wait_for_num_in_flight_queries(0)
+
   @pytest.mark.execute_serially
   def test_unicode_input(self):
     "Test queries containing non-ascii input"
@@ -230,6 +303,32 @@ class TestImpalaShellInteractive(object):
     for query in queries:
       assert query in result.stderr, "'%s' not in '%s'" % (query, result.stderr)
 
+  @pytest.mark.execute_serially
+  def test_history_search_and_replay(self):
+    """Test that statements from the history log can be searched and replayed"""
+    p = ImpalaShell()
+    p.send_cmd("select 'history_marker_1'")
+    p.send_cmd("select 'history_marker_2'")
+    p.send_cmd("history /history_marker_[12]/")
+    result = p.get_result()
+    assert "select 'history_marker_1'" in result.stderr
+    assert "select 'history_marker_2'" in result.stderr
+
+    # Statements keep their ids across sessions, so the last ones can be replayed.
+    p = ImpalaShell()
+    p.send_cmd("history")
+    result = p.get_result()
+    ids = [line.split(']')[0].lstrip('[') for line in result.stderr.splitlines()
+           if "]: select 'history_marker_" in line]
+    assert len(ids) == 2
+    p = ImpalaShell()
+    p.send_cmd("history replay %s-%s" % (ids[0], ids[1]))
+    result = p.get_result()
+    assert "Replaying [%s]" % ids[0] in result.stderr
+    assert "history_marker_1" in result.stdout
+    assert "history_marker_2" in result.stdout
+    assert "Succeeded" in result.stderr
+
   @pytest.mark.execute_serially
   def test_tip(self):
     """Smoke test for the TIP command"""
@@ -57,6 +57,7 @@ import logging
 import os
 import re
 import signal
+import sqlite3
 import sys
 import threading
 import traceback
@@ -64,7 +65,9 @@ from Queue import Empty   # Must be before Queue below
 from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime
-from multiprocessing import Lock, Process, Queue, Value
+from functools import partial
+from hashlib import sha1
+from multiprocessing import Lock, Manager, Process, Queue, Value
 from random import choice, random, randrange
 from sys import exit, maxint
 from tempfile import gettempdir
@@ -72,6 +75,8 @@ from textwrap import dedent
 from threading import current_thread, Thread
 from time import sleep, time
 
+import numpy as np
+
 import tests.util.test_file_parser as test_file_parser
 from tests.comparison.cluster import Timeout
 from tests.comparison.model_translator import SqlWriter
@@ -90,8 +95,22 @@ MEM_LIMIT_EQ_THRESHOLD_MB = 50
 # Regex to extract the estimated memory from an explain plan.
 MEM_ESTIMATE_PATTERN = re.compile(r"Estimated.*Memory=(\d+.?\d*)(T|G|M|K)?B")
 
-# The version of the file format containing the collected query runtime info.
-RUNTIME_INFO_FILE_VERSION = 2
+# Regexes to extract the operators, ex: "03:HASH JOIN [INNER JOIN, BROADCAST]", and the
+# cardinality estimates from an extended explain plan.
+PLAN_OPERATOR_PATTERN = re.compile(r"\d+:([A-Z][A-Z -]*[A-Z])")
+PLAN_CARDINALITY_PATTERN = re.compile(r"cardinality=(\d+)")
+# The EXPLAIN_LEVEL that sessions use by default.
+DEFAULT_EXPLAIN_LEVEL = 1
+
+# The plan operators that are counted as features of a query, see MemLimitPredictor.
+PLAN_OPERATORS = ("SCAN HDFS", "HASH JOIN", "NESTED LOOP JOIN", "AGGREGATE", "SORT",
+    "TOP-N", "ANALYTIC", "UNION", "EXCHANGE")
+
+# The version of the file format containing the collected query runtime info. Up to
+# version 3 the runtime info was stored in a JSON file, since version 4 it is stored in
+# a SQLite database.
+RUNTIME_INFO_FILE_VERSION = 4
+LAST_JSON_RUNTIME_INFO_FILE_VERSION = 3
 
 
 def create_and_start_daemon_thread(fn, name):
@@ -260,7 +279,10 @@ class StressRunner(object):
      purpose of stress testing Impala.
 
      Queries will be executed in separate processes since python threading is limited
-     to the use of a single CPU.
+     to the use of a single CPU. Each runner process runs up to 'sessions_per_runner'
+     sessions in threads, so many concurrent queries do not need as many processes.
+     If 'num_hash_processes' is set, the results of all sessions are hashed by a pool of
+     that many processes instead of by the runner processes.
   """
 
   # This is the point at which the work queue will block because it is full.
@@ -270,6 +292,9 @@ class StressRunner(object):
     self.use_kerberos = False
     self.common_query_options = {}
     self._mem_broker = None
+    self.sessions_per_runner = 1
+    self.num_hash_processes = 0
+    self._hash_pool = None
 
     # Synchronized blocking work queue for producer/consumers.
     self._query_queue = Queue(self.WORK_QUEUE_CAPACITY)
@@ -306,6 +331,9 @@ class StressRunner(object):
     self._num_successive_errors = Value("i", 0)
     self.result_hash_log_dir = gettempdir()
 
+    # The number of sessions that are running queries, across all runner processes.
+    self._num_sessions = Value("i", 0)
+
     self._status_headers = [" Done", "Running", "Mem Lmt Ex", "Time Out", "Cancel",
         "Err", "Next Qry Mem Lmt", "Tot Qry Mem Lmt", "Tracked Mem", "RSS Mem"]
 
@@ -340,6 +368,8 @@ class StressRunner(object):
 
     if self.startup_queries_per_sec <= 0:
       raise Exception("Startup queries per second must be positive")
+    if self.sessions_per_runner <= 0:
+      raise Exception("Sessions per runner must be positive")
     if self.leak_check_interval_mins is not None and self.leak_check_interval_mins <= 0:
       raise Exception("Memory leak check interval must be positive")
 
@@ -357,6 +387,10 @@ class StressRunner(object):
       last_report_secs = 0
 
     self._num_queries_to_run = num_queries_to_run
+    if self.num_hash_processes:
+      # The pool must be started before the runner processes, which inherit it.
+      self._hash_pool = HashPool(self.num_hash_processes)
+      self._hash_pool.start()
     self._start_polling_mem_usage(impala)
     self._start_producing_queries(queries)
     self._start_consuming_queries(impala)
@@ -399,6 +433,7 @@ class StressRunner(object):
             LOG.debug("Consumer is alive: %s" % self._query_consumer_thread.is_alive())
             LOG.debug("Queue size: %s" % self._query_queue.qsize())
             LOG.debug("Runners: %s" % len(self._query_runners))
+            LOG.debug("Sessions: %s" % self._num_sessions.value)
           last_report_secs = 0
           lines_printed %= 50
           if lines_printed == 0:
@@ -423,27 +458,43 @@ class StressRunner(object):
         "Query Producer")
 
   def _start_consuming_queries(self, impala):
-    def start_additional_runners_if_needed():
+    def start_additional_sessions_if_needed():
+      runners = list()
       try:
+        num_sessions_started = 0
+        runner = None
         while self._num_queries_started.value < self._num_queries_to_run:
           sleep(1.0 / self.startup_queries_per_sec)
           # Remember num dequeued/started are cumulative.
           with self._submit_query_lock:
             if self._num_queries_dequeued.value != self._num_queries_started.value:
               # Assume dequeued queries are stuck waiting for cluster resources so there
-              # is no point in starting an additional runner.
+              # is no point in starting an additional session.
               continue
-          impalad = impala.impalads[len(self._query_runners) % len(impala.impalads)]
-          runner = Process(target=self._start_single_runner, args=(impalad, ))
-          runner.daemon = True
-          self._query_runners.append(runner)
-          runner.start()
+          if runner is None or not runner.is_alive() \
+              or runner.num_sessions >= self.sessions_per_runner:
+            session_queue = Queue()
+            runner = Process(target=self._start_runner_process, args=(session_queue, ))
+            runner.daemon = True
+            runner.session_queue = session_queue
+            runner.num_sessions = 0
+            runners.append(runner)
+            self._query_runners.append(runner)
+            runner.start()
+          impalad = impala.impalads[num_sessions_started % len(impala.impalads)]
+          runner.session_queue.put(impalad)
+          runner.num_sessions += 1
+          num_sessions_started += 1
       except Exception as e:
         LOG.error("Error consuming queries: %s", e)
         current_thread().error = e
         raise e
+      finally:
+        # Let the runners exit once their sessions are done.
+        for runner in runners:
+          runner.session_queue.put(None)
     self._query_consumer_thread = create_and_start_daemon_thread(
-        start_additional_runners_if_needed, "Query Consumer")
+        start_additional_sessions_if_needed, "Query Consumer")
 
   def _start_polling_mem_usage(self, impala):
     def poll_mem_usage():
@@ -470,8 +521,8 @@ class StressRunner(object):
           if not query_sumbission_is_locked \
               and self.leak_check_interval_mins \
               and time() > self._next_leak_check_unix_time.value:
-            assert self._num_queries_running <= len(self._query_runners), \
-                "Each running query should belong to a runner"
+            assert self._num_queries_running <= self._num_sessions.value, \
+                "Each running query should belong to a session"
             LOG.debug("Stopping query submission")
             self._submit_query_lock.acquire()
             query_sumbission_is_locked = True
@@ -532,19 +583,59 @@ class StressRunner(object):
     assert num_running >= 0, "The number of running queries is negative"
     return num_running
 
-  def _start_single_runner(self, impalad):
-    """Consumer function to take a query of the queue and run it. This is intended to
-       run in a separate process so validating the result set can use a full CPU.
+  def _start_runner_process(self, session_queue):
+    """Runs a session in a new thread for each impalad received through 'session_queue'.
+       This is intended to run in a separate process. The process exits once None was
+       received and its sessions are done. If a session fails, the other sessions stop
+       after their current query and the process exits with an error.
     """
     LOG.debug("New query runner started")
+    sessions = list()
+    session_failed = threading.Event()
+    more_sessions = True
+    while more_sessions and not session_failed.is_set():
+      try:
+        impalad = session_queue.get(True, 1)
+      except Empty:
+        continue
+      if impalad is None:
+        more_sessions = False
+        continue
+      sessions.append(create_and_start_daemon_thread(
+          self._create_session_fn(impalad, session_failed),
+          "Session %s" % len(sessions)))
+    for session in sessions:
+      session.join()
+      if session.error:
+        raise session.error
+
+  def _create_session_fn(self, impalad, session_failed):
+    def run_session():
+      increment(self._num_sessions)
+      try:
+        self._run_session(impalad, session_failed)
+      except Exception as e:
+        LOG.error("Error running queries: %s", e)
+        current_thread().error = e
+        session_failed.set()
+      finally:
+        with self._num_sessions.get_lock():
+          self._num_sessions.value -= 1
+    return run_session
+
+  def _run_session(self, impalad, session_failed):
+    """Consumer function to take a query of the queue and run it, until the queue is
+       empty or another session of the process failed.
+    """
     runner = QueryRunner()
     runner.impalad = impalad
     runner.result_hash_log_dir = self.result_hash_log_dir
     runner.use_kerberos = self.use_kerberos
     runner.common_query_options = self.common_query_options
+    runner.hash_pool = self._hash_pool
     runner.connect()
 
-    while not self._query_queue.empty():
+    while not self._query_queue.empty() and not session_failed.is_set():
       try:
         query = self._query_queue.get(True, 1)
       except Empty:
@@ -631,6 +722,7 @@ class StressRunner(object):
           raise Exception("Result hash mismatch; expected %s, got %s\nQuery: %s"
               % (query.result_hash, report.result_hash, query.sql))
         self._num_successive_errors.value = 0
+    runner.disconnect()
 
   def _print_status_header(self):
     print(" | ".join(self._status_headers))
@@ -677,6 +769,8 @@ class Query(object):
     self.required_mem_mb_without_spilling = None
     self.solo_runtime_secs_with_spilling = None
     self.solo_runtime_secs_without_spilling = None
+    # The features of the plan of the query, see get_plan_features().
+    self.plan_features = None
 
   def __repr__(self):
     return dedent("""
@@ -689,11 +783,160 @@ class Query(object):
         SQL: %(sql)s>""".strip() % self.__dict__)
 
 
+class ResultHasher(object):
+  """Computes a hash of a result set that is independent of row order, one batch of rows
+     at a time. The values of each column of a batch are hashed together with numpy,
+     and the hash is the sum of the value hashes weighted by their column position, so
+     the order of the rows does not matter.
+  """
+
+  # The hash() of None can change from run to run since it's based on a memory address.
+  # This value is used for NULLs instead.
+  NULL_HASH = 38463209
+  INT_TYPES = frozenset(["BOOLEAN", "TINYINT", "SMALLINT", "INT", "BIGINT"])
+  FLOAT_TYPES = frozenset(["FLOAT", "DOUBLE"])
+  # Floats returned by Impala may not be deterministic, the ending insignificant digits
+  # may differ. Floats are rounded to this many digits, including the integral ones.
+  FLOAT_DIGITS = 6
+  HASH_MASK = 2 ** 64 - 1
+
+  def __init__(self, column_types):
+    self.column_types = [str(column_type).upper() for column_type in column_types]
+    self.result = 0
+
+  def add_rows(self, rows):
+    for idx, column in enumerate(zip(*rows)):
+      if self.column_types[idx] in self.INT_TYPES:
+        hashes = self._hash_ints(column)
+      elif self.column_types[idx] in self.FLOAT_TYPES:
+        hashes = self._hash_floats(column)
+      else:
+        hashes = self._hash_objects(column)
+      # The sum wraps around, which keeps the math fast and does not depend on the order.
+      column_hash = int(hashes.view(np.uint64).sum(dtype=np.uint64))
+      self.result = (self.result + (idx + 1) * column_hash) & self.HASH_MASK
+
+  def get_hash(self):
+    return self.result
+
+  def _hash_ints(self, column):
+    try:
+      return np.array(column, dtype=np.int64)
+    except TypeError:
+      return np.array([self.NULL_HASH if val is None else val for val in column],
+          dtype=np.int64)
+
+  def _hash_floats(self, column):
+    vals = np.array(column, dtype=np.float64)
+    with np.errstate(all="ignore"):
+      # Round to 'FLOAT_DIGITS' minus the number of characters before the decimal point,
+      # i.e. the integral digits and the sign.
+      abs_vals = np.abs(vals)
+      int_digits = np.where(abs_vals < 1, 1, np.floor(np.log10(abs_vals)) + 1)
+      decimals = self.FLOAT_DIGITS - int_digits - (vals < 0)
+      # Powers of 10 up to 10^22 are exact, so the rounded values are the closest floats
+      # to the decimal values.
+      scale = np.power(10.0, np.abs(decimals))
+      rounded = np.where(decimals >= 0,
+          np.rint(vals * scale) / scale, np.rint(vals / scale) * scale)
+      # Adding 0 turns -0.0 into 0.0. Infinite values and NaN are hashed as they are.
+      rounded = np.where(np.isfinite(vals), rounded + 0.0, vals)
+    hashes = rounded.view(np.int64)
+    if None in column:
+      hashes[np.array([val is None for val in column])] = self.NULL_HASH
+    return hashes
+
+  def _hash_objects(self, column):
+    if None in column:
+      column = [self.NULL_HASH if val is None else val for val in column]
+    return np.array(map(hash, column), dtype=np.int64)
+
+
+class HashPool(object):
+  """Hashes batches of result rows in worker processes, so that the sessions of a runner
+     process do not compete for its CPU to hash results. The pool must be started before
+     the runner processes, which inherit its task queue.
+  """
+
+  def __init__(self, num_workers):
+    self.num_workers = num_workers
+    self._tasks = Queue()
+    self._manager = None
+    self._workers = list()
+
+  def start(self):
+    # The manager provides result queues that can be created after the workers were
+    # started, and be sent to them.
+    self._manager = Manager()
+    for idx in xrange(self.num_workers):
+      worker = Process(target=self._run_worker, name="Hash Worker %s" % idx)
+      worker.daemon = True
+      self._workers.append(worker)
+      worker.start()
+
+  def create_result_queue(self):
+    return self._manager.Queue()
+
+  def submit(self, result_queue, column_types, rows):
+    """Hashes 'rows'. Their hash, or an error message, is put in 'result_queue'."""
+    self._tasks.put((result_queue, column_types, rows))
+
+  def _run_worker(self):
+    while True:
+      result_queue, column_types, rows = self._tasks.get()
+      try:
+        hasher = ResultHasher(column_types)
+        hasher.add_rows(rows)
+        result_queue.put((hasher.get_hash(), None))
+      except Exception as e:
+        result_queue.put((None, str(e)))
+
+
+class PooledResultHasher(object):
+  """Like ResultHasher but the batches of rows are hashed by a HashPool, while the
+     next batches are fetched.
+  """
+
+  # The number of batches that may be waiting to be hashed. This bounds the memory used
+  # by the rows of a query that is fetched faster than it is hashed.
+  MAX_PENDING_BATCHES = 4
+
+  def __init__(self, hash_pool, column_types):
+    self._hash_pool = hash_pool
+    self._column_types = column_types
+    # Each query has a queue of its own, so the hashes of a query that timed out cannot
+    # be taken for the next one.
+    self._results = hash_pool.create_result_queue()
+    self._num_pending = 0
+    self.result = 0
+
+  def add_rows(self, rows):
+    if self._num_pending >= self.MAX_PENDING_BATCHES:
+      self._add_next_hash()
+    self._hash_pool.submit(self._results, self._column_types, rows)
+    self._num_pending += 1
+
+  def get_hash(self):
+    while self._num_pending:
+      self._add_next_hash()
+    return self.result
+
+  def _add_next_hash(self):
+    batch_hash, error = self._results.get()
+    self._num_pending -= 1
+    if error is not None:
+      raise Exception("Error hashing results: %s" % error)
+    # The hash of a result is the sum of the hashes of its batches.
+    self.result = (self.result + batch_hash) & ResultHasher.HASH_MASK
+
+
 class QueryRunner(object):
   """Encapsulates functionality to run a query and provide a runtime report."""
 
   SPILLED_PATTERN = re.compile("ExecOption:.*Spilled")
   BATCH_SIZE = 1024
+  # The number of rows written to the log file of an unexpected result.
+  MAX_LOGGED_ROWS = 10000
 
   def __init__(self):
     self.impalad = None
@@ -702,6 +945,8 @@ class QueryRunner(object):
     self.result_hash_log_dir = gettempdir()
     self.check_if_mem_was_spilled = False
     self.common_query_options = {}
+    # If set, results are hashed by this HashPool instead of the thread of the query.
+    self.hash_pool = None
 
   def connect(self):
     self.impalad_conn = self.impalad.impala.connect(impalad=self.impalad)
@@ -837,54 +1082,29 @@ class QueryRunner(object):
     # A value of 1 indicates that the hash thread should continue to work.
     should_continue = Value("i", 1)
     def hash_result_impl():
-      result_log = None
+      # The first rows are kept to be logged if the result is not the expected one. A
+      # result can only be unexpected if there is an expected result.
+      logged_rows = list() if query.result_hash is not None else None
       try:
-        file_name = query_id.replace(":", "_")
-        if query.result_hash is None:
-          file_name += "_initial"
-        file_name += "_results.txt"
-        result_log = open(os.path.join(self.result_hash_log_dir, file_name), "w")
-        result_log.write(query.sql)
-        result_log.write("\n")
-        current_thread().result = 1
+        column_types = [column[1] for column in cursor.description]
+        if self.hash_pool:
+          hasher = PooledResultHasher(self.hash_pool, column_types)
+        else:
+          hasher = ResultHasher(column_types)
         while should_continue.value:
-          LOG.debug("Fetching result for query with id %s",
-              op_handle_to_query_id(cursor._last_operation_handle))
+          LOG.debug("Fetching result for query with id %s", query_id)
           rows = cursor.fetchmany(self.BATCH_SIZE)
           if not rows:
-            LOG.debug("No more results for query with id %s",
-                op_handle_to_query_id(cursor._last_operation_handle))
-            return
-          for row in rows:
-            for idx, val in enumerate(row):
-              if val is None:
-                # The hash() of None can change from run to run since it's based on
-                # a memory address. A chosen value will be used instead.
-                val = 38463209
-              elif isinstance(val, float):
-                # Floats returned by Impala may not be deterministic, the ending
-                # insignificant digits may differ. Only the first 6 digits will be used
-                # after rounding.
-                sval = "%f" % val
-                dot_idx = sval.find(".")
-                val = round(val, 6 - dot_idx)
-              current_thread().result += (idx + 1) * hash(val)
-              # Modulo the result to keep it "small" otherwise the math ops can be slow
-              # since python does infinite precision math.
-              current_thread().result %= maxint
-              if result_log:
-                result_log.write(str(val))
-                result_log.write("\t")
-                result_log.write(str(current_thread().result))
-                result_log.write("\n")
+            LOG.debug("No more results for query with id %s", query_id)
+            break
+          hasher.add_rows(rows)
+          if logged_rows is not None and len(logged_rows) < self.MAX_LOGGED_ROWS:
+            logged_rows.extend(rows[:self.MAX_LOGGED_ROWS - len(logged_rows)])
+        current_thread().result = hasher.get_hash()
+        if logged_rows is not None and current_thread().result != query.result_hash:
+          self._log_result(query_id, query, current_thread().result, logged_rows)
       except Exception as e:
         current_thread().error = e
-      finally:
-        if result_log is not None:
-          result_log.close()
-          if current_thread().error is not None \
-              and current_thread().result == query.result_hash:
-            os.remove(result_log.name)
 
     hash_thread = create_and_start_daemon_thread(hash_result_impl,
         "Fetch Results %s" % query_id)
@@ -896,6 +1116,124 @@ class QueryRunner(object):
       raise hash_thread.error
     return hash_thread.result
 
+  def _log_result(self, query_id, query, result_hash, rows):
+    """Writes the first 'rows' of a result whose hash was not the expected one to a file,
+       sorted so that the files of different runs can be compared.
+    """
+    file_name = query_id.replace(":", "_") + "_results.txt"
+    path = os.path.join(self.result_hash_log_dir, file_name)
+    with open(path, "w") as result_log:
+      result_log.write(query.sql)
+      result_log.write("\nExpected hash %s, got %s\n" % (query.result_hash, result_hash))
+      if len(rows) == self.MAX_LOGGED_ROWS:
+        result_log.write("Only the first %s rows were kept\n" % self.MAX_LOGGED_ROWS)
+      for row in sorted(rows):
+        result_log.write("\t".join(str(val) for val in row))
+        result_log.write("\n")
+    LOG.warn("Result hash mismatch for query with id %s, results were written to %s",
+        query_id, path)
+
+
+class MemLimitPredictor(object):
+  """Predicts the memory that a query requires from its plan, with models fitted on the
+     runtime info of other queries. The predicted bounds are probed first when searching
+     for the mem limits of new queries, which saves most of the probes of the binary
+     search if the prediction is accurate.
+
+     The logarithm of the required memory, with and without spilling, is modeled as a
+     linear function of the plan features: the memory estimate, the largest cardinality
+     estimate and the number of operators of each type. The models are fitted with ridge
+     regression. Their error is measured with leave-one-out cross validation when they
+     are fitted, and on the queries whose mem limits are searched afterwards.
+  """
+
+  REQUIRED_MEM_FIELDS = ("required_mem_mb_with_spilling",
+      "required_mem_mb_without_spilling")
+  # The number of queries with runtime info and plan features needed to fit a model.
+  MIN_TRAINING_QUERIES = 20
+  RIDGE_PENALTY = 1.0
+  # The predicted bounds are the prediction plus or minus this many standard deviations
+  # of the cross validation error, which covers about 80% of normally distributed errors.
+  BOUNDS_NUM_STDDEVS = 1.3
+
+  def __init__(self, queries):
+    """Fits the models on the 'queries' that have plan features."""
+    # The weights of the features and the standard deviation of the error in log space,
+    # by required mem field.
+    self._models = dict()
+    # The errors of the predictions of searched queries in log space, and whether the
+    # required memory was within the bounds, by required mem field.
+    self._errors = defaultdict(list)
+    for field in self.REQUIRED_MEM_FIELDS:
+      training_queries = [query for query in queries
+          if query.plan_features and getattr(query, field)]
+      if len(training_queries) < self.MIN_TRAINING_QUERIES:
+        LOG.info("Not enough queries with plan features to predict %s: %s of %s", field,
+            len(training_queries), self.MIN_TRAINING_QUERIES)
+        continue
+      features = np.array([self._get_feature_vector(query.plan_features)
+          for query in training_queries])
+      log_mem = np.log([getattr(query, field) for query in training_queries])
+      penalty = self.RIDGE_PENALTY * np.eye(features.shape[1])
+      # The intercept is not penalized.
+      penalty[0, 0] = 0
+      inverse = np.linalg.pinv(features.T.dot(features) + penalty)
+      weights = inverse.dot(features.T).dot(log_mem)
+      # The leave-one-out errors of a linear smoother follow from its hat matrix.
+      leverages = np.einsum("ij,jk,ik->i", features, inverse, features)
+      errors = (log_mem - features.dot(weights)) / (1 - leverages)
+      stddev = float(np.sqrt(np.mean(errors ** 2)))
+      self._models[field] = (weights, stddev)
+      LOG.info("Fitted a model of %s on %s queries. Cross validation: median error %s%%,"
+          " %s%% of queries within the predicted bounds", field, len(training_queries),
+          self._format_pct(np.median(np.abs(errors))),
+          int(100 * np.mean(np.abs(errors) <= self.BOUNDS_NUM_STDDEVS * stddev)))
+
+  def predict(self, plan_features, max_mem_mb):
+    """Returns a dict with the predicted (lower bound, prediction, upper bound) of each
+       required mem field, at most 'max_mem_mb', or None if no prediction can be made.
+    """
+    if len(self._models) != len(self.REQUIRED_MEM_FIELDS) or not plan_features:
+      return None
+    features = np.array(self._get_feature_vector(plan_features))
+    prediction = dict()
+    for field, (weights, stddev) in self._models.iteritems():
+      log_mem = features.dot(weights)
+      margin = self.BOUNDS_NUM_STDDEVS * stddev
+      prediction[field] = tuple(int(min(max(np.exp(value), 1), max_mem_mb))
+          for value in (log_mem - margin, log_mem, log_mem + margin))
+    return prediction
+
+  def record(self, query, prediction):
+    """Records the error of 'prediction', made for 'query' before its mem limits were
+       searched.
+    """
+    for field, (lower_bound, predicted_mem, upper_bound) in prediction.iteritems():
+      required_mem = getattr(query, field)
+      if required_mem:
+        self._errors[field].append((np.log(required_mem) - np.log(predicted_mem),
+            lower_bound <= required_mem <= upper_bound))
+
+  def log_error_summary(self):
+    for field in self.REQUIRED_MEM_FIELDS:
+      if not self._errors[field]:
+        continue
+      errors, within_bounds = zip(*self._errors[field])
+      LOG.info("Predictions of %s for %s queries: median error %s%%, %s%% of queries"
+          " within the predicted bounds", field, len(errors),
+          self._format_pct(np.median(np.abs(errors))), int(100 * np.mean(within_bounds)))
+
+  def _get_feature_vector(self, plan_features):
+    vector = [1.0, np.log1p(plan_features["mem_estimate_mb"] or 0),
+        np.log1p(plan_features["max_cardinality"])]
+    vector.extend(plan_features["operators"].get(operator, 0)
+        for operator in PLAN_OPERATORS)
+    return vector
+
+  def _format_pct(self, log_error):
+    """Returns the relative error corresponding to an error in log space."""
+    return int(100 * (np.exp(log_error) - 1))
+
 
 def load_tpc_queries(workload):
   """Returns a list of TPC queries. 'workload' should either be 'tpch' or 'tpcds'."""
@@ -933,7 +1271,7 @@ def load_queries_from_test_file(file_path, db_name=None):
 
 def load_random_queries_and_populate_runtime_info(query_generator, model_translator,
     tables, db_name, impala, use_kerberos, query_count, query_timeout_secs,
-    result_hash_log_dir):
+    result_hash_log_dir, concurrency=1, mem_limit_predictor=None):
   """Returns a list of random queries. Each query will also have its runtime info
      populated. The runtime info population also serves to validate the query.
   """
@@ -947,35 +1285,129 @@ def load_random_queries_and_populate_runtime_info(query_generator, model_transla
       query.db_name = db_name
       yield query
   return populate_runtime_info_for_random_queries(impala, use_kerberos,
-      generate_candidates(), query_count, query_timeout_secs, result_hash_log_dir)
+      generate_candidates(), query_count, query_timeout_secs, result_hash_log_dir,
+      concurrency=concurrency, mem_limit_predictor=mem_limit_predictor)
 
 
 def populate_runtime_info_for_random_queries(impala, use_kerberos, candidate_queries,
-    query_count, query_timeout_secs, result_hash_log_dir):
+    query_count, query_timeout_secs, result_hash_log_dir, concurrency=1,
+    mem_limit_predictor=None):
   """Returns a list of random queries. Each query will also have its runtime info
      populated. The runtime info population also serves to validate the query.
   """
+  return populate_runtime_info_concurrently(candidate_queries, impala, use_kerberos,
+      result_hash_log_dir, concurrency, max_queries=query_count, ignore_errors=True,
+      timeout_secs=query_timeout_secs, mem_limit_predictor=mem_limit_predictor)
+
+
+def populate_runtime_info_concurrently(queries, impala, use_kerberos,
+    result_hash_log_dir, concurrency, max_queries=None, ignore_errors=False,
+    populated_query_handler=None, timeout_secs=maxint, samples=1,
+    max_conflicting_samples=0, mem_limit_predictor=None):
+  """Populates the runtime info of the queries from the iterable 'queries' with up to
+     'concurrency' searches at a time, see populate_runtime_info(). Returns the queries
+     that were searched, at most 'max_queries' if given. 'populated_query_handler' is
+     called with each of them as soon as it was searched, one at a time.
+
+     The searches run their queries on different impalads. Every query may use up to its
+     mem limit on each impalad, so a query is only run once its mem limit was reserved
+     from a broker with the memory of one impalad. The outcome of a run, i.e. whether
+     the query spilled or exceeded its mem limit, is then the same as if the query ran
+     alone. Runtimes may be longer because queries compete for CPU and IO.
+
+     If 'ignore_errors' is set, queries that fail are skipped, otherwise the first error
+     is raised once the running searches are done. These could be query timeouts or bad
+     queries (query generator bugs). Crashed impalads are always an error.
+  """
+  if concurrency <= 0:
+    raise Exception("Runtime info concurrency must be positive")
   start_time = datetime.now()
-  queries = list()
-  for query in candidate_queries:
+  mem_broker = MemBroker(impala.min_impalad_mem_mb, 0)
+  queries = iter(queries)
+  populated_queries = list()
+  errors = list()
+  # Protects the state above, and 'queries', which may be a generator.
+  lock = threading.Lock()
+  # The number of queries being searched, in a list so the searches can update it.
+  num_running = [0]
+
+  def get_next_query():
+    with lock:
+      if errors or (max_queries is not None
+          and len(populated_queries) + num_running[0] >= max_queries):
+        return None
+      query = next(queries, None)
+      if query is not None:
+        num_running[0] += 1
+      return query
+
+  def add_error(error):
+    with lock:
+      errors.append(error)
+
+  def search_queries(impalad):
+    # Errors are raised from the main thread, since a search thread would just exit.
     try:
-      populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
-          timeout_secs=query_timeout_secs)
-      queries.append(query)
+      runner = _create_runtime_info_runner(impalad, use_kerberos, result_hash_log_dir)
     except Exception as e:
-      # Ignore any non-fatal errors. These could be query timeouts or bad queries (
-      # query generator bugs).
-      if print_crash_info_if_exists(impala, start_time):
-        raise e
-      LOG.warn("Error running query (the test will continue)\n%s\n%s", e, query.sql,
-          exc_info=True)
-    if len(queries) == query_count:
-      break
-  return queries
+      add_error(e)
+      return
+    try:
+      while True:
+        query = get_next_query()
+        if query is None:
+          return
+        try:
+          populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
+              timeout_secs=timeout_secs, samples=samples,
+              max_conflicting_samples=max_conflicting_samples, runner=runner,
+              mem_broker=mem_broker, mem_limit_predictor=mem_limit_predictor)
+          with lock:
+            populated_queries.append(query)
+            if populated_query_handler:
+              populated_query_handler(query)
+        except Exception as e:
+          if not ignore_errors or print_crash_info_if_exists(impala, start_time):
+            add_error(e)
+            return
+          LOG.warn("Error running query (the test will continue)\n%s\n%s", e, query.sql,
+              exc_info=True)
+          # The connection may have been lost.
+          try:
+            runner.disconnect()
+            runner.connect()
+          except Exception as e:
+            add_error(e)
+            return
+        finally:
+          with lock:
+            num_running[0] -= 1
+    finally:
+      runner.disconnect()
+
+  searches = [create_and_start_daemon_thread(
+      partial(search_queries, impala.impalads[idx % len(impala.impalads)]),
+      "Runtime Info Search %s" % idx) for idx in xrange(concurrency)]
+  for search in searches:
+    search.join()
+  if errors:
+    raise errors[0]
+  return populated_queries
+
+
+def _create_runtime_info_runner(impalad, use_kerberos, result_hash_log_dir):
+  runner = QueryRunner()
+  runner.check_if_mem_was_spilled = True
+  runner.impalad = impalad
+  runner.result_hash_log_dir = result_hash_log_dir
+  runner.use_kerberos = use_kerberos
+  runner.connect()
+  return runner
 
 
 def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
-    timeout_secs=maxint, samples=1, max_conflicting_samples=0):
+    timeout_secs=maxint, samples=1, max_conflicting_samples=0, runner=None,
+    mem_broker=None, mem_limit_predictor=None):
   """Runs the given query by itself repeatedly until the minimum memory is determined
      with and without spilling. Potentially all fields in the Query class (except
      'sql') will be populated by this method. 'required_mem_mb_without_spilling' and
@@ -988,14 +1420,16 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
      to express "X out of Y runs must have resulted in the same outcome". Increasing the
      number of samples and decreasing the tolerance (max conflicts) increases confidence
      but also increases the time to collect the data.
+
+     The query is run by 'runner' if given, which must be connected and check if memory
+     was spilled, otherwise on the first impalad. If 'mem_broker' is given, the mem limit
+     of each run is reserved from it. If 'mem_limit_predictor' is given and the query has
+     no runtime info yet, the search starts from the bounds it predicts.
   """
   LOG.info("Collecting runtime info for query %s: \n%s", query.name, query.sql)
-  runner = QueryRunner()
-  runner.check_if_mem_was_spilled = True
-  runner.impalad = impala.impalads[0]
-  runner.result_hash_log_dir = result_hash_log_dir
-  runner.use_kerberos = use_kerberos
-  runner.connect()
+  if not runner:
+    runner = _create_runtime_info_runner(impala.impalads[0], use_kerberos,
+        result_hash_log_dir)
   limit_exceeded_mem = 0
   non_spill_mem = None
   spill_mem = None
@@ -1006,6 +1440,17 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
   old_required_mem_mb_without_spilling = query.required_mem_mb_without_spilling
   old_required_mem_mb_with_spilling = query.required_mem_mb_with_spilling
 
+  # The plan is only explained if there is no runtime info to start the search from.
+  # The features are then stored with the runtime info, so that they can be used to fit
+  # the models of the MemLimitPredictor later.
+  prediction = None
+  if mem_limit_predictor and not any((old_required_mem_mb_with_spilling,
+      old_required_mem_mb_without_spilling)):
+    query.plan_features = get_plan_features(query, runner)
+    prediction = mem_limit_predictor.predict(query.plan_features,
+        impala.min_impalad_mem_mb)
+    LOG.info("Predicted (lower bound, memory, upper bound): %s", prediction)
+
   # TODO: This method is complicated enough now that breaking it out into a class may be
   # helpful to understand the structure.
 
@@ -1025,7 +1470,11 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
     reports_by_outcome = defaultdict(list)
     leading_outcome = None
     for remaining_samples in xrange(samples - 1, -1, -1):
-      report = runner.run_query(query, timeout_secs, mem_limit)
+      if mem_broker:
+        with mem_broker.reserve_mem_mb(min(mem_limit, mem_broker.total_mem_mb)):
+          report = runner.run_query(query, timeout_secs, mem_limit)
+      else:
+        report = runner.run_query(query, timeout_secs, mem_limit)
       if report.timed_out:
         raise QueryTimeout()
       if report.non_mem_limit_error:
@@ -1063,8 +1512,30 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
     reports.sort(key=lambda r: r.runtime_secs)
     return reports[len(reports) / 2]
 
-  if not any((old_required_mem_mb_with_spilling, old_required_mem_mb_without_spilling)):
+  def get_first_mem_limits(old_required_mem, field):
+    """Returns the mem limits to try before bisecting: the previous required memory, or
+       the predicted upper and lower bounds.
+    """
+    if old_required_mem:
+      return [old_required_mem]
+    if prediction:
+      lower_bound, _, upper_bound = prediction[field]
+      return [upper_bound, lower_bound]
+    return list()
+
+  def get_next_mem_limit(first_mem_limits, lower_bound, upper_bound):
+    # A mem limit outside of the bounds would not narrow them.
+    while first_mem_limits \
+        and not lower_bound < first_mem_limits[0] <= upper_bound:
+      first_mem_limits.pop(0)
+    if first_mem_limits:
+      return first_mem_limits.pop(0)
+    return (lower_bound + upper_bound) / 2
+
+  if not prediction and not any((old_required_mem_mb_with_spilling,
+      old_required_mem_mb_without_spilling)):
     mem_estimate = estimate_query_mem_mb_usage(query, runner)
+    query.plan_features = get_plan_features(query, runner)
     LOG.info("Finding a starting point for binary search")
     mem_limit = min(mem_estimate, impala.min_impalad_mem_mb) or impala.min_impalad_mem_mb
     while True:
@@ -1088,14 +1559,14 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
   LOG.info("Finding minimum memory required to avoid spilling")
   lower_bound = max(limit_exceeded_mem, spill_mem)
   upper_bound = min(non_spill_mem or maxint, impala.min_impalad_mem_mb)
+  first_mem_limits = get_first_mem_limits(old_required_mem_mb_without_spilling,
+      "required_mem_mb_without_spilling")
   while True:
-    if old_required_mem_mb_without_spilling:
-      mem_limit = old_required_mem_mb_without_spilling
-      old_required_mem_mb_without_spilling = None
-    else:
-      mem_limit = (lower_bound + upper_bound) / 2
-    should_break = mem_limit / float(upper_bound) > MEM_LIMIT_EQ_THRESHOLD_PC \
-            or upper_bound - mem_limit < MEM_LIMIT_EQ_THRESHOLD_MB
+    mem_limit = get_next_mem_limit(first_mem_limits, lower_bound, upper_bound)
+    # The search does not end before the first mem limits were tried.
+    should_break = not first_mem_limits \
+        and (mem_limit / float(upper_bound) > MEM_LIMIT_EQ_THRESHOLD_PC
+            or upper_bound - mem_limit < MEM_LIMIT_EQ_THRESHOLD_MB)
     report = get_report(desired_outcome=("NOT_SPILLED" if spill_mem else None))
     if not report:
       lower_bound = mem_limit
@@ -1110,7 +1581,7 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
       else:
         upper_bound = mem_limit
         non_spill_mem = mem_limit
-    if mem_limit == impala.min_impalad_mem_mb:
+    if mem_limit == impala.min_impalad_mem_mb and not first_mem_limits:
       break
     if should_break:
       if non_spill_mem:
@@ -1124,14 +1595,13 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
   lower_bound = limit_exceeded_mem
   upper_bound = min(spill_mem or maxint, non_spill_mem or maxint,
       impala.min_impalad_mem_mb)
+  first_mem_limits = get_first_mem_limits(old_required_mem_mb_with_spilling,
+      "required_mem_mb_with_spilling")
   while True:
-    if old_required_mem_mb_with_spilling:
-      mem_limit = old_required_mem_mb_with_spilling
-      old_required_mem_mb_with_spilling = None
-    else:
-      mem_limit = (lower_bound + upper_bound) / 2
-    should_break = mem_limit / float(upper_bound) > MEM_LIMIT_EQ_THRESHOLD_PC \
-        or upper_bound - mem_limit < MEM_LIMIT_EQ_THRESHOLD_MB
+    mem_limit = get_next_mem_limit(first_mem_limits, lower_bound, upper_bound)
+    should_break = not first_mem_limits \
+        and (mem_limit / float(upper_bound) > MEM_LIMIT_EQ_THRESHOLD_PC
+            or upper_bound - mem_limit < MEM_LIMIT_EQ_THRESHOLD_MB)
     report = get_report(desired_outcome="SPILLED")
     if not report or report.mem_limit_exceeded:
       lower_bound = mem_limit
@@ -1154,86 +1624,200 @@ def populate_runtime_info(query, impala, use_kerberos, result_hash_log_dir,
         " the absolute minimum memory.")
     query.required_mem_mb_with_spilling = query.required_mem_mb_without_spilling
     query.solo_runtime_secs_with_spilling = query.solo_runtime_secs_without_spilling
+  if prediction:
+    mem_limit_predictor.record(query, prediction)
   LOG.debug("Query after populating runtime info: %s", query)
 
 
+# The plan features of the queries by db name and sql, which are shared by concurrent
+# runtime info searches.
+_plan_features = dict()
+_plan_features_lock = threading.Lock()
+
+
 def estimate_query_mem_mb_usage(query, query_runner):
   """Runs an explain plan then extracts and returns the estimated memory needed to run
      the query.
   """
+  return get_plan_features(query, query_runner)["mem_estimate_mb"]
+
+
+def get_plan_features(query, query_runner):
+  """Returns a dict with the estimated memory needed to run the query, the largest
+     cardinality estimate and the number of operators of each type in its plan. The
+     features of each query are only computed once.
+  """
+  key = (query.db_name, query.sql)
+  with _plan_features_lock:
+    if key in _plan_features:
+      return _plan_features[key]
+  plan_features = _explain_plan_features(query, query_runner)
+  with _plan_features_lock:
+    _plan_features[key] = plan_features
+  return plan_features
+
+
+def _explain_plan_features(query, query_runner):
   with query_runner.impalad_conn.cursor() as cursor:
     LOG.debug("Using %s database", query.db_name)
     if query.db_name:
       cursor.execute('USE ' + query.db_name)
     LOG.debug("Explaining query\n%s", query.sql)
-    cursor.execute('EXPLAIN ' + query.sql)
-    first_val = cursor.fetchone()[0]
-    regex_result = MEM_ESTIMATE_PATTERN.search(first_val)
-    if not regex_result:
-      return
+    # The cardinality estimates are only part of extended plans.
+    cursor.execute('SET EXPLAIN_LEVEL=2')
+    try:
+      cursor.execute('EXPLAIN ' + query.sql)
+      plan = "\n".join(str(row[0]) for row in cursor.fetchall())
+    finally:
+      # The session of the runner is reused to run the query.
+      cursor.execute('SET EXPLAIN_LEVEL=%s' % DEFAULT_EXPLAIN_LEVEL)
+  plan_features = {"mem_estimate_mb": None, "max_cardinality": 0, "operators": dict()}
+  regex_result = MEM_ESTIMATE_PATTERN.search(plan)
+  if regex_result:
     mem_limit, units = regex_result.groups()
-    return parse_mem_to_mb(mem_limit, units)
+    plan_features["mem_estimate_mb"] = parse_mem_to_mb(mem_limit, units)
+  plan_features["max_cardinality"] = max(
+      [int(cardinality) for cardinality in PLAN_CARDINALITY_PATTERN.findall(plan)] or [0])
+  operators = plan_features["operators"]
+  for operator in PLAN_OPERATOR_PATTERN.findall(plan):
+    if operator in PLAN_OPERATORS:
+      operators[operator] = operators.get(operator, 0) + 1
+  return plan_features
 
 
 def save_runtime_info(path, query, impala):
-  """Updates the file at 'path' with the given query information."""
-  store = None
-  if os.path.exists(path):
-    with open(path) as file:
-      store = json.load(file)
-    _check_store_version(store)
-  if not store:
-    store = {"host_names": list(), "db_names": dict(),
-        "version": RUNTIME_INFO_FILE_VERSION}
-  with open(path, "w+") as file:
-    store["host_names"] = sorted([i.host_name for i in impala.impalads])
-    queries = store["db_names"].get(query.db_name, dict())
-    queries[query.sql] = query
-    store["db_names"][query.db_name] = queries
-    class JsonEncoder(json.JSONEncoder):
-      def default(self, obj):
-        data = dict(obj.__dict__)
-        # Queries are stored by sql, so remove the duplicate data.
-        if "sql" in data:
-          del data["sql"]
-        return data
-    json.dump(store, file, cls=JsonEncoder, sort_keys=True, indent=2,
-        separators=(',', ': '))
+  """Adds or replaces the information of 'query' in the store at 'path'. Only the row of
+     the query is written, so this does not depend on the size of the store, and several
+     processes may update the same store.
+  """
+  cluster = _get_cluster_fingerprint([i.host_name for i in impala.impalads])
+  data = dict(query.__dict__)
+  # The sql is stored in a column of its own.
+  del data["sql"]
+  with _open_runtime_info_store(path) as conn:
+    conn.execute("INSERT OR REPLACE INTO runtime_info"
+        " (cluster, query_hash, db_name, sql, info) VALUES (?, ?, ?, ?, ?)",
+        (cluster, _get_query_hash(query.db_name, query.sql), query.db_name, query.sql,
+        json.dumps(data, sort_keys=True)))
 
 
 def load_runtime_info(path, impala=None):
   """Reads the query runtime information at 'path' and returns a
-     dict<db_name, dict<sql, Query>>. Returns an empty dict if the hosts in the 'impala'
-     instance do not match the data in 'path'.
+     dict<db_name, dict<sql, Query>>. If 'impala' is given, only the information collected
+     on a cluster with the same hosts is returned.
   """
   queries_by_db_and_sql = defaultdict(dict)
-  if not os.path.exists(path):
+  if not os.path.exists(path) and not os.path.exists(_get_json_runtime_info_path(path)):
     return queries_by_db_and_sql
-  with open(path) as file:
-    store = json.load(file)
-    _check_store_version(store)
-    if impala and \
-        store.get("host_names") != sorted([i.host_name for i in impala.impalads]):
-      return queries_by_db_and_sql
-    for db_name, queries_by_sql in store["db_names"].iteritems():
-      for sql, json_query in queries_by_sql.iteritems():
-        query = Query()
-        query.__dict__.update(json_query)
-        query.sql = sql
-        queries_by_db_and_sql[db_name][sql] = query
+  with _open_runtime_info_store(path) as conn:
+    if impala:
+      cluster = _get_cluster_fingerprint([i.host_name for i in impala.impalads])
+      rows = conn.execute("SELECT db_name, sql, info FROM runtime_info WHERE cluster = ?",
+          (cluster, ))
+    else:
+      rows = conn.execute("SELECT db_name, sql, info FROM runtime_info")
+    for db_name, sql, info in rows:
+      query = Query()
+      query.__dict__.update(json.loads(info))
+      query.sql = sql
+      queries_by_db_and_sql[db_name][sql] = query
   return queries_by_db_and_sql
 
 
-def _check_store_version(store):
-  """Clears 'store' if the version is too old or raises an error if the version is too
-     new.
+def _get_cluster_fingerprint(host_names):
+  """Returns a key for the runtime info collected on the cluster with the impalads
+     'host_names', which changes if the impalads of the cluster change.
   """
-  if store["version"] < RUNTIME_INFO_FILE_VERSION:
-    LOG.warn("Runtime file info version is old and will be ignored")
-    store.clear()
-  elif store["version"] > RUNTIME_INFO_FILE_VERSION:
+  return sha1(",".join(sorted(host_names))).hexdigest()
+
+
+def _get_query_hash(db_name, sql):
+  return sha1(json.dumps([db_name, sql])).hexdigest()
+
+
+def _get_json_runtime_info_path(path):
+  """Returns the path where older versions stored the runtime info of 'path'."""
+  return os.path.splitext(path)[0] + ".json"
+
+
+@contextmanager
+def _open_runtime_info_store(path):
+  """Opens the runtime info store at 'path', creating or migrating it as needed. The
+     changes made in the 'with' block are committed when it exits.
+  """
+  json_path = None
+  if os.path.exists(path):
+    with open(path, "rb") as file:
+      if file.read(1) == "{":
+        # The store is still a JSON file. It is kept next to the new store.
+        json_path = path + ".bak"
+        os.rename(path, json_path)
+  elif path != _get_json_runtime_info_path(path) \
+      and os.path.exists(_get_json_runtime_info_path(path)):
+    json_path = _get_json_runtime_info_path(path)
+  # Other processes may be updating the store, writes wait up to the timeout for them.
+  conn = sqlite3.connect(path, timeout=600)
+  try:
+    _migrate_runtime_info_store(conn, json_path)
+    with conn:
+      yield conn
+  finally:
+    conn.close()
+
+
+def _migrate_runtime_info_store(conn, json_path):
+  """Creates the tables of a new store or upgrades an older store to
+     RUNTIME_INFO_FILE_VERSION. The runtime info from the JSON file at 'json_path', if
+     given, is imported into a new store.
+  """
+  version = conn.execute("PRAGMA user_version").fetchone()[0]
+  if version == RUNTIME_INFO_FILE_VERSION:
+    return
+  if version > RUNTIME_INFO_FILE_VERSION:
     raise Exception("Unexpected runtime file info version %s expected %s"
-        % (store["version"], RUNTIME_INFO_FILE_VERSION))
+        % (version, RUNTIME_INFO_FILE_VERSION))
+  # The transaction is managed here since the sqlite3 module would commit before the
+  # CREATE TABLE. It takes the write lock, so that only one process migrates the store.
+  conn.isolation_level = None
+  conn.execute("BEGIN EXCLUSIVE")
+  try:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < RUNTIME_INFO_FILE_VERSION:
+      if version:
+        LOG.warn("Runtime file info version is old and will be ignored")
+        conn.execute("DROP TABLE IF EXISTS runtime_info")
+      conn.execute("CREATE TABLE runtime_info ("
+          " cluster TEXT NOT NULL,"
+          " query_hash TEXT NOT NULL,"
+          " db_name TEXT,"
+          " sql TEXT NOT NULL,"
+          " info TEXT NOT NULL,"
+          " PRIMARY KEY (cluster, query_hash))")
+      if json_path:
+        _import_json_runtime_info(conn, json_path)
+      conn.execute("PRAGMA user_version = %s" % RUNTIME_INFO_FILE_VERSION)
+    conn.execute("COMMIT")
+  except Exception:
+    conn.execute("ROLLBACK")
+    raise
+  finally:
+    conn.isolation_level = ""
+
+
+def _import_json_runtime_info(conn, json_path):
+  with open(json_path) as file:
+    store = json.load(file)
+  if store["version"] != LAST_JSON_RUNTIME_INFO_FILE_VERSION:
+    LOG.warn("Runtime file info version is old and will be ignored")
+    return
+  LOG.info("Importing runtime info from %s", json_path)
+  cluster = _get_cluster_fingerprint(store["host_names"])
+  for db_name, queries_by_sql in store["db_names"].iteritems():
+    for sql, data in queries_by_sql.iteritems():
+      conn.execute("INSERT OR REPLACE INTO runtime_info"
+          " (cluster, query_hash, db_name, sql, info) VALUES (?, ?, ?, ?, ?)",
+          (cluster, _get_query_hash(db_name, sql), db_name, sql,
+          json.dumps(data, sort_keys=True)))
 
 
 def print_runtime_info_comparison(old_runtime_info, new_runtime_info):
@@ -1298,9 +1882,19 @@ def main():
   cli_options.add_cluster_options(parser)
   cli_options.add_kerberos_options(parser)
   parser.add_argument("--runtime-info-path",
-      default=os.path.join(gettempdir(), "{cm_host}_query_runtime_info.json"),
+      default=os.path.join(gettempdir(), "{cm_host}_query_runtime_info.db"),
       help="The path to store query runtime info at. '{cm_host}' will be replaced with"
-      " the actual host name from --cm-host.")
+      " the actual host name from --cm-host. The info is stored in a SQLite database,"
+      " a JSON file written by older versions is imported.")
+  parser.add_argument("--runtime-info-concurrency", default=1, type=int,
+      help="The number of queries whose runtime info is collected at the same time."
+      " Concurrent queries run on different impalads and their mem limits add up to at"
+      " most the memory of an impalad, so that they do not affect whether other"
+      " queries spill. Their runtimes may be longer than when run alone though.")
+  parser.add_argument("--no-mem-limit-model", action="store_true",
+      help="Do not predict the memory needed by queries without runtime info from the"
+      " runtime info of other queries. The predictions only make collecting runtime info"
+      " faster, the collected info does not depend on them.")
   parser.add_argument("--samples", default=1, type=int,
       help='Used when collecting "runtime info" - the number of samples to collect when'
       ' testing a particular mem limit value.')
@@ -1324,6 +1918,14 @@ def main():
       help="Adjust this depending on the cluster size and workload. This determines"
       " the minimum amount of time between successive query submissions when"
       " the workload is initially ramping up.")
+  parser.add_argument("--sessions-per-runner", type=int, default=1,
+      help="The number of sessions that each query runner process uses to run queries"
+      " concurrently. Increase this to run many concurrent queries with fewer processes"
+      " on the client host.")
+  parser.add_argument("--hash-processes", type=int, default=0,
+      help="If positive, the results of queries are hashed by this many processes"
+      " instead of by the query runner processes. This is useful with many sessions per"
+      " runner.")
   parser.add_argument("--fail-upon-successive-errors", type=int, default=1,
       help="Continue running until N query errors are encountered in a row. Set"
       " this to a high number to only stop when something catastrophic happens. A"
@@ -1430,6 +2032,11 @@ def main():
   if "{cm_host}" in runtime_info_path:
     runtime_info_path = runtime_info_path.format(cm_host=args.cm_host)
   queries_with_runtime_info_by_db_and_sql = load_runtime_info(runtime_info_path, impala)
+  mem_limit_predictor = None
+  if not args.no_mem_limit_model:
+    mem_limit_predictor = MemLimitPredictor([query
+        for queries_by_sql in queries_with_runtime_info_by_db_and_sql.itervalues()
+        for query in queries_by_sql.itervalues()])
 
   # Start loading the test queries.
   queries = list()
@@ -1451,6 +2058,7 @@ def main():
     for query in tpch_nested_queries:
       query.db_name = args.tpch_nested_db
     queries.extend(tpch_nested_queries)
+  queries_without_runtime_info = list()
   for idx in xrange(len(queries) - 1, -1, -1):
     query = queries[idx]
     if query.sql in queries_with_runtime_info_by_db_and_sql[query.db_name]:
@@ -1458,9 +2066,13 @@ def main():
       LOG.debug("Reusing previous runtime data for query: " + query.sql)
       queries[idx] = query
     else:
-      populate_runtime_info(query, impala, args.use_kerberos, args.result_hash_log_dir,
-          samples=args.samples, max_conflicting_samples=args.max_conflicting_samples)
-      save_runtime_info(runtime_info_path, query, impala)
+      queries_without_runtime_info.append(query)
+  populate_runtime_info_concurrently(queries_without_runtime_info, impala,
+      args.use_kerberos, args.result_hash_log_dir, args.runtime_info_concurrency,
+      populated_query_handler=partial(save_runtime_info, runtime_info_path,
+      impala=impala),
+      samples=args.samples, max_conflicting_samples=args.max_conflicting_samples,
+      mem_limit_predictor=mem_limit_predictor)
 
   # A particular random query may either fail (due to a generator or Impala bug) or
   # take a really long time to complete. So the queries needs to be validated. Since the
@@ -1472,7 +2084,8 @@ def main():
     queries.extend(load_random_queries_and_populate_runtime_info(query_generator,
         SqlWriter.create(), tables, args.random_db, impala, args.use_kerberos,
         args.random_query_count, args.random_query_timeout_seconds,
-        args.result_hash_log_dir))
+        args.result_hash_log_dir, concurrency=args.runtime_info_concurrency,
+        mem_limit_predictor=mem_limit_predictor))
 
   if args.query_file_path:
     file_queries = load_queries_from_test_file(args.query_file_path,
@@ -1480,7 +2093,11 @@ def main():
     shuffle(file_queries)
     queries.extend(populate_runtime_info_for_random_queries(impala, args.use_kerberos,
         file_queries, args.random_query_count, args.random_query_timeout_seconds,
-        args.result_hash_log_dir))
+        args.result_hash_log_dir, concurrency=args.runtime_info_concurrency,
+        mem_limit_predictor=mem_limit_predictor))
+
+  if mem_limit_predictor:
+    mem_limit_predictor.log_error_summary()
 
   # Apply tweaks to the query's runtime info as requested by CLI options.
   for idx in xrange(len(queries) - 1, -1, -1):
@@ -1535,6 +2152,8 @@ def main():
   stress_runner.startup_queries_per_sec = args.startup_queries_per_second
   stress_runner.num_successive_errors_needed_to_abort = args.fail_upon_successive_errors
   stress_runner.use_kerberos = args.use_kerberos
+  stress_runner.sessions_per_runner = args.sessions_per_runner
+  stress_runner.num_hash_processes = args.hash_processes
   stress_runner.cancel_probability = args.cancel_probability
   stress_runner.spill_probability = args.spill_probability
   stress_runner.leak_check_interval_mins = args.mem_leak_check_interval_mins